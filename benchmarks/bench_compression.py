@@ -0,0 +1,140 @@
+"""
+响应压缩基准：SSE 流与 JSON 响应在不同压缩级别下的线上字节数与额外 CPU
+- 流：按 token 推送的 think/plain_text 帧、一帧图片、一帧知识图谱（真实三元组构建的 ECharts option）
+- 逐帧：FrameCompressor（每帧 Z_SYNC_FLUSH，即中间件实际行为）；整体：整个响应一次性 gzip，作为压缩率上限
+- 中间件：经 StreamingCompressionMiddleware 发送整条流与不经过中间件的耗时差，即每个流额外的 CPU
+
+用法（项目根目录）：
+    python benchmarks/bench_compression.py --tokens 400 --levels 1,5,9 --output compression.json
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+
+from middlewares.stream_registry import format_event
+from middlewares.compression import FrameCompressor, StreamingCompressionMiddleware
+
+SAMPLE_ANSWER = ("CIR设备开机后无法登录，应首先检查电源板输出电压是否正常，再确认主控单元与MMI之间的连接线缆。"
+                 "若电台显示“通信故障”，可按照维修手册依次更换记录单元、GPS天线及450MHz电台模块。")
+
+
+def synthetic_graph(keyword: str) -> str:
+    nodes = [{"name": f"{keyword}部件{i}", "category": i % 4, "symbolSize": 20} for i in range(60)]
+    links = [{"source": f"{keyword}部件{i // 2}", "target": f"{keyword}部件{i}", "value": "包含"}
+             for i in range(1, 60)]
+    return json.dumps({"title": {"text": keyword}, "series": [{"type": "graph", "layout": "force",
+                                                               "data": nodes, "links": links}]}, ensure_ascii=False)
+
+
+def build_stream(tokens: int, builder, keyword: str) -> tuple[list[bytes], bytes]:
+    """
+    返回 (SSE 帧列表, 三元组 JSON 响应体)
+    """
+    items = [("think", SAMPLE_ANSWER[i % len(SAMPLE_ANSWER)] * 2) for i in range(tokens // 4)]
+    items += [("plain_text", SAMPLE_ANSWER[i % len(SAMPLE_ANSWER):i % len(SAMPLE_ANSWER) + 3]) for i in range(tokens)]
+    images = [{"url": f"/api/qa/images/{keyword}_{i}.jpg", "score": round(0.9 - i * 0.05, 2)} for i in range(6)]
+    items.insert(len(items) // 2, ("images", json.dumps(images, ensure_ascii=False)))
+    if builder is not None:
+        records = builder.extract_relevant_records(keyword, top_k=200)
+        graph = builder.build_graphs(records, keyword)
+    else:
+        records = [{"head": f"{keyword}", "relation": "包含", "tail": f"{keyword}部件{i}"} for i in range(200)]
+        graph = synthetic_graph(keyword)
+    items.append(("echarts", graph))
+    items.append(("end", ""))
+    frames = [frame.encode("utf-8") for frame in map(format_event, items) if frame]
+    return frames, json.dumps({"records": records}, ensure_ascii=False).encode("utf-8")
+
+
+def measure_frames(frames: list[bytes], level: int, repeat: int) -> dict:
+    timings, wire = [], 0
+    for _ in range(repeat):
+        compressor = FrameCompressor(level)
+        start = time.perf_counter()
+        wire = sum(len(compressor.compress(frame)) for frame in frames[:-1]) + len(compressor.finish(frames[-1]))
+        timings.append(time.perf_counter() - start)
+    raw = sum(len(frame) for frame in frames)
+    whole = len(gzip.compress(b"".join(frames), compresslevel=level))
+    return {"level": level, "frames": len(frames), "raw_bytes": raw, "per_frame_bytes": wire,
+            "whole_body_bytes": whole, "per_frame_ratio": round(wire / raw, 4),
+            "cpu_us_per_frame": round(min(timings) / len(frames) * 1e6, 2),
+            "cpu_ms_per_stream": round(min(timings) * 1000, 3)}
+
+
+def measure_json(body: bytes, level: int, repeat: int) -> dict:
+    timings, wire = [], 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        wire = len(FrameCompressor(level).finish(body))
+        timings.append(time.perf_counter() - start)
+    return {"level": level, "raw_bytes": len(body), "wire_bytes": wire, "ratio": round(wire / len(body), 4),
+            "cpu_ms": round(min(timings) * 1000, 3)}
+
+
+async def measure_middleware(frames: list[bytes], level: int, repeat: int) -> dict:
+    async def sse_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8")]})
+        for frame in frames:
+            await send({"type": "http.response.body", "body": frame, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def discard(message):
+        pass
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", b"gzip, deflate")]}
+    wrapped = StreamingCompressionMiddleware(sse_app, level=level)
+
+    async def run(app) -> float:
+        start = time.perf_counter()
+        await app(scope, receive, discard)
+        return time.perf_counter() - start
+
+    baseline = min([await run(sse_app) for _ in range(repeat)])
+    compressed = min([await run(wrapped) for _ in range(repeat)])
+    return {"level": level, "baseline_ms": round(baseline * 1000, 3), "compressed_ms": round(compressed * 1000, 3),
+            "added_ms_per_stream": round((compressed - baseline) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=400, help="每个流的 plain_text token 帧数")
+    parser.add_argument("--levels", default="1,5,9", help="压缩级别，逗号分隔")
+    parser.add_argument("--keyword", default="CIR设备", help="知识图谱与三元组的关键字")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    builder = None
+    if os.getenv("TRIPLETS_PATH") and os.path.exists(os.getenv("TRIPLETS_PATH")):
+        from middlewares.knowledge_builder import KnowledgeGraphBuilder
+        builder = KnowledgeGraphBuilder()
+    frames, triples_body = build_stream(args.tokens, builder, args.keyword)
+
+    results = {"sse": [], "json": [], "middleware": []}
+    for level in [int(n) for n in args.levels.split(",") if n]:
+        results["sse"].append(measure_frames(frames, level, args.repeat))
+        results["json"].append(measure_json(triples_body, level, args.repeat))
+        results["middleware"].append(asyncio.run(measure_middleware(frames, level, args.repeat)))
+        for kind in results:
+            print(json.dumps({"kind": kind, **results[kind][-1]}, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
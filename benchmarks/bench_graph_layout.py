@@ -0,0 +1,102 @@
+"""
+服务端图布局基准：不同节点数下力导向布局的耗时、布局质量与输出体积
+- 图：真实三元组中按关键字抽取的子图，以及节点数更大的合成图（每个节点挂在较早节点上，另加少量随机边）
+- 质量：最近节点对距离、边长中位数（相对坐标范围）
+- 体积：client（force）与 server（layout=none + 坐标）两种 ECharts option 的字节数
+
+用法（项目根目录）：
+    python benchmarks/bench_graph_layout.py --sizes 50,200,500 --keywords CIR设备,机车电台
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+
+import numpy as np
+from middlewares.graph_layout import force_layout, _layout_positions
+
+
+def synthetic_records(node_count: int, extra_edges: float, seed: int) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    records = [{"head": f"节点{rng.integers(0, i)}", "relation": "包含", "tail": f"节点{i}"}
+               for i in range(1, node_count)]
+    for _ in range(int(node_count * extra_edges)):
+        head, tail = rng.integers(0, node_count, 2)
+        records.append({"head": f"节点{head}", "relation": "关联", "tail": f"节点{tail}"})
+    return records
+
+
+def layout_quality(positions: dict, records: list[dict], size: float) -> dict:
+    coordinates = np.array(list(positions.values()), dtype=np.float64)
+    delta = coordinates[:, None, :] - coordinates[None, :, :]
+    distance = np.sqrt((delta ** 2).sum(-1))
+    np.fill_diagonal(distance, np.inf)
+    edge_lengths = [np.hypot(*np.subtract(positions[r["head"]], positions[r["tail"]])) for r in records
+                    if r["head"] != r["tail"]]
+    return {
+        "min_node_distance": round(float(distance.min()) / size, 4),
+        "median_edge_length": round(float(np.median(edge_lengths)) / size, 4) if edge_lengths else 0.0,
+    }
+
+
+def measure(name: str, records: list[dict], builder, iterations: int, size: float, repeat: int) -> dict:
+    nodes = sorted({node for r in records for node in (r["head"], r["tail"])})
+    edges = sorted({(r["head"], r["tail"]) for r in records})
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        positions = _layout_positions(nodes, edges, iterations, size)
+        timings.append(time.perf_counter() - start)
+    result = {"graph": name, "nodes": len(nodes), "edges": len(edges),
+              "layout_ms": round(min(timings) * 1000, 2), **layout_quality(positions, records, size)}
+    if builder is not None:
+        result["client_bytes"] = len(builder.build_graphs(records, name))
+        result["server_bytes"] = len(builder.build_graphs(records, name, positions))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="50,200,500", help="合成图节点数")
+    parser.add_argument("--extra-edges", type=float, default=0.3, help="合成图额外随机边与节点数之比")
+    parser.add_argument("--keywords", default="CIR设备,机车电台,列尾", help="真实子图的关键字，逗号分隔")
+    parser.add_argument("--top-k", type=int, default=200, help="每个关键字抽取的三元组数")
+    parser.add_argument("--iterations", type=int, default=int(os.getenv("GRAPH_LAYOUT_ITERATIONS", 200)))
+    parser.add_argument("--size", type=float, default=float(os.getenv("GRAPH_LAYOUT_SIZE", 1000)))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    builder = None
+    if os.getenv("TRIPLETS_PATH") and os.path.exists(os.getenv("TRIPLETS_PATH")):
+        from middlewares.knowledge_builder import KnowledgeGraphBuilder
+        builder = KnowledgeGraphBuilder()
+
+    results = []
+    if builder is not None:
+        for keyword in [k for k in args.keywords.split(",") if k]:
+            records = builder.extract_relevant_records(keyword, top_k=args.top_k)
+            if records:
+                results.append(measure(f"triples:{keyword}", records, builder, args.iterations, args.size,
+                                       args.repeat))
+                print(json.dumps(results[-1], ensure_ascii=False))
+    for node_count in [int(n) for n in args.sizes.split(",") if n]:
+        records = synthetic_records(node_count, args.extra_edges, args.seed)
+        results.append(measure(f"synthetic:{node_count}", records, builder, args.iterations, args.size,
+                               args.repeat))
+        print(json.dumps(results[-1], ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+图片检索打分基准（不调用 embedding 接口）：
+- legacy：旧实现，逐个查询求平均向量后 np.dot + 全量 argsort
+- mean / max / rrf：score_queries 计算 (查询数 × 图片数) 得分矩阵后用 fuse_scores 融合
+
+合成数据：图片向量按簇生成（同簇图片彼此相似，模拟真实 embedding 的高基线相似度），
+每次检索的多个查询改写分别指向不同的目标图片，统计目标图片在 top_k 中的召回率。两种场景：
+- same_cluster：目标在同一簇内（改写表达同一意图）
+- cross_cluster：目标分属不同簇（改写覆盖问题的不同方面，平均向量会落在簇之间）
+
+用法（项目根目录）：
+    python benchmarks/bench_image_search.py --sizes 1000,10000,100000 --queries 3 --top-k 3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from middlewares.image_searcher import fuse_scores, score_queries
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+
+def make_library(size: int, dim: int, cluster_size: int, spread: float, rng) -> np.ndarray:
+    centers = rng.standard_normal((max(size // cluster_size, 1), dim), dtype=np.float32)
+    assignment = rng.integers(0, len(centers), size)
+    noise = rng.standard_normal((size, dim), dtype=np.float32) * spread
+    return normalize(centers[assignment] + noise).astype(np.float32), assignment
+
+
+def make_queries(embeddings: np.ndarray, assignment: np.ndarray, queries: int, noise: float,
+                 scenario: str, rng):
+    """
+    选取 queries 张目标图片，每个查询改写 = 目标向量 + 噪声
+    """
+    if scenario == "same_cluster":
+        cluster = assignment[rng.integers(0, len(assignment))]
+        members = np.flatnonzero(assignment == cluster)
+        targets = rng.choice(members, size=min(queries, len(members)), replace=False)
+    else:
+        targets = rng.choice(len(embeddings), size=queries, replace=False)
+    vectors = embeddings[targets] + rng.standard_normal((len(targets), embeddings.shape[1]),
+                                                        dtype=np.float32) * noise / np.sqrt(embeddings.shape[1])
+    return normalize(vectors).astype(np.float32), set(targets.tolist())
+
+
+def legacy_search(embeddings: np.ndarray, query_vectors: np.ndarray, top_k: int) -> np.ndarray:
+    query_embeddings = []
+    for emb in query_vectors:
+        emb = emb / np.linalg.norm(emb)
+        query_embeddings.append(emb)
+    query_vec = np.mean(query_embeddings, axis=0)
+    scores = np.dot(embeddings, query_vec)
+    return np.argsort(scores)[::-1][:top_k]
+
+
+def fused_search(embeddings: np.ndarray, query_vectors: np.ndarray, top_k: int, fusion: str) -> np.ndarray:
+    score_matrix = score_queries(embeddings, query_vectors)
+    indices, _, _ = fuse_scores(score_matrix, fusion, top_k)
+    return indices
+
+
+def run(size: int, args, rng) -> dict:
+    embeddings, assignment = make_library(size, args.dim, args.cluster_size, args.spread, rng)
+    methods = {
+        "legacy": lambda q: legacy_search(embeddings, q, args.top_k),
+        "mean": lambda q: fused_search(embeddings, q, args.top_k, "mean"),
+        "max": lambda q: fused_search(embeddings, q, args.top_k, "max"),
+        "rrf": lambda q: fused_search(embeddings, q, args.top_k, "rrf"),
+    }
+    report = {"images": size, "matrix_mb": round(embeddings.nbytes / 1024 / 1024, 1)}
+    for scenario in ("same_cluster", "cross_cluster"):
+        trials = [make_queries(embeddings, assignment, args.queries, args.noise, scenario, rng)
+                  for _ in range(args.trials)]
+        report[scenario] = {}
+        for name, method in methods.items():
+            hits, total, timings = 0, 0, []
+            for query_vectors, targets in trials:
+                start = time.perf_counter()
+                indices = method(query_vectors)
+                timings.append(time.perf_counter() - start)
+                hits += len(targets & set(indices.tolist()))
+                total += len(targets)
+            timings.sort()
+            report[scenario][name] = {
+                "recall": round(hits / total, 4),
+                "p50_ms": round(timings[len(timings) // 2] * 1000, 3),
+                "p95_ms": round(timings[max(int(len(timings) * 0.95) - 1, 0)] * 1000, 3),
+            }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=3, help="每次检索的查询改写数")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--trials", type=int, default=50)
+    parser.add_argument("--cluster-size", type=int, default=20)
+    parser.add_argument("--spread", type=float, default=0.08, help="簇内离散度（相对簇中心）")
+    parser.add_argument("--noise", type=float, default=1.0, help="查询改写相对目标向量的噪声")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = [run(int(size), args, rng) for size in args.sizes.split(",")]
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+图片服务吞吐基准：对比旧实现（isfile + FileResponse）与 StaticImageServer
+
+用法（项目根目录）：
+    python benchmarks/bench_image_serving.py --requests 2000 --concurrency 32
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import httpx
+from fastapi import FastAPI, HTTPException, Path, Request
+from fastapi.responses import FileResponse
+from middlewares.image_server import StaticImageServer
+
+
+def build_app(image_dir: str) -> FastAPI:
+    app = FastAPI()
+    image_server = StaticImageServer(image_dir)
+
+    @app.get("/legacy/{filename:path}")
+    async def legacy(filename: str = Path(...)):
+        file_path = os.path.join(image_dir, filename)
+        if not os.path.isfile(file_path):
+            raise HTTPException(status_code=404, detail="File not found")
+        return FileResponse(file_path)
+
+    @app.get("/current/{filename:path}")
+    async def current(request: Request, filename: str = Path(...)):
+        return await image_server.serve(filename, request.headers)
+
+    return app
+
+
+async def run_case(client: httpx.AsyncClient, prefix: str, filenames: list[str],
+                   total: int, concurrency: int, revalidate: bool) -> dict:
+    etags = {}
+    if revalidate:
+        for name in filenames:
+            resp = await client.get(f"/{prefix}/{name}")
+            etags[name] = resp.headers.get("etag")
+
+    counter = iter(range(total))
+    transferred = 0
+    statuses = {}
+
+    async def worker():
+        nonlocal transferred
+        for i in counter:
+            name = filenames[i % len(filenames)]
+            headers = {"If-None-Match": etags[name]} if revalidate and etags.get(name) else {}
+            resp = await client.get(f"/{prefix}/{name}", headers=headers)
+            transferred += len(resp.content)
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "handler": prefix,
+        "revalidate": revalidate,
+        "requests": total,
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(total / elapsed, 1),
+        "bytes_per_request": round(transferred / total, 1),
+        "statuses": statuses,
+    }
+
+
+async def main(args):
+    image_dir = args.image_dir
+    filenames = sorted(f for f in os.listdir(image_dir) if os.path.isfile(os.path.join(image_dir, f)))
+    transport = httpx.ASGITransport(app=build_app(image_dir))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        results = []
+        for prefix in ("legacy", "current"):
+            for revalidate in (False, True):
+                results.append(await run_case(client, prefix, filenames, args.requests,
+                                              args.concurrency, revalidate))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image-dir", default=os.getenv("STATIC_IMAGE_PATH", "assets/static_images"))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""
+量化索引基准：召回率 vs 内存 vs 扫描耗时（不调用 embedding 接口）
+- 精度：float32 / float16 / int8，分别测“仅量化扫描”与“量化扫描 + float32 重排前 N 个候选”
+- 维度：同时测截断到更低维度的向量。合成向量各向同性，截断近似于随机投影；
+  线上降维应通过 DashScope 的 dimensions 参数重新生成 embedding，此处仅用于估计量级
+召回率以 float32 全维度精确检索的 top_k 为基准
+
+用法（项目根目录）：
+    python benchmarks/bench_quantization.py --size 100000 --dims 1024,512,256 --top-k 10
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from benchmarks.bench_image_search import make_library, normalize
+from middlewares.image_searcher import top_k_indices, score_queries
+from middlewares.quantization import quantize, score_quantized
+
+
+def search(index: dict, full: np.ndarray, query: np.ndarray, top_k: int, rerank: int) -> np.ndarray:
+    scores = score_quantized(index["codes"], query[None], index.get("scales"))[0]
+    if not rerank:
+        return top_k_indices(scores, top_k)
+    candidates = np.sort(top_k_indices(scores, max(rerank, top_k)))
+    exact = score_queries(full[candidates], query[None])[0]
+    return candidates[top_k_indices(exact, top_k)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dims", default="1024,512,256")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=50, help="重排候选数")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--cluster-size", type=int, default=20)
+    parser.add_argument("--spread", type=float, default=0.08)
+    parser.add_argument("--noise", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    dims = [int(d) for d in args.dims.split(",")]
+    library, _ = make_library(args.size, max(dims), args.cluster_size, args.spread, rng)
+    targets = rng.choice(args.size, size=args.queries, replace=False)
+    queries = normalize(library[targets] + rng.standard_normal((args.queries, library.shape[1]), dtype=np.float32)
+                        * args.noise / np.sqrt(library.shape[1])).astype(np.float32)
+    truth = [set(top_k_indices(score_queries(library, q[None])[0], args.top_k).tolist()) for q in queries]
+
+    results = []
+    for dim in dims:
+        full = normalize(library[:, :dim]).astype(np.float32)
+        dim_queries = normalize(queries[:, :dim]).astype(np.float32)
+        for precision in ("float32", "float16", "int8"):
+            index = quantize(full, precision)
+            scan_bytes = sum(array.nbytes for array in index.values())
+            for rerank in (0, args.rerank):
+                if precision == "float32" and rerank:
+                    continue
+                hits, timings = 0, []
+                for query, expected in zip(dim_queries, truth):
+                    start = time.perf_counter()
+                    found = search(index, full, query, args.top_k, rerank)
+                    timings.append(time.perf_counter() - start)
+                    hits += len(expected & set(found.tolist()))
+                timings.sort()
+                results.append({
+                    "dim": dim,
+                    "precision": precision,
+                    "rerank": rerank,
+                    "scan_mb": round(scan_bytes / 1024 / 1024, 1),
+                    f"recall@{args.top_k}": round(hits / (len(truth) * args.top_k), 4),
+                    "p50_ms": round(timings[len(timings) // 2] * 1000, 3),
+                })
+                print(json.dumps(results[-1], ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"size": args.size, "top_k": args.top_k, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
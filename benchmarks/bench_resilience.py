@@ -0,0 +1,120 @@
+"""
+外部调用策略基准：对本地替身服务（tools/fake_dify.py 的 /v1/embeddings）注入故障，比较有无策略时的表现
+- tail：少量请求出现长尾延迟，比较不对冲与 p95 对冲的 p50/p95/p99
+- errors：一定比例 503，比较不重试与抖动重试的成功率
+- outage：全部失败，熔断打开后每次调用的耗时（应立即失败）
+
+用法（项目根目录，先启动替身服务）：
+    python tools/fake_dify.py --port 8081
+    python benchmarks/bench_resilience.py --base-url http://127.0.0.1:8081 --requests 300 --concurrency 8
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+
+import aiohttp
+import numpy as np
+from openai import OpenAI
+from middlewares.resilience import CallPolicy
+
+
+async def set_faults(base_url: str, **faults):
+    async with aiohttp.ClientSession() as session:
+        async with session.put(f"{base_url}/faults", json=faults) as resp:
+            resp.raise_for_status()
+
+
+async def run_calls(policy: CallPolicy | None, client, requests: int, concurrency: int) -> dict:
+    """
+    并发发出 requests 次 embedding 调用，policy 为空时直接调用（不限时、不重试）
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    def embed(i: int):
+        return client.embeddings.create(model="text-embedding-v4", input=[f"查询{i}"], dimensions=64)
+
+    async def one(i: int):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if policy is None:
+                    await asyncio.to_thread(embed, i)
+                else:
+                    await policy.call(lambda: asyncio.to_thread(embed, i))
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {"requests": requests, "failures": failures, "p50_ms": round(p50, 1), "p95_ms": round(p95, 1),
+            "p99_ms": round(p99, 1), "max_ms": round(max(latencies) * 1000, 1)}
+
+
+async def main_async(args):
+    client = OpenAI(api_key="fake", base_url=f"{args.base_url}/v1").with_options(timeout=args.timeout,
+                                                                                  max_retries=0)
+    results = []
+
+    def report(scenario: str, mode: str, result: dict, policy: CallPolicy | None = None):
+        if policy is not None:
+            result["hedges"] = policy._hedges
+            result["circuit"] = policy.breaker.state
+        results.append({"scenario": scenario, "mode": mode, **result})
+        print(json.dumps(results[-1], ensure_ascii=False))
+
+    # 长尾：slow_rate 比例的请求额外等待 slow_latency
+    await set_faults(args.base_url, error_rate=0, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                     embedding_latency=args.latency)
+    report("tail", "direct", await run_calls(None, client, args.requests, args.concurrency))
+    policy = CallPolicy("bench_hedge", timeout=args.timeout, deadline=args.timeout * 2, retries=0,
+                        hedge_quantile=0.95, hedge_budget=0.2, failure_threshold=0)
+    # 先积累耗时样本，再正式测量
+    await run_calls(policy, client, 40, args.concurrency)
+    report("tail", "hedged_p95", await run_calls(policy, client, args.requests, args.concurrency), policy)
+
+    # 错误：error_rate 比例返回 503
+    await set_faults(args.base_url, error_rate=args.error_rate, slow_rate=0)
+    report("errors", "direct", await run_calls(None, client, args.requests, args.concurrency))
+    policy = CallPolicy("bench_retry", timeout=args.timeout, deadline=args.timeout * 2, retries=2,
+                        failure_threshold=0)
+    report("errors", "retry_jitter", await run_calls(policy, client, args.requests, args.concurrency), policy)
+
+    # 完全不可用：熔断打开后立即失败
+    await set_faults(args.base_url, error_rate=1.0, slow_rate=1.0, slow_latency=args.slow_latency)
+    policy = CallPolicy("bench_breaker", timeout=args.timeout, deadline=args.timeout * 2, retries=1,
+                        failure_threshold=5, reset_timeout=60)
+    report("outage", "breaker", await run_calls(policy, client, args.requests, args.concurrency), policy)
+
+    await set_faults(args.base_url, error_rate=0, slow_rate=0)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8081", help="替身服务地址（不含 /v1）")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="embedding 基础耗时（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="长尾请求比例")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="长尾额外等待（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.2, help="503 比例")
+    parser.add_argument("--timeout", type=float, default=3.0, help="单次尝试超时（秒）")
+    parser.add_argument("--output", default=None, help="结果写入 JSON 文件")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
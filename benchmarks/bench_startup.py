@@ -0,0 +1,113 @@
+"""
+启动耗时基准：
+- import：子进程中导入 main 的耗时（重依赖推迟导入后的效果）
+- lifespan：顺序 / 并行两种模式下执行 tai_middleware 直到就绪的耗时，
+  分别在冷启动（空共享索引目录）与热启动（共享索引已发布）下测量
+  图片目录与 embedding 缓存使用由现有缓存生成的临时副本，测量过程不调用 embedding 接口
+
+用法（项目根目录）：
+    python benchmarks/bench_startup.py --repeat 3
+"""
+import os
+import sys
+import json
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def prepare_fixture(work_dir: str) -> dict:
+    """
+    以现有缓存中的向量生成临时图片目录（空文件）与按本机路径重写键的缓存文件
+    """
+    with open(os.getenv("STATIC_IMAGE_EMBEDDING_PATH"), "r", encoding="utf-8") as f:
+        embeddings_dict = json.load(f)
+    image_dir = os.path.join(work_dir, "images")
+    os.makedirs(image_dir)
+    cache = {}
+    for path, embedding in embeddings_dict.items():
+        file = os.path.basename(path.replace("\\", "/"))
+        open(os.path.join(image_dir, file), "wb").close()
+        cache[os.path.join(image_dir, file)] = embedding
+    cache_path = os.path.join(work_dir, "image_embeddings.json")
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    return {"STATIC_IMAGE_PATH": image_dir, "STATIC_IMAGE_EMBEDDING_PATH": cache_path}
+
+
+def measure_import(repeat: int) -> list[float]:
+    code = "import time; s = time.perf_counter(); import main; print(time.perf_counter() - s)"
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout
+        results.append(round(float(output.strip().splitlines()[-1]), 4))
+    return results
+
+
+def measure_lifespan(mode: str, shared_dir: str, fixture: dict) -> dict:
+    """
+    在子进程中运行一次 lifespan，保证 jieba / pyecharts / openai 等模块为冷导入
+    """
+    code = (
+        "import time, json, asyncio\n"
+        "from dotenv import load_dotenv; load_dotenv('.env')\n"
+        "from fastapi import FastAPI\n"
+        "from middlewares import init_lifespan\n"
+        "async def run():\n"
+        "    app = FastAPI()\n"
+        "    s = time.perf_counter()\n"
+        "    async with init_lifespan.tai_middleware(app):\n"
+        "        ready = time.perf_counter() - s\n"
+        "        await asyncio.sleep(0)\n"
+        "        print(json.dumps({'ready_seconds': round(ready, 4), 'subsystems': app.state.startup.subsystems}))\n"
+        "asyncio.run(run())\n"
+    )
+    env = {**os.environ, **fixture, "STARTUP_MODE": mode, "STARTUP_WARMUP": "false", "SHARED_INDEX_PATH": shared_dir}
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True,
+                            text=True, check=True, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    report = {"import_seconds": measure_import(args.repeat), "lifespan": {}}
+    fixture_dir = tempfile.mkdtemp(prefix="bench_startup_fixture_")
+    fixture = prepare_fixture(fixture_dir)
+    for mode in ("sequential", "parallel"):
+        runs = {"cold": [], "warm": []}
+        for _ in range(args.repeat):
+            shared_dir = tempfile.mkdtemp(prefix="bench_startup_")
+            try:
+                runs["cold"].append(measure_lifespan(mode, shared_dir, fixture))
+                runs["warm"].append(measure_lifespan(mode, shared_dir, fixture))
+            finally:
+                shutil.rmtree(shared_dir, ignore_errors=True)
+        report["lifespan"][mode] = {
+            phase: {"ready_seconds": [r["ready_seconds"] for r in results],
+                    "subsystems": results[-1]["subsystems"]}
+            for phase, results in runs.items()
+        }
+    shutil.rmtree(fixture_dir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,507 @@
+"""
+离线性能回归基准套件：覆盖问答链路的热点路径，结果写入 JSON，便于逐次对比
+- search：ImageSemanticSearcher.search 在 1k/10k/100k 合成向量上的检索耗时（embedding 由本地替代，不调用接口）
+- graph：KnowledgeGraphBuilder 加载与 extract_relevant_records 随三元组数增长的耗时，build_graphs 随图规模增长的耗时
+- sse：format_event 单帧序列化，以及事件经事件总线、回放缓冲到 stream_generator 输出的吞吐
+- dify_parser：dify_stream_chat 解析本地回环服务输出的 Dify 事件流的吞吐
+- ask：子进程启动服务与 tools/fake_dify.py，经 benchmarks/load_ask.py 压测 /ask 的端到端吞吐
+
+每条结果带稳定的 name 与主指标（metric/value/better），--compare 按 name 与历史结果比较，
+主指标变差超过 --threshold 视为回退，配合 --fail-on-regression 以非零退出码结束
+
+用法（项目根目录）：
+    python benchmarks/bench_suite.py --output benchmarks/results/baseline.json
+    python benchmarks/bench_suite.py --cases search,graph,sse,dify_parser --compare benchmarks/results/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.chdir(ROOT)
+
+from dotenv import load_dotenv
+load_dotenv(os.path.join(ROOT, ".env"))
+
+import numpy as np
+
+CASES = {}
+QUERY_TEXTS = ["机车电台无法呼叫调度", "CIR设备主控单元故障指示灯常亮", "GSM-R注册失败如何处理"]
+NAME_VOCABULARY = ["CIR", "主控单元", "电源板", "GSM-R", "天线", "电台", "450MHz", "MMI", "记录单元", "故障",
+                   "更换", "检查", "接口", "面板", "指示灯", "车次号", "注册", "呼叫", "调度", "机车"]
+
+
+def case(name: str):
+    def register(func):
+        CASES[name] = func
+        return func
+    return register
+
+
+def result(case_name: str, name: str, metric: str, value: float, better: str = "lower", **extra) -> dict:
+    return {"case": case_name, "name": name, "metric": metric, "value": round(float(value), 4), "better": better,
+            **extra}
+
+
+def measure(func, repeat: int, number: int = 1) -> dict:
+    """
+    同步函数计时：每轮连续执行 number 次，取 repeat 轮的中位数与最小值（毫秒/次）
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number * 1000)
+    return {"median_ms": round(float(np.median(timings)), 4), "min_ms": round(min(timings), 4)}
+
+
+async def measure_async(func, repeat: int, number: int = 1) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            await func()
+        timings.append((time.perf_counter() - start) / number * 1000)
+    return {"median_ms": round(float(np.median(timings)), 4), "min_ms": round(min(timings), 4)}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------------------------------------------------------------- search
+
+
+def synthetic_searcher_class():
+    from middlewares.image_searcher import ImageSemanticSearcher
+    from middlewares.shared_index import fingerprint
+
+    class SyntheticSearcher(ImageSemanticSearcher):
+        """
+        以合成向量构建索引、以库中向量加噪作为查询 embedding 的检索器，除 embedding 来源外走线上相同的代码路径
+        """
+
+        def __init__(self, size: int, dim: int, precision: str, work_dir: str, seed: int = 0):
+            from middlewares.shared_index import SharedArrayStore
+            self._size, self._dim, self._seed = size, dim, seed
+            rng = np.random.default_rng(seed + 1)
+            targets = rng.integers(0, size, len(QUERY_TEXTS))
+            self._targets = targets
+            image_dir = os.path.join(work_dir, "images")
+            os.makedirs(image_dir, exist_ok=True)
+            super().__init__(image_dir=image_dir, cache_path=os.path.join(work_dir, "missing.json"),
+                             api_key="offline", base_url="http://127.0.0.1:9/v1", dimensions=dim,
+                             shared_store=SharedArrayStore(os.path.join(work_dir, "shared_index")),
+                             lexical_fast_path=False, precision=precision, index_source="names")
+            noise = rng.standard_normal((len(targets), dim)).astype(np.float32) * 0.02
+            self._query_vectors = np.asarray(self.embeddings[targets]) + noise
+
+        def _source_version(self) -> str:
+            return fingerprint("synthetic", self._size, self._dim, self._seed, self.precision)
+
+        def _load_or_generate_embeddings(self):
+            rng = np.random.default_rng(self._seed)
+            embeddings = rng.standard_normal((self._size, self._dim), dtype=np.float32)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            words = rng.integers(0, len(NAME_VOCABULARY), (self._size, 3))
+            self.embeddings = embeddings
+            self.image_texts = ["".join(NAME_VOCABULARY[w] for w in row) + str(i) for i, row in enumerate(words)]
+            self.image_paths = [f"synthetic/{text}.jpg" for text in self.image_texts]
+
+        async def _generate_embeddings(self, texts: list[str]) -> list:
+            return self._query_vectors[:len(texts)]
+
+    return SyntheticSearcher
+
+
+@case("search")
+def bench_search(args) -> list[dict]:
+    searcher_class = synthetic_searcher_class()
+    results = []
+    for size in args.search_sizes:
+        for precision in args.search_precisions:
+            work_dir = tempfile.mkdtemp(prefix="bench_suite_search_")
+            try:
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    searcher = searcher_class(size, args.search_dim, precision, work_dir)
+                build_ms = (time.perf_counter() - start) * 1000
+
+                async def run():
+                    # 首次检索构建词法索引，不计入
+                    await searcher.search(QUERY_TEXTS, top_k=2, with_query=True)
+                    return await measure_async(lambda: searcher.search(QUERY_TEXTS, top_k=2, with_query=True),
+                                               args.repeat, args.search_number)
+                timing = asyncio.run(run())
+                hits = asyncio.run(searcher.search(QUERY_TEXTS, top_k=len(QUERY_TEXTS)))
+                recall = len({path for path, _ in hits} & {searcher.image_paths[t] for t in searcher._targets})
+                results.append(result("search", f"search/{size}/{precision}", "median_ms", timing["median_ms"],
+                                      size=size, precision=precision, dim=args.search_dim, queries=len(QUERY_TEXTS),
+                                      min_ms=timing["min_ms"], build_ms=round(build_ms, 1),
+                                      recall=round(recall / len(QUERY_TEXTS), 3)))
+                del searcher
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+# ---------------------------------------------------------------- graph
+
+
+def load_triplets() -> list[dict]:
+    path = os.getenv("TRIPLETS_PATH")
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="UTF-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    return [{"head": "CIR设备", "relation": "包含", "tail": f"部件{i}"} for i in range(200)]
+
+
+def grow_triplets(base: list[dict], count: int) -> list[dict]:
+    """
+    复制真实三元组到 count 条，第 k 份副本的节点名加后缀，节点数随三元组数同比增长
+    """
+    grown = []
+    copy = 0
+    while len(grown) < count:
+        suffix = f"#{copy}" if copy else ""
+        grown.extend({"head": t["head"] + suffix, "relation": t["relation"], "tail": t["tail"] + suffix}
+                     for t in base[:count - len(grown)])
+        copy += 1
+    return grown
+
+
+@case("graph")
+def bench_graph(args) -> list[dict]:
+    from middlewares.knowledge_builder import KnowledgeGraphBuilder
+    from middlewares.shared_index import SharedArrayStore
+
+    base = load_triplets()
+    results = []
+    largest = None
+    for count in args.triplet_counts:
+        work_dir = tempfile.mkdtemp(prefix="bench_suite_graph_")
+        try:
+            path = os.path.join(work_dir, "triples.txt")
+            with open(path, "w", encoding="UTF-8") as f:
+                for triplet in grow_triplets(base, count):
+                    f.write(json.dumps(triplet, ensure_ascii=False) + "\n")
+            start = time.perf_counter()
+            builder = KnowledgeGraphBuilder(path, SharedArrayStore(os.path.join(work_dir, "shared_index")))
+            load_ms = (time.perf_counter() - start) * 1000
+            timing = measure(lambda: builder.extract_relevant_records(args.keyword), args.repeat,
+                             args.graph_number)
+            results.append(result("graph", f"extract_relevant_records/{count}", "median_ms", timing["median_ms"],
+                                  triplets=count, nodes=len(builder.nodes), min_ms=timing["min_ms"],
+                                  load_ms=round(load_ms, 1)))
+            print(json.dumps(results[-1], ensure_ascii=False))
+            largest = builder.extract_relevant_records(args.keyword, top_k=max(args.graph_sizes))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # 首次绘图导入 pyecharts，不计入
+    builder.build_graphs(largest[:1], args.keyword)
+    for size in args.graph_sizes:
+        records = largest[:size]
+        timing = measure(lambda: builder.build_graphs(records, args.keyword), args.repeat)
+        results.append(result("graph", f"build_graphs/{size}", "median_ms", timing["median_ms"], records=len(records),
+                              min_ms=timing["min_ms"], bytes=len(builder.build_graphs(records, args.keyword))))
+        print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+# ---------------------------------------------------------------- sse
+
+
+@case("sse")
+def bench_sse(args) -> list[dict]:
+    from middlewares.stream_registry import format_event, stream_registry
+    from middlewares.message_queue import event_bus
+    from endpoints.v1 import stream_generator
+
+    builder_graph = json.dumps({"series": [{"type": "graph", "data": [{"name": f"节点{i}"} for i in range(50)],
+                                            "links": [{"source": "节点0", "target": f"节点{i}"}
+                                                      for i in range(1, 50)]}]}, ensure_ascii=False)
+    items = {"plain_text": ("plain_text", "机车"), "images": ("images", "/api/qa/images/CIR设备.jpg"),
+             "echarts": ("echarts", builder_graph)}
+    results = []
+    for name, item in items.items():
+        timing = measure(lambda: format_event(item), args.repeat, 2000)
+        results.append(result("sse", f"format_event/{name}", "median_ms", timing["median_ms"],
+                              us_per_frame=round(timing["median_ms"] * 1000, 3)))
+        print(json.dumps(results[-1], ensure_ascii=False))
+
+    async def stream_once(index: int) -> float:
+        stream_id = f"bench-sse-{index}"
+        await event_bus.open(stream_id)
+        stream_registry.open(stream_id)
+        frames = 0
+
+        async def consume():
+            nonlocal frames
+            async for _ in stream_generator(stream_id):
+                frames += 1
+
+        start = time.perf_counter()
+        consumer = asyncio.create_task(consume())
+        for i in range(args.sse_frames):
+            await event_bus.publish(stream_id, ("plain_text", NAME_VOCABULARY[i % len(NAME_VOCABULARY)]))
+        await event_bus.publish(stream_id, ("end", ""))
+        await consumer
+        return frames / (time.perf_counter() - start)
+
+    async def run():
+        return [await stream_once(i) for i in range(args.repeat)]
+    throughput = asyncio.run(run())
+    results.append(result("sse", "stream_generator", "frames_per_second", np.median(throughput), better="higher",
+                          frames=args.sse_frames))
+    print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+# ---------------------------------------------------------------- dify_parser
+
+
+def dify_stream_body(tokens: int) -> list[bytes]:
+    """
+    与 Dify 事件格式一致的流：think 与 plain_text 逐 token 输出，另有一帧 echarts 与 message_end
+    """
+    import services.dify as dify
+    nodes = {kind: next((node for node, t in dify.node_types.items() if t == kind), kind)
+             for kind in ("think", "plain_text", "echarts")}
+
+    def frame(payload: dict) -> bytes:
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+    def message(kind: str, answer: str) -> bytes:
+        return frame({"event": "message", "conversation_id": "bench", "message_id": "bench", "answer": answer,
+                      "from_variable_selector": [nodes[kind], "text"]})
+
+    chunks = [frame({"event": "workflow_started", "conversation_id": "bench"})]
+    chunks += [message("think", "思") for _ in range(tokens // 4)]
+    chunks += [message("plain_text", NAME_VOCABULARY[i % len(NAME_VOCABULARY)]) for i in range(tokens)]
+    chunks.append(message("echarts", '```echarts\n{"series": [{"type": "bar", "data": [1, 2, 3]}]}\n```'))
+    chunks.append(frame({"event": "message_end", "conversation_id": "bench", "message_id": "bench"}))
+    return chunks
+
+
+@case("dify_parser")
+def bench_dify_parser(args) -> list[dict]:
+    from aiohttp import web
+    import services.dify as dify
+    from middlewares.message_queue import event_bus
+
+    chunks = dify_stream_body(args.dify_tokens)
+
+    async def chat_messages(request: web.Request):
+        await request.read()
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for chunk in chunks:
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def run() -> list[float]:
+        app = web.Application()
+        app.router.add_post("/v1/chat-messages", chat_messages)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        original_url, dify.dify_url = dify.dify_url, f"http://127.0.0.1:{port}/v1"
+        rates = []
+        try:
+            for i in range(args.repeat + 1):
+                stream_id = f"bench-dify-{i}"
+                await event_bus.open(stream_id)
+
+                async def drain():
+                    while (item := await event_bus.get(stream_id, timeout=5.0)) is not None and item[0] != "end":
+                        pass
+
+                drainer = asyncio.create_task(drain())
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    answer = await dify.dify_stream_chat("bench", [], stream_id=stream_id)
+                elapsed = time.perf_counter() - start
+                await drainer
+                await event_bus.close(stream_id)
+                if answer is None:
+                    raise RuntimeError("Dify 事件流未正常结束")
+                if i:
+                    # 第一轮建立连接，不计入
+                    rates.append(len(chunks) / elapsed)
+        finally:
+            dify.dify_url = original_url
+            await runner.cleanup()
+        return rates
+
+    rates = asyncio.run(run())
+    results = [result("dify_parser", "dify_stream_chat", "events_per_second", np.median(rates), better="higher",
+                      events=len(chunks))]
+    print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+# ---------------------------------------------------------------- ask
+
+
+def wait_http(url: str, timeout: float) -> bool:
+    import urllib.request
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resp:
+                if resp.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.3)
+    return False
+
+
+@case("ask")
+def bench_ask(args) -> list[dict]:
+    from bench_startup import prepare_fixture
+    import load_ask
+
+    work_dir = tempfile.mkdtemp(prefix="bench_suite_ask_")
+    fake_port, app_port = args.ask_port + 1, args.ask_port
+    env = {**os.environ, **prepare_fixture(work_dir),
+           "SHARED_INDEX_PATH": os.path.join(work_dir, "shared_index"),
+           "DIFY_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+           "DASHSCOPE_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+           "ADMISSION_RATE": "0", "ADMISSION_ANON_RATE": "0", "ADMISSION_MAX_STREAMS": str(args.ask_clients)}
+    processes = [
+        subprocess.Popen([sys.executable, "tools/fake_dify.py", "--port", str(fake_port), "--token-rate", "0",
+                          "--first-event-delay", "0", "--answer-tokens", str(args.dify_tokens),
+                          "--callback-base", f"http://127.0.0.1:{app_port}"],
+                         cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+        subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port",
+                          str(app_port), "--log-level", "warning"],
+                         cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+    ]
+    try:
+        if not (wait_http(f"http://127.0.0.1:{app_port}/ready", 120)
+                and wait_http(f"http://127.0.0.1:{fake_port}/docs", 30)):
+            raise RuntimeError("服务或 Dify 替身未能就绪")
+        load_args = argparse.Namespace(url=f"http://127.0.0.1:{app_port}/api/qa/ask", clients=args.ask_clients,
+                                       requests=args.ask_requests, question="CIR车次功能号注册失败怎么办",
+                                       api_key=os.getenv("FASTAPI_API_KEY"), timeout=120)
+        # 预热：首个请求触发分词词典与 pyecharts 加载
+        asyncio.run(load_ask.run(argparse.Namespace(**{**vars(load_args), "clients": 1, "requests": 2})))
+        report = asyncio.run(load_ask.run(load_args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    results = [result("ask", f"ask/{args.ask_clients}", "requests_per_second", report["requests_per_second"],
+                      better="higher", failed=report["failed"], frames_per_second=report["frames_per_second"],
+                      latency=report["latency"], time_to_first_token=report["time_to_first_token"])]
+    print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+# ---------------------------------------------------------------- report
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> list[dict]:
+    """
+    与历史结果按 name 对比主指标，返回变差超过 threshold 的条目
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for current in results:
+        previous = baseline.get(current["name"])
+        if previous is None or previous["metric"] != current["metric"] or not previous["value"]:
+            continue
+        ratio = current["value"] / previous["value"]
+        change = ratio - 1 if current["better"] == "lower" else 1 - ratio
+        current["baseline"] = previous["value"]
+        current["change"] = round(change, 4)
+        if change > threshold:
+            regressions.append(current)
+        print(f"{'REGRESSION' if change > threshold else 'ok':>10}  {current['name']:<40} "
+              f"{previous['value']:>12} -> {current['value']:<12} {current['metric']} "
+              f"({abs(change):.1%} {'worse' if change > 0 else 'better'})")
+    return regressions
+
+
+def parse_list(value: str, convert=int) -> list:
+    return [convert(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", default=",".join(CASES), help=f"运行的用例，逗号分隔：{','.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="每项测量的轮数（取中位数）")
+    parser.add_argument("--search-sizes", type=parse_list, default=[1000, 10000, 100000])
+    parser.add_argument("--search-precisions", type=lambda v: parse_list(v, str), default=["float32", "int8"])
+    parser.add_argument("--search-dim", type=int, default=int(os.getenv("IMAGE_EMBEDDING_DIMENSIONS", 1024)))
+    parser.add_argument("--search-number", type=int, default=5, help="每轮检索次数")
+    parser.add_argument("--triplet-counts", type=parse_list, default=[1000, 10000, 100000])
+    parser.add_argument("--graph-sizes", type=parse_list, default=[20, 100, 500], help="build_graphs 的三元组数")
+    parser.add_argument("--graph-number", type=int, default=10, help="每轮 extract_relevant_records 次数")
+    parser.add_argument("--keyword", default="CIR设备")
+    parser.add_argument("--sse-frames", type=int, default=5000)
+    parser.add_argument("--dify-tokens", type=int, default=2000, help="Dify 替身每个回答的 token 数")
+    parser.add_argument("--ask-port", type=int, default=7990, help="端到端压测的服务端口，替身使用其后一个端口")
+    parser.add_argument("--ask-clients", type=int, default=8)
+    parser.add_argument("--ask-requests", type=int, default=80)
+    parser.add_argument("--output", default=None, help="结果 JSON 路径，默认 benchmarks/results/<时间>_<提交>.json")
+    parser.add_argument("--compare", default=None, help="对比的历史结果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.15, help="主指标变差超过该比例视为回退")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    selected = parse_list(args.cases, str)
+    unknown = [name for name in selected if name not in CASES]
+    if unknown:
+        parser.error(f"未知用例: {','.join(unknown)}")
+
+    commit = git_commit()
+    results = []
+    for name in selected:
+        print(f"# {name}")
+        results.extend(CASES[name](args))
+
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+    report = {
+        "meta": {"timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": commit,
+                 "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "cases": selected,
+                 "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}},
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
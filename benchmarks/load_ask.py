@@ -0,0 +1,113 @@
+"""
+/ask 压测：N 个并发客户端持续发起流式问答，统计吞吐、首帧/首 token 时间与尾延迟
+
+用法（项目根目录，配合 tools/fake_dify.py）：
+    python benchmarks/load_ask.py --url http://127.0.0.1:7999/api/qa/ask --clients 20 --requests 200
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import aiohttp
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 4)
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+async def one_request(session: aiohttp.ClientSession, url: str, question: str, headers: dict) -> dict:
+    start = time.perf_counter()
+    first_frame = first_token = None
+    frames = 0
+    received = 0
+    async with session.post(url, json={"question": question, "history": []}, headers=headers) as resp:
+        status = resp.status
+        async for line in resp.content:
+            received += len(line)
+            if not line.startswith(b"data: "):
+                continue
+            now = time.perf_counter() - start
+            frames += 1
+            if first_frame is None:
+                first_frame = now
+            if line.startswith(b"data: [DONE]"):
+                break
+            if first_token is None and b'"plain_text"' in line:
+                first_token = now
+    return {
+        "status": status,
+        "seconds": time.perf_counter() - start,
+        "first_frame": first_frame,
+        "first_token": first_token,
+        "frames": frames,
+        "bytes": received,
+    }
+
+
+async def run(args) -> dict:
+    headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+    results = []
+    errors = 0
+    remaining = iter(range(args.requests))
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+
+    async def client(session: aiohttp.ClientSession):
+        nonlocal errors
+        for i in remaining:
+            try:
+                results.append(await one_request(session, args.url, f"{args.question} #{i}", headers))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                errors += 1
+
+    start = time.perf_counter()
+    connector = aiohttp.TCPConnector(limit=args.clients)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(client(session) for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    return {
+        "clients": args.clients,
+        "requests": args.requests,
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok) + errors,
+        "statuses": {str(s): sum(1 for r in results if r["status"] == s) for s in {r["status"] for r in results}},
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(len(ok) / elapsed, 2) if elapsed else 0,
+        "frames_per_second": round(sum(r["frames"] for r in ok) / elapsed, 2) if elapsed else 0,
+        "time_to_first_frame": summarize([r["first_frame"] for r in ok if r["first_frame"] is not None]),
+        "time_to_first_token": summarize([r["first_token"] for r in ok if r["first_token"] is not None]),
+        "latency": summarize([r["seconds"] for r in ok]),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('PORT', 7999)}/api/qa/ask")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--question", default="CIR车次功能号注册失败怎么办")
+    parser.add_argument("--api-key", default=os.getenv("FASTAPI_API_KEY"))
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", default=None, help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
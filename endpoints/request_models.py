@@ -1,10 +1,19 @@
+import os
 import json
+from typing import Literal
 from fastapi import Form, UploadFile, File
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, conlist
 from datetime import date
 
 from starlette.datastructures import FormData
 
+# 报告任务的请求上限，与 ReportJobManager 读取同一配置
+REPORT_MAX_QUESTIONS = int(os.getenv("REPORT_MAX_QUESTIONS", 200))
+REPORT_MAX_PARALLEL = int(os.getenv("REPORT_MAX_PARALLEL", 2))
+# 因果链查询的深度与返回条数上限，限制单次请求的路径枚举量
+CAUSAL_MAX_DEPTH = int(os.getenv("CAUSAL_MAX_DEPTH", 10))
+CAUSAL_MAX_LIMIT = int(os.getenv("CAUSAL_MAX_LIMIT", 200))
+
 
 class AskQuestionModel(BaseModel):
     question: str
@@ -32,10 +41,29 @@ async def parse_form_data(form_data: Form) -> (AskQuestionModel, UploadFile):
 
 class QuestionFetchImageModel(BaseModel):
     questions: list[str]
+    stream_id: str | None = None
 
 
 class KeywordsModel(BaseModel):
     keywords: list[str]
     title: str
+    stream_id: str | None = None
+
+
+
+
+class ReportJobModel(BaseModel):
+    questions: conlist(str, min_length=1, max_length=REPORT_MAX_QUESTIONS)
+    title: str = "故障维修报告"
+    format: Literal["html", "markdown"] = "html"
+    # 为空时使用 REPORT_MAX_PARALLEL
+    parallelism: int | None = Field(None, ge=1, le=REPORT_MAX_PARALLEL)
 
 
+class CausalChainModel(BaseModel):
+    entity: str
+    relation: str = "导致"
+    direction: Literal["effects", "causes"] = "effects"
+    target: str | None = None
+    max_depth: int = Field(6, ge=1, le=CAUSAL_MAX_DEPTH)
+    limit: int = Field(50, ge=1, le=CAUSAL_MAX_LIMIT)
@@ -1,60 +1,63 @@
 import os
 import json
+import uuid
 import asyncio
 from urllib.parse import unquote
-from fastapi import APIRouter, Request, Depends, HTTPException, Path
+from fastapi import APIRouter, Request, Depends, HTTPException, Path, Query, WebSocket
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from pydantic import ValidationError
 from pygments.lexers import data
 
-from endpoints.request_models import AskQuestionModel, parse_form_data, QuestionFetchImageModel, KeywordsModel
-from middlewares.message_queue import global_queue
+from endpoints.request_models import AskQuestionModel, parse_form_data, QuestionFetchImageModel, KeywordsModel, \
+    ReportJobModel, CausalChainModel
+from middlewares.admission import admission_controller
+from middlewares.message_queue import event_bus
+from middlewares.stream_registry import stream_registry, StreamGapError, format_gap_event
+from middlewares.stream_multiplexer import MultiplexedConnection
+from middlewares.metrics import observe_stage, ACTIVE_STREAMS
+from middlewares.stream_trace import stream_tracer
+from middlewares.profiler import request_profiler
 from services.dify import file_upload, dify_stream_chat
+from services.report_jobs import report_jobs, REPORT_FORMATS
 
 repair_qa = APIRouter()
-BASE_DIR = os.getenv("STATIC_IMAGE_PATH")
 BASE_IMAGE_URL = os.getenv("IMAGE_SERVER_BASE")
-
-
-async def stream_generator():
+# 推送给客户端的图片链接附带的派生参数，如 "w=640&fmt=auto"，为空则推送原图
+IMAGE_PUSH_VARIANT = os.getenv("IMAGE_PUSH_VARIANT", "")
+# 推送图片的最低余弦相似度（search 返回的向量原始得分，BM25 混合只影响排序，不参与阈值比较）
+IMAGE_PUSH_MIN_SCORE = float(os.getenv("IMAGE_PUSH_MIN_SCORE", 0.4))
+# 预取：/ask 收到问题后立即在本地检索图片与知识图谱并提前推送，不等待 Dify 回调
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+SPECULATIVE_TIMEOUT = float(os.getenv("SPECULATIVE_TIMEOUT", 10))
+SPECULATIVE_MAX_ENTITIES = int(os.getenv("SPECULATIVE_MAX_ENTITIES", 3))
+# 持有后台预取任务的引用，避免被垃圾回收
+_speculative_tasks: set[asyncio.Task] = set()
+
+
+async def stream_generator(stream_id: str, last_event_id: int = 0):
     """
     异步生成器，用于SSE流式响应。
-    每隔50ms轮询队列一次，直到收到'end'类型的数据才停止。
-    如果队列为空，则继续轮询；如果有数据，则yield SSE格式输出。
+    从本流的回放缓冲中读取 id > last_event_id 的事件，直到上游结束（'end'）才停止。
+    每条事件带 id，客户端断线后可携带 Last-Event-ID 调用续传接口。
+    读取落后、所需事件已被淘汰时发出 gap 事件并结束响应，此时续传接口返回 410。
     """
-    end_received = False
-    while not end_received:
-        try:
-            # 每50ms尝试从队列取数据（轮询机制）
-            item = await asyncio.wait_for(global_queue.get(), timeout=0.05)
-            type_, text = item
-            # 确保text是字符串，如果为空则用空字符串
-            text = text if text else ""
-            if type_ == 'end':
-                yield 'data: [DONE]\n\n'
-                end_received = True
-            elif type_ in ['think', 'plain_text', 'images']:
-                data = json.dumps({"type": type_, "text": text}, ensure_ascii=False)
-                # 输出SSE格式，注意JSON字符串转义（简单假设text不含特殊字符，如需严格可添加json.dumps）
-                yield f'data: {data}\n\n'
-            elif type_ in ['echarts']:
-                try:
-                    echarts = json.loads(text)
-                    data = json.dumps({"type": type_, "text": echarts}, ensure_ascii=False)
-                    yield f'data: {data}\n\n'
-                except:
-                    pass
-            else:
-                # 未知类型，跳过或记录日志（这里简单跳过）
-                pass
-        except asyncio.TimeoutError:
-            # 队列为空，继续下一轮轮询（不停止）
-            pass
-        except ValueError:
-            # 如果item无法解包，跳过
-            pass
-
-
-async def fake_response():
+    buffer = stream_registry.get(stream_id)
+    if buffer is None:
+        # 流已过期（保留期已过）：不重新创建，直接结束响应
+        print(f"⚠️ 问答流 {stream_id} 不存在或已过期")
+        return
+    ACTIVE_STREAMS.labels().inc()
+    try:
+        async for event_id, frame in buffer.follow(last_event_id):
+            yield f'id: {event_id}\n{frame}'
+    except StreamGapError as e:
+        print(f"⚠️ 问答流 {stream_id} 读取落后，{e.first_id} 之前的事件已被淘汰")
+        yield format_gap_event(e.first_id)
+    finally:
+        ACTIVE_STREAMS.labels().dec()
+
+
+async def fake_response(stream_id: str):
     text = """# 🌍 智慧沙盘多模态交互系统
 
 > 🚗🎤💡 集 **实时监控**、**智能识别**、**语音交互** 与 **多模态联动** 于一体的智慧沙盘项目
@@ -259,20 +262,117 @@ sequenceDiagram
 
     images = ["http://gips3.baidu.com/it/u=1821127123,1149655687&fm=3028&app=3028&f=JPEG&fmt=auto?w=720&h=1280",
               "https://gips3.baidu.com/it/u=3732737575,1337431568&fm=3028&app=3028&f=JPEG&fmt=auto&q=100&size=f1440_2560"]
-    await global_queue.put(('think', '正在为您生成内容'))
+    await event_bus.publish(stream_id, ('think', '正在为您生成内容'))
     await asyncio.sleep(0.1)
-    await global_queue.put(("think", "内容......"))
+    await event_bus.publish(stream_id, ("think", "内容......"))
     await asyncio.sleep(0.500)
 
     for i in range(0, len(text), 5):
-        await global_queue.put(("plain_text", text[i:i+5]))
+        await event_bus.publish(stream_id, ("plain_text", text[i:i+5]))
         await asyncio.sleep(0.05)
 
-    await global_queue.put(("images", images))
+    await event_bus.publish(stream_id, ("images", images))
     await asyncio.sleep(0.100)
 
-    await global_queue.put(("echarts", graph))
-    await global_queue.put(('end', ''))
+    await event_bus.publish(stream_id, ("echarts", graph))
+    await event_bus.publish(stream_id, ('end', ''))
+
+
+def image_push_url(image_path: str) -> str:
+    image_url = f"{BASE_IMAGE_URL}{os.path.basename(image_path)}"
+    if IMAGE_PUSH_VARIANT:
+        image_url = f"{image_url}?{IMAGE_PUSH_VARIANT}"
+    return image_url
+
+
+async def push_images(stream_id: str | None, image_list: list, queries: list[str], source: str):
+    """
+    推送得分达标的图片；同一流中已推送过的图片（如预取已命中）不再重复推送
+    :param image_list: search(..., with_query=True) 的结果 [(图片路径, 得分, 查询下标), ...]
+    :param source: 轨迹中的事件来源
+    """
+    buffer = stream_registry.get(stream_id) if stream_id else None
+    for image_path, score, query_index in image_list:
+        if score < IMAGE_PUSH_MIN_SCORE:
+            continue
+        image_url = image_push_url(image_path)
+        if buffer is not None and not buffer.claim("images", [image_url]):
+            continue
+        stream_tracer.record_callback(stream_id, source, type="images", score=score, query=queries[query_index],
+                                      bytes=len(image_url), item=("images", image_url))
+        await event_bus.publish(stream_id, ("images", image_url))
+        await asyncio.sleep(0.05)
+
+
+async def push_graph(knowledge_graph, stream_id: str | None, keywords: list[str], title: str, source: str,
+                     endpoint: str) -> list[dict]:
+    """
+    按关键字检索知识图谱并推送图表；图表涉及的三元组此前已全部推送过时（如预取已覆盖）跳过推送。
+    返回全部匹配到的三元组，供工作流后续节点使用
+    """
+    relevant_records_list = []
+    llm_records_list = []
+    with observe_stage(endpoint, "graph_extract"):
+        for keyword in keywords:
+            records = knowledge_graph.extract_relevant_records(keyword)
+            relevant_records_list.extend(records[:20]), llm_records_list.extend(records)
+
+    buffer = stream_registry.get(stream_id) if stream_id else None
+    if buffer is not None and relevant_records_list and \
+            not buffer.claim("graph", [tuple(sorted(d.items())) for d in relevant_records_list]):
+        return llm_records_list
+
+    with observe_stage(endpoint, "build_graphs"):
+        graph_str = await knowledge_graph.render_graph(relevant_records_list, title)
+    stream_tracer.record_callback(stream_id, source, type="echarts", keywords=keywords, bytes=len(graph_str),
+                                  item=("echarts", graph_str))
+    await event_bus.publish(stream_id, ("echarts", graph_str))
+    return llm_records_list
+
+
+async def speculative_retrieval(app_state, question: str, stream_id: str):
+    """
+    用原始问题在本地检索图片与知识图谱并提前推送，与 Dify 工作流并行；
+    之后 Dify 回调命中相同内容时由 push_images / push_graph 去重
+    """
+    async def images():
+        image_list = await app_state.image_searcher.search([question], top_k=2, with_query=True)
+        await push_images(stream_id, image_list, [question], "speculative")
+
+    async def graph():
+        keywords = app_state.knowledge_graph.match_entities(question, max_entities=SPECULATIVE_MAX_ENTITIES)
+        if keywords:
+            await push_graph(app_state.knowledge_graph, stream_id, keywords, "、".join(keywords), "speculative",
+                             "/ask")
+
+    try:
+        await asyncio.wait_for(asyncio.gather(images(), graph()), timeout=SPECULATIVE_TIMEOUT)
+    except Exception as e:
+        # 预取只是加速，失败不影响 Dify 回调的正常推送
+        print(f"⚠️ 预取检索失败: {e!r}")
+
+
+async def start_answer(app_state, data: AskQuestionModel, image_file: str | None = None,
+                       owner: str | None = None) -> tuple[str, asyncio.Task]:
+    """
+    建立问答流并在后台运行 Dify 工作流，SSE 与 WebSocket 两种传输共用
+    :param owner: 通过校验的调用方 API key（AdmissionSlot.api_key），服务端会话历史按其隔离
+    :return: (stream_id, Dify 任务)
+    """
+    # 每个问答流独立的事件通道，Dify 回调通过 stream_id 路由回来
+    stream_id = uuid.uuid4().hex
+    await event_bus.open(stream_id)
+    # 立即开始缓冲上游事件，与客户端连接的生命周期解耦
+    stream_registry.open(stream_id)
+    trace = stream_tracer.start(data.question, stream_id)
+    task = asyncio.create_task(dify_stream_chat(data.question, data.history, image_file, trace=trace,
+                                                stream_id=stream_id, conversation_id=data.conversation_id,
+                                                owner=owner))
+    if SPECULATIVE_RETRIEVAL:
+        speculative = asyncio.create_task(speculative_retrieval(app_state, data.question, stream_id))
+        _speculative_tasks.add(speculative)
+        speculative.add_done_callback(_speculative_tasks.discard)
+    return stream_id, task
 
 
 @repair_qa.post("/ask", tags=["多模态图文问答"])
@@ -280,58 +380,166 @@ sequenceDiagram
 async def multi_modal_ask_question(request: Request):
     """兼容 multipart/form-data 与 application/json"""
 
-    content_type = request.headers.get("content-type", "")
-
-    if "application/json" in content_type:
-        # 处理 JSON 请求
-        json_data = await request.json()
-        data = AskQuestionModel.model_validate(json_data)
-        image_file = None
-        print(json.dumps(json_data, ensure_ascii=False))
-    else:
-        # 处理表单请求
-        form_data = await request.form()
-        data, image_file = await parse_form_data(form_data)
-
-    if image_file:
-        image_file = await file_upload(image_file)
-        print(image_file)
-
-    asyncio.create_task(dify_stream_chat(data.question, data.history, image_file))
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    # 准入控制：限流或上游并发已满时直接返回 429，占用的名额在 Dify 流结束后释放
+    slot = await admission_controller.admit(request)
+    # 按请求开启的剖析：覆盖本请求、Dify 后台任务与回调，Dify 流结束后写出
+    profile = request_profiler.begin(request.headers, "/ask")
+    try:
+        content_type = request.headers.get("content-type", "")
+
+        with observe_stage("/ask", "parse_request"):
+            if "application/json" in content_type:
+                # 处理 JSON 请求
+                json_data = await request.json()
+                data = AskQuestionModel.model_validate(json_data)
+                image_file = None
+                print(json.dumps(json_data, ensure_ascii=False))
+            else:
+                # 处理表单请求
+                form_data = await request.form()
+                data, image_file = await parse_form_data(form_data)
+
+        if image_file:
+            with observe_stage("/ask", "file_upload"):
+                image_file = await file_upload(image_file)
+            print(image_file)
+
+        stream_id, task = await start_answer(request.app.state, data, image_file, owner=slot.api_key)
+    except BaseException:
+        slot.release()
+        request_profiler.finish(profile)
+        raise
+    task.add_done_callback(slot.release)
+    headers = {"X-Stream-Id": stream_id}
+    if profile is not None:
+        request_profiler.bind(profile, stream_id)
+        task.add_done_callback(lambda _: request_profiler.finish(profile))
+        headers["X-Profile-Id"] = profile.profile_id
+    return StreamingResponse(stream_generator(stream_id), media_type="text/event-stream", headers=headers)
+
+
+async def start_ws_answer(websocket: WebSocket, message: dict) -> tuple[str, asyncio.Task]:
+    """
+    WebSocket 上的 ask：与 /ask 相同的准入控制，名额在 Dify 流结束后释放
+    """
+    slot = await admission_controller.admit(websocket)
+    try:
+        try:
+            data = AskQuestionModel.model_validate(message)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+        stream_id, task = await start_answer(websocket.app.state, data, owner=slot.api_key)
+    except BaseException:
+        slot.release()
+        raise
+    task.add_done_callback(slot.release)
+    return stream_id, task
+
+
+@repair_qa.websocket("/ws")
+async def multiplexed_ask(websocket: WebSocket):
+    """单个 WebSocket 连接复用多个问答流，消息格式见 MultiplexedConnection"""
+    await MultiplexedConnection(websocket, start_ws_answer).run()
+
+
+@repair_qa.get("/streams/{stream_id}", tags=["多模态图文问答"])
+async def resume_stream(request: Request, stream_id: str = Path(...), last_event_id: int | None = Query(None)):
+    """断线续传：从 Last-Event-ID（请求头或查询参数）之后继续推送，上游结束后在保留期内仍可读取"""
+    buffer = stream_registry.get(stream_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    if last_event_id is None:
+        header = request.headers.get("last-event-id", "0")
+        last_event_id = int(header) if header.isdigit() else 0
+    if not buffer.can_resume(last_event_id):
+        # 缓冲已淘汰所需事件，只能重新提问
+        raise HTTPException(status_code=410, detail="Requested events are no longer buffered")
+    return StreamingResponse(stream_generator(stream_id, last_event_id), media_type="text/event-stream",
+                             headers={"X-Stream-Id": stream_id})
+
+
+@repair_qa.post("/reports", tags=["批量报告"], status_code=202)
+async def create_report_job(request: Request, report_model: ReportJobModel):
+    """提交批量报告任务：后台按并发上限逐题运行 Dify 工作流，完成后生成 HTML / Markdown 报告"""
+    job = report_jobs.submit(report_model.questions, report_model.title, report_model.format,
+                             report_model.parallelism)
+    status_url = str(request.url_for("get_report_job", job_id=job.job_id))
+    return JSONResponse({**job.to_dict(), "status_url": status_url,
+                         "download_url": str(request.url_for("download_report", job_id=job.job_id))},
+                        status_code=202, headers={"Location": status_url})
+
+
+@repair_qa.get("/reports/{job_id}", tags=["批量报告"])
+async def get_report_job(job_id: str = Path(...), detail: bool = Query(False, description="是否返回逐题结果")):
+    """查询任务状态与进度"""
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found or expired")
+    result = job.to_dict()
+    if detail:
+        result["results"] = job.results
+    return result
+
+
+@repair_qa.get("/reports/{job_id}/download", tags=["批量报告"])
+async def download_report(job_id: str = Path(...)):
+    """下载已完成任务的报告文件"""
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found or expired")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Report job is {job.status}")
+    extension, media_type = REPORT_FORMATS[job.format]
+    return FileResponse(job.path, media_type=media_type, filename=f"report-{job.job_id}.{extension}")
 
 
 @repair_qa.post("/query-to-image", tags=["根据用户请求，获取最相关图片名"])
 async def query_to_image(request: Request, question_model: QuestionFetchImageModel):
-    image_list = await request.app.state.image_searcher.search(question_model.questions, top_k=2)
-    print(image_list)
-    for image_path, score in image_list:
-        if score >= 0.4:
-            await global_queue.put(("images", f"{BASE_IMAGE_URL}{os.path.basename(image_path)}"))
-            await asyncio.sleep(0.05)
+    with request_profiler.attach(question_model.stream_id, "/query-to-image"):
+        image_list = await request.app.state.image_searcher.search(question_model.questions, top_k=2,
+                                                                   with_query=True)
+        print(image_list)
+        await push_images(question_model.stream_id, image_list, question_model.questions, "query-to-image")
     return None
 
 
 @repair_qa.post("/keywords-to-graph", tags=["根据关键字，匹配知识图谱"])
 async def keywords_to_graph(request: Request, keywords_model: KeywordsModel):
-    relevant_records_list = []
-    llm_records_list = []
-    for keyword in keywords_model.keywords:
-        records = request.app.state.knowledge_graph.extract_relevant_records(keyword)
-        relevant_records_list.extend(records[:20]), llm_records_list.extend(records)
-
-    graph_str = request.app.state.knowledge_graph.build_graphs(relevant_records_list, keywords_model.title)
-    await global_queue.put(("echarts", graph_str))
+    with request_profiler.attach(keywords_model.stream_id, "/keywords-to-graph"):
+        llm_records_list = await push_graph(request.app.state.knowledge_graph, keywords_model.stream_id,
+                                            keywords_model.keywords, keywords_model.title, "keywords-to-graph",
+                                            "/keywords-to-graph")
     unique_dicts = [dict(t) for t in {tuple(sorted(d.items())) for d in llm_records_list}]
     return {"triples": unique_dicts}
 
 
 
+@repair_qa.post("/causal-chain", tags=["根据实体，查询故障因果链"])
+async def causal_chain(request: Request, causal_model: CausalChainModel):
+    """基于加载时预计算的可达性索引，查询“什么会导致 X”（causes）或“X 会导致什么”（effects）"""
+    try:
+        with observe_stage("/causal-chain", "causal_query"):
+            return request.app.state.knowledge_graph.causal_chains(
+                causal_model.entity, causal_model.relation, causal_model.direction,
+                max_depth=causal_model.max_depth, limit=causal_model.limit, target=causal_model.target)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @repair_qa.get("/images/{filename:path}", tags=["图片服务器"])
-async def image_path(request: Request, filename: str = Path(...)):
-    file_path = os.path.join(BASE_DIR, filename)
-    # 判断文件是否存在
-    if not os.path.isfile(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    # 返回文件（自动根据扩展名设置 MIME）
-    return FileResponse(file_path)
+async def image_path(request: Request, filename: str = Path(...),
+                     w: int | None = Query(None, description="缩略图宽度（吸附到预设档位）"),
+                     q: int | None = Query(None, description="编码质量 30-95"),
+                     fmt: str | None = Query(None, description="输出格式：webp/jpeg/png/auto")):
+    # 安全路径解析 + ETag/304 + 长缓存头 + 小文件内存缓存，详见 StaticImageServer
+    image_server = request.app.state.image_server
+    if w is None and q is None and fmt is None:
+        return await image_server.serve(filename, request.headers)
+
+    # 派生图（缩略图/转码）：生成一次后落盘缓存，之后直接命中
+    source_path = image_server.resolve(filename)
+    variants = request.app.state.image_variants
+    negotiated = variants.negotiate_format(fmt, request.headers.get("accept", ""), source_path)
+    variant_path = await variants.get(source_path, width=w, quality=q, fmt=negotiated)
+    # 只有 fmt=auto 的响应随 Accept 变化
+    return await image_server.serve_file(variant_path, request.headers, {"Vary": "Accept"} if fmt == "auto" else None)
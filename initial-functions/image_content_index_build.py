@@ -0,0 +1,188 @@
+"""
+离线批量构建图片内容索引：
+为每张图片汇总文件名、人工标注、旁路说明文件与 OCR 文本，批量生成 embedding，
+发布为共享索引目录中的一个版本（IMAGE_CONTENT_INDEX_NAME），服务端设置
+IMAGE_INDEX_SOURCE=content 后挂载；服务运行中重新构建，各 worker 会自动切换到新版本。
+
+文本来源（按顺序拼接）：
+- 文件名
+- --captions 指定的 JSON：{"文件名": "说明", ...}
+- 图片旁的同名说明文件：<图片名>.txt，或 <图片名>.json 中的 caption / description / ocr 字段
+- --ocr 时用 pytesseract 识别图中文字（可选依赖，需要安装 tesseract 及中文语言包）
+
+文本相同的图片复用上一版本的 embedding，只对新增或变化的图片调用接口。
+
+用法（项目根目录）：
+    python initial-functions/image_content_index_build.py --captions assets/captions.json --workers 4
+    python initial-functions/image_content_index_build.py --dump logs/image_texts.jsonl --dry-run
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from dotenv import load_dotenv
+load_dotenv(os.path.join(ROOT, ".env"))
+
+import numpy as np
+from middlewares.image_searcher import CONTENT_INDEX_NAME, IMAGE_EXTENSIONS
+from middlewares.quantization import quantize
+from middlewares.shared_index import SharedArrayStore, fingerprint
+
+SIDECAR_FIELDS = ("caption", "description", "ocr")
+
+
+def read_sidecar(image_path: str) -> list[str]:
+    stem = os.path.splitext(image_path)[0]
+    texts = []
+    if os.path.isfile(f"{stem}.txt"):
+        with open(f"{stem}.txt", "r", encoding="utf-8") as f:
+            texts.append(f.read().strip())
+    if os.path.isfile(f"{stem}.json"):
+        with open(f"{stem}.json", "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        texts.extend(str(sidecar[field]).strip() for field in SIDECAR_FIELDS if sidecar.get(field))
+    return [text for text in texts if text]
+
+
+def run_ocr(image_path: str, lang: str) -> str:
+    try:
+        import pytesseract
+        from PIL import Image
+    except ImportError as e:
+        raise RuntimeError("启用 --ocr 需要安装 pytesseract（以及 tesseract 与中文语言包）") from e
+    with Image.open(image_path) as image:
+        return " ".join(pytesseract.image_to_string(image, lang=lang).split())
+
+
+def prepare_image(task: tuple) -> dict:
+    """
+    进程池中执行：汇总单张图片的文本并分词
+    """
+    image_path, caption, ocr_lang, max_chars = task
+    from middlewares.image_searcher import image_name
+    from middlewares.segmenter import segmenter
+
+    name = image_name(image_path)
+    parts = [name]
+    if caption:
+        parts.append(caption)
+    parts.extend(read_sidecar(image_path))
+    if ocr_lang:
+        ocr_text = run_ocr(image_path, ocr_lang)
+        if ocr_text:
+            parts.append(ocr_text)
+    document = "\n".join(dict.fromkeys(parts))[:max_chars]
+    return {
+        "image_path": image_path,
+        "name": name,
+        "document": document,
+        "embedding_text": segmenter.segment(document),
+        "text_hash": hashlib.sha1(document.encode("utf-8")).hexdigest(),
+    }
+
+
+def embed_batches(texts: list[str], model: str, dimensions: int, batch_size: int) -> list[list[float]]:
+    from openai import OpenAI
+    client = OpenAI(api_key=os.getenv("DASHSCOPE_API_KEY"), base_url=os.getenv("DASHSCOPE_BASE_URL"))
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        resp = client.embeddings.create(model=model, input=batch, dimensions=dimensions)
+        vectors.extend(item.embedding for item in sorted(resp.data, key=lambda item: item.index))
+        print(f"🧮 已生成 {len(vectors)}/{len(texts)} 条 embedding")
+    return vectors
+
+
+def previous_embeddings(store: SharedArrayStore, model: str, dimensions: int) -> dict:
+    """
+    上一版本中 文本哈希 -> embedding，模型或维度不同则不复用
+    """
+    attached = store.attach(CONTENT_INDEX_NAME)
+    if attached is None:
+        return {}
+    _, arrays, meta = attached
+    if meta.get("model") != model or meta.get("dimensions") != dimensions:
+        return {}
+    return {text_hash: arrays["embeddings"][i] for i, text_hash in enumerate(meta.get("text_hashes", []))}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image-dir", default=os.getenv("STATIC_IMAGE_PATH"))
+    parser.add_argument("--captions", default=None, help="人工标注 JSON：{文件名: 说明}")
+    parser.add_argument("--ocr", action="store_true", help="用 pytesseract 识别图中文字")
+    parser.add_argument("--ocr-lang", default="chi_sim+eng")
+    parser.add_argument("--max-chars", type=int, default=2000, help="单张图片文本的最大长度")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="预处理进程数")
+    parser.add_argument("--batch-size", type=int, default=10, help="每次 embedding 请求的文本数（DashScope 上限 10）")
+    parser.add_argument("--model", default="text-embedding-v4")
+    parser.add_argument("--dimensions", type=int, default=int(os.getenv("IMAGE_EMBEDDING_DIMENSIONS", 1024)))
+    parser.add_argument("--precision", default=os.getenv("IMAGE_INDEX_PRECISION", "float32"))
+    parser.add_argument("--shared-index-path", default=os.getenv("SHARED_INDEX_PATH", "assets/shared_index"))
+    parser.add_argument("--dump", default=None, help="把汇总后的文本写入 JSONL 便于检查")
+    parser.add_argument("--dry-run", action="store_true", help="只做预处理，不调用 embedding 接口、不发布")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    captions = {}
+    if args.captions:
+        with open(args.captions, "r", encoding="utf-8") as f:
+            captions = json.load(f)
+
+    files = sorted(file for file in os.listdir(args.image_dir) if file.lower().endswith(IMAGE_EXTENSIONS))
+    tasks = [(os.path.join(args.image_dir, file), captions.get(file) or captions.get(os.path.splitext(file)[0]),
+              args.ocr_lang if args.ocr else None, args.max_chars) for file in files]
+    print(f"📂 共 {len(tasks)} 张图片，预处理进程 {args.workers} 个")
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        records = list(executor.map(prepare_image, tasks, chunksize=max(len(tasks) // (args.workers * 4), 1)))
+
+    if args.dump:
+        os.makedirs(os.path.dirname(args.dump) or ".", exist_ok=True)
+        with open(args.dump, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"💾 文本已写入 {args.dump}")
+    if args.dry_run:
+        return
+
+    store = SharedArrayStore(args.shared_index_path)
+    reused = previous_embeddings(store, args.model, args.dimensions)
+    pending = [record for record in records if record["text_hash"] not in reused]
+    print(f"♻️ 复用 {len(records) - len(pending)} 条，需要生成 {len(pending)} 条")
+    vectors = embed_batches([record["embedding_text"] for record in pending], args.model, args.dimensions,
+                            args.batch_size)
+    generated = {record["text_hash"]: vector for record, vector in zip(pending, vectors)}
+
+    embeddings = np.array([reused.get(record["text_hash"], generated.get(record["text_hash"])) for record in records],
+                          dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    arrays = {"embeddings": embeddings}
+    if args.precision != "float32":
+        arrays.update(quantize(embeddings, args.precision))
+
+    text_hashes = [record["text_hash"] for record in records]
+    version = fingerprint(args.model, args.dimensions, args.precision,
+                          [record["image_path"] for record in records], text_hashes)
+    store.publish(CONTENT_INDEX_NAME, version, arrays, {
+        "image_paths": [record["image_path"] for record in records],
+        "image_texts": [record["name"] for record in records],
+        "documents": [record["document"] for record in records],
+        "text_hashes": text_hashes,
+        "model": args.model,
+        "dimensions": args.dimensions,
+        "precision": args.precision,
+    })
+    print(f"✅ 已发布图片内容索引 {CONTENT_INDEX_NAME}@{version}（{len(records)} 张）")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,12 @@ import os
 load_dotenv()
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from endpoints.v1 import repair_qa
 from middlewares.init_lifespan import tai_middleware
+from middlewares.metrics import TimingMiddleware, REGISTRY
+from middlewares.compression import StreamingCompressionMiddleware, COMPRESSION_ENABLED
 
 app = FastAPI(lifespan=tai_middleware)
 
@@ -23,10 +26,29 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if COMPRESSION_ENABLED:
+    # SSE 逐帧压缩并立即刷新，ECharts 图表与三元组等较大的 JSON 一次性压缩
+    app.add_middleware(StreamingCompressionMiddleware)
+app.add_middleware(TimingMiddleware)
 
 app.include_router(repair_qa, prefix="/api/qa")
 
 
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """就绪检查：报告各子系统是否已加载/预热"""
+    startup = app.state.startup
+    return JSONResponse({"ready": startup.is_ready(), "subsystems": startup.subsystems},
+                        status_code=200 if startup.is_ready() else 503)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 文本格式指标"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 
 if __name__ == '__main__':
-    uvicorn.run("main:app", host="0.0.0.0", port=int((os.getenv("PORT"))))
+    # 多 worker 部署需配合 EVENT_BUS_BACKEND=redis，使 Dify 回调能送达任意 worker 上的问答流
+    uvicorn.run("main:app", host="0.0.0.0", port=int((os.getenv("PORT"))), workers=int(os.getenv("WORKERS", 1)))
@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import asyncio
+from fastapi import HTTPException, Request, status
+from middlewares.apikey_auth import bearer_scheme, verify_bearer_api_key
+from middlewares.metrics import ADMISSION_SLOTS, ADMISSION_REJECTED
+
+
+class TokenBucket:
+    """
+    令牌桶：每秒补充 rate 个令牌，最多累积 burst 个
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """
+        取一个令牌，成功返回 0，否则返回需要等待的秒数
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionSlot:
+    """
+    一个上游 Dify 流的占用凭证，release 可重复调用
+    api_key 为通过校验的调用方 API key，未携带或未通过校验时为 None
+    """
+
+    def __init__(self, controller: "AdmissionController | None", api_key: str | None = None):
+        self._controller = controller
+        self.api_key = api_key
+
+    def release(self, *_):
+        controller, self._controller = self._controller, None
+        if controller is not None:
+            controller._release()
+
+
+class AdmissionController:
+    """
+    /ask 准入控制：
+    - 按调用方（通过校验的 API key，否则按客户端 IP）做令牌桶限流；未携带 key 的请求按 IP 计，
+      同一站点 NAT 后的多台终端共用一个桶，因此匿名桶单独配置、默认更宽松
+    - 限制同时进行的上游 Dify 流数量，超出时进入有界等待队列，等待超时或队列已满返回 429
+    令牌桶与并发信号量都在进程内，多 worker（WORKERS>1）部署时实际上限为配置值乘以 worker 数
+    """
+
+    def __init__(self, max_streams: int = int(os.getenv("ADMISSION_MAX_STREAMS", 16)),
+                 max_waiting: int = int(os.getenv("ADMISSION_MAX_WAITING", 32)),
+                 wait_timeout: float = float(os.getenv("ADMISSION_WAIT_TIMEOUT", 5)),
+                 rate: float = float(os.getenv("ADMISSION_RATE", 0.5)),
+                 burst: int = int(os.getenv("ADMISSION_BURST", 5)),
+                 anonymous_rate: float = float(os.getenv("ADMISSION_ANON_RATE", 2)),
+                 anonymous_burst: int = int(os.getenv("ADMISSION_ANON_BURST", 20)),
+                 require_api_key: bool = os.getenv("ADMISSION_REQUIRE_API_KEY", "false").lower() == "true",
+                 max_buckets: int = 10000):
+        """
+        初始化
+        :param max_streams: 同时进行的上游流上限，0 表示不限制
+        :param max_waiting: 等待队列长度上限
+        :param wait_timeout: 排队等待的最长时间（秒）
+        :param rate: 每个 API key 每秒允许的请求数，0 表示不限速
+        :param burst: 每个 API key 允许的突发请求数
+        :param anonymous_rate: 未携带有效 key 时每个客户端 IP 每秒允许的请求数，0 表示不限速
+        :param anonymous_burst: 未携带有效 key 时每个客户端 IP 允许的突发请求数
+        :param require_api_key: 是否要求 Authorization: Bearer <FASTAPI_API_KEY>
+        :param max_buckets: 令牌桶数量上限，超过时清理已回满的桶
+        """
+        self.max_streams = max_streams
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.rate = rate
+        self.burst = burst
+        self.anonymous_rate = anonymous_rate
+        self.anonymous_burst = anonymous_burst
+        self.require_api_key = require_api_key
+        self.max_buckets = max_buckets
+        self.active = 0
+        self.waiting = 0
+        self.buckets: dict[str, TokenBucket] = {}
+        self._semaphore = asyncio.Semaphore(max_streams) if max_streams > 0 else None
+
+    def _reject(self, reason: str, retry_after: float, detail: str):
+        ADMISSION_REJECTED.labels(reason=reason).inc()
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=detail,
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    def _check_rate(self, key: str, rate: float, burst: int):
+        if rate <= 0:
+            return
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                now = time.monotonic()
+                self.buckets = {k: b for k, b in self.buckets.items()
+                                if b.tokens + (now - b.updated_at) * b.rate < b.burst}
+            bucket = self.buckets[key] = TokenBucket(rate, burst)
+        retry_after = bucket.take()
+        if retry_after > 0:
+            self._reject("rate_limit", retry_after, "Too many requests")
+
+    async def _verified_api_key(self, request: Request) -> str | None:
+        credentials = await bearer_scheme(request)
+        if self.require_api_key:
+            return await verify_bearer_api_key(credentials)
+        # 不强制鉴权时携带的 token 同样须通过校验，否则视为未携带
+        if credentials is not None and credentials.credentials and os.getenv("FASTAPI_API_KEY", "").strip():
+            try:
+                return await verify_bearer_api_key(credentials)
+            except HTTPException:
+                pass
+        return None
+
+    @staticmethod
+    def _caller_key(request: Request, api_key: str | None) -> str:
+        # 只有通过校验的 key 才单独计桶；未校验的 token 一律按 IP 计，
+        # 否则每次请求换一个随机 token 即可拿到新桶绕过限流，并占满桶表
+        if api_key is not None:
+            return f"key:{api_key}"
+        return f"ip:{request.client.host if request.client else 'unknown'}"
+
+    async def admit(self, request: Request) -> AdmissionSlot:
+        """
+        通过限流与并发检查后返回占用凭证；上游流结束时须调用 slot.release()
+        """
+        api_key = await self._verified_api_key(request)
+        rate, burst = (self.rate, self.burst) if api_key is not None else (self.anonymous_rate, self.anonymous_burst)
+        self._check_rate(self._caller_key(request, api_key), rate, burst)
+        if self._semaphore is None:
+            return AdmissionSlot(None, api_key)
+
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                self._reject("queue_full", self.wait_timeout, "Server busy")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.wait_timeout)
+            except asyncio.TimeoutError:
+                self._reject("wait_timeout", self.wait_timeout, "Server busy")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+        return AdmissionSlot(self, api_key)
+
+    def _release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+
+admission_controller = AdmissionController()
+ADMISSION_SLOTS.set_function(lambda: admission_controller.active, state="active")
+ADMISSION_SLOTS.set_function(lambda: admission_controller.waiting, state="waiting")
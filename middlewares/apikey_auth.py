@@ -9,18 +9,19 @@ bearer_scheme = HTTPBearer(auto_error=False)
 
 
 @lru_cache()
-def _get_expected_api_key() -> str:
-    api_key = os.getenv("FASTAPI_API_KEY")
-    if not api_key:
+def _get_expected_api_keys() -> tuple[str, ...]:
+    # 支持逗号分隔的多个 key，便于按调用方分别限流
+    api_keys = tuple(key.strip() for key in os.getenv("FASTAPI_API_KEY", "").split(",") if key.strip())
+    if not api_keys:
         raise RuntimeError("FASTAPI_API_KEY is not set in environment variables")
-    return api_key
+    return api_keys
 
 
 async def verify_bearer_api_key(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
-) -> None:
+) -> str:
     """
-    全局依赖：验证 Authorization: Bearer <token>
+    全局依赖：验证 Authorization: Bearer <token>，返回通过校验的 token
     - 缺失或 scheme 不为 Bearer -> 401
     - 值不匹配 -> 401
     """
@@ -33,12 +34,15 @@ async def verify_bearer_api_key(
         )
 
     provided = credentials.credentials or ""
-    expected = _get_expected_api_key()
 
-    # 常量时间比较，避免时序攻击
-    if not hmac.compare_digest(provided, expected):
+    # 常量时间比较，避免时序攻击；逐个比较完所有 key，不因提前命中而暴露位置
+    matched = False
+    for expected in _get_expected_api_keys():
+        matched |= hmac.compare_digest(provided, expected)
+    if not matched:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key",
             headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        )
+    return provided
@@ -0,0 +1,183 @@
+import os
+import numpy as np
+
+# 建立因果链索引的关系，如 A 导致 B、A 需要 B
+CAUSAL_RELATIONS = [r for r in os.getenv("CAUSAL_RELATIONS", "导致,需要").split(",") if r]
+# 强连通分量数不超过该值时预计算传递闭包（位矩阵，约 C^2/8 字节），否则查询时按图遍历
+CAUSAL_CLOSURE_MAX_COMPONENTS = int(os.getenv("CAUSAL_CLOSURE_MAX_COMPONENTS", 20000))
+
+
+def build_csr(sources: np.ndarray, targets: np.ndarray, node_count: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    邻接表压缩为 CSR：节点 v 的后继为 indices[indptr[v]:indptr[v + 1]]
+    """
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=node_count), out=indptr[1:])
+    return indptr, targets[order].astype(np.int32)
+
+
+def strongly_connected_components(indptr: np.ndarray, indices: np.ndarray) -> tuple[np.ndarray, int]:
+    """
+    迭代版 Tarjan 算法
+    :return: (每个节点的分量编号, 分量数)；编号按逆拓扑序，即分量的后继分量编号都更小
+    """
+    node_count = len(indptr) - 1
+    indptr, indices = indptr.tolist(), indices.tolist()
+    order, low = [-1] * node_count, [0] * node_count
+    on_stack = [False] * node_count
+    component = [-1] * node_count
+    stack, counter, component_count = [], 0, 0
+    for root in range(node_count):
+        if order[root] != -1:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, indptr[root])]
+        while work:
+            node, cursor = work[-1]
+            if cursor < indptr[node + 1]:
+                work[-1] = (node, cursor + 1)
+                successor = indices[cursor]
+                if order[successor] == -1:
+                    order[successor] = low[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack[successor] = True
+                    work.append((successor, indptr[successor]))
+                elif on_stack[successor]:
+                    low[node] = min(low[node], order[successor])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == order[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = component_count
+                    if member == node:
+                        break
+                component_count += 1
+    return np.array(component, dtype=np.int32), component_count
+
+
+class RelationIndex:
+    """
+    单一关系（如“导致”）上的可达性索引，加载时构建：
+    - 只对参与该关系的节点建立紧凑编号，正向/反向邻接均为 CSR
+    - 强连通分量缩点得到 DAG，按逆拓扑序一次性计算每个分量的后代位集（传递闭包）
+    查询“X 能否导致 Y”为 O(1)，“X 的全部后果/原因”为一次位集展开，具体链路由有界 BFS 给出
+    """
+
+    def __init__(self, heads: np.ndarray, tails: np.ndarray, max_closure: int = CAUSAL_CLOSURE_MAX_COMPONENTS):
+        """
+        初始化
+        :param heads: 该关系三元组的 head 全局节点编号
+        :param tails: 该关系三元组的 tail 全局节点编号
+        :param max_closure: 预计算传递闭包的分量数上限
+        """
+        self.nodes, local = np.unique(np.concatenate([heads, tails]), return_inverse=True)
+        size = len(self.nodes)
+        edges = np.unique(np.stack([local[:len(heads)], local[len(heads):]], axis=1), axis=0).reshape(-1, 2)
+        self.edge_count = len(edges)
+        self.self_loops = set(edges[edges[:, 0] == edges[:, 1], 0].tolist())
+        self.forward = build_csr(edges[:, 0], edges[:, 1], size)
+        self.backward = build_csr(edges[:, 1], edges[:, 0], size)
+        self.local = {int(node): i for i, node in enumerate(self.nodes)}
+
+        self.component, self.component_count = strongly_connected_components(*self.forward)
+        self.component_sizes = np.bincount(self.component, minlength=self.component_count)
+        self.closure = None
+        if 0 < self.component_count <= max_closure:
+            self.closure = self._build_closure(edges)
+
+    def _build_closure(self, edges: np.ndarray) -> np.ndarray:
+        """
+        (C, ceil(C/8)) 位矩阵，第 c 行为分量 c 可达的全部分量（含自身）
+        """
+        count = self.component_count
+        component_edges = np.unique(self.component[edges], axis=0)
+        component_edges = component_edges[component_edges[:, 0] != component_edges[:, 1]]
+        indptr, indices = build_csr(component_edges[:, 0], component_edges[:, 1], count)
+        closure = np.zeros((count, (count + 7) // 8), dtype=np.uint8)
+        for c in range(count):
+            # 逆拓扑序：后继分量编号都更小，其行已计算完成
+            successors = indices[indptr[c]:indptr[c + 1]]
+            if len(successors):
+                np.bitwise_or.reduce(closure[successors], axis=0, out=closure[c])
+            closure[c, c >> 3] |= np.uint8(0x80 >> (c & 7))
+        return closure
+
+    def __contains__(self, node_id: int) -> bool:
+        return node_id in self.local
+
+    def reaches(self, source: int, target: int) -> bool:
+        """
+        全局节点 source 是否能经一条或多条该关系到达 target
+        """
+        if source not in self.local or target not in self.local:
+            return False
+        s, t = self.component[self.local[source]], self.component[self.local[target]]
+        if s == t:
+            # 同一强连通分量：分量内有环时互相可达（含自身），单节点仅在有自环时可达自身
+            return bool(self.component_sizes[s] > 1) or self.local[source] in self.self_loops
+        if self.closure is not None:
+            return bool(self.closure[s, t >> 3] & (0x80 >> (t & 7)))
+        return target in {node for node, _, _ in self.walk([source], forward=True, max_depth=len(self.nodes))}
+
+    def reachable(self, sources: list[int], forward: bool = True) -> np.ndarray:
+        """
+        sources 的全部后代（forward）或祖先的全局节点编号，不含 sources 本身
+        """
+        local = [self.local[s] for s in sources if s in self.local]
+        if not local:
+            return np.zeros(0, dtype=self.nodes.dtype)
+        if self.closure is None:
+            return np.array([node for node, depth, _ in self.walk(sources, forward, len(self.nodes)) if depth],
+                            dtype=self.nodes.dtype)
+        components = np.unique(self.component[local])
+        if forward:
+            bits = np.bitwise_or.reduce(self.closure[components], axis=0)
+            reached = np.unpackbits(bits, count=self.component_count).astype(bool)
+        else:
+            columns = self.closure[:, components >> 3] & (0x80 >> (components & 7)).astype(np.uint8)
+            reached = columns.any(axis=1)
+        mask = reached[self.component]
+        mask[local] = False
+        return self.nodes[mask]
+
+    def walk(self, sources: list[int], forward: bool = True, max_depth: int = 6):
+        """
+        从 sources 出发按层 BFS，依次产出 (全局节点编号, 深度, 最短链路上的前驱全局编号)
+        """
+        indptr, indices = self.forward if forward else self.backward
+        frontier = [self.local[s] for s in dict.fromkeys(sources) if s in self.local]
+        visited = set(frontier)
+        for node in frontier:
+            yield int(self.nodes[node]), 0, None
+        depth = 0
+        while frontier and depth < max_depth:
+            depth += 1
+            next_frontier = []
+            for node in frontier:
+                for successor in indices[indptr[node]:indptr[node + 1]].tolist():
+                    if successor not in visited:
+                        visited.add(successor)
+                        next_frontier.append(successor)
+                        yield int(self.nodes[successor]), depth, int(self.nodes[node])
+            frontier = next_frontier
+
+    def cycles(self, node_id: int) -> np.ndarray:
+        """
+        与 node_id 处于同一个环（强连通分量）中的全局节点编号，无环时为空
+        """
+        if node_id not in self.local:
+            return np.zeros(0, dtype=self.nodes.dtype)
+        component = self.component[self.local[node_id]]
+        if self.component_sizes[component] < 2:
+            return self.nodes[:0]
+        return self.nodes[self.component == component]
@@ -0,0 +1,132 @@
+import os
+import zlib
+from middlewares.metrics import COMPRESSION_BYTES
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+DEFAULT_CONTENT_TYPES = ("text/event-stream,application/json,text/html,text/markdown,text/plain,"
+                         "text/css,application/javascript")
+
+
+class FrameCompressor:
+    """
+    gzip 流式压缩：每个数据块压缩后立即 Z_SYNC_FLUSH，客户端收到即可解出完整帧，
+    不会因压缩缓冲而推迟 token；压缩字典在整个流内共享，重复的 JSON 键仍能被压缩
+    """
+
+    def __init__(self, level: int = 5):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, chunk: bytes = b"") -> bytes:
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_FINISH)
+
+
+class StreamingCompressionMiddleware:
+    """
+    纯 ASGI 响应压缩中间件（gzip），兼容流式响应：
+    - 只压缩白名单中的内容类型，已带 Content-Encoding 的响应（如图片派生）原样发出
+    - 一次性响应小于 minimum_size 时不压缩
+    - 流式响应（SSE、分块下载）逐块压缩并同步刷新
+    """
+
+    def __init__(self, app, minimum_size: int = int(os.getenv("COMPRESSION_MIN_SIZE", 500)),
+                 level: int = int(os.getenv("COMPRESSION_LEVEL", 5)),
+                 content_types: str = os.getenv("COMPRESSION_CONTENT_TYPES", DEFAULT_CONTENT_TYPES)):
+        """
+        初始化
+        :param minimum_size: 一次性响应的最小压缩字节数
+        :param level: zlib 压缩级别 1-9，级别越高 CPU 越多
+        :param content_types: 逗号分隔的可压缩内容类型
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.content_types = tuple(t.strip().lower() for t in content_types.split(",") if t.strip())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD" or not self._accepts_gzip(scope):
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def compressed_send(message):
+            if message["type"] == "http.response.start":
+                headers = {k.lower(): v for k, v in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip().lower()
+                state["passthrough"] = (b"content-encoding" in headers or message["status"] in (204, 206, 304)
+                                        or content_type not in self.content_types)
+                if state["passthrough"]:
+                    await send(message)
+                elif content_type == "text/event-stream":
+                    # SSE 必然是流式响应，立即发出响应头，不等第一条事件
+                    state["compressor"] = FrameCompressor(self.level)
+                    await send(self._compressed_start(message))
+                else:
+                    # 等第一个响应体到达后再决定是否压缩
+                    state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if state["start"] is not None:
+                start, state["start"] = state["start"], None
+                if not more_body and len(body) < self.minimum_size:
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                state["compressor"] = FrameCompressor(self.level)
+                if not more_body:
+                    compressed = state["compressor"].finish(body)
+                    await send(self._compressed_start(start, len(compressed)))
+                    await self._send_body(send, body, compressed, False)
+                    return
+                await send(self._compressed_start(start))
+
+            compressor = state["compressor"]
+            compressed = compressor.finish(body) if not more_body else compressor.compress(body)
+            await self._send_body(send, body, compressed, more_body)
+
+        await self.app(scope, receive, compressed_send)
+
+    @staticmethod
+    def _compressed_start(start: dict, content_length: int | None = None) -> dict:
+        headers = [(k, v) for k, v in start.get("headers", []) if k.lower() not in (b"content-length", b"vary")]
+        headers.append((b"content-encoding", b"gzip"))
+        # 合并已有的 Vary（如图片派生的 Vary: Accept），同一响应只保留一个 Vary 头
+        vary = [v.decode("latin-1").strip() for k, v in start.get("headers", []) if k.lower() == b"vary"]
+        fields = [f.strip() for value in vary for f in value.split(",") if f.strip()]
+        if "*" not in fields and "accept-encoding" not in (f.lower() for f in fields):
+            fields.append("Accept-Encoding")
+        headers.append((b"vary", ", ".join(fields).encode("latin-1")))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        return {**start, "headers": headers}
+
+    @staticmethod
+    async def _send_body(send, raw: bytes, compressed: bytes, more_body: bool):
+        COMPRESSION_BYTES.labels(stage="raw").inc(len(raw))
+        COMPRESSION_BYTES.labels(stage="wire").inc(len(compressed))
+        await send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    @staticmethod
+    def _accepts_gzip(scope) -> bool:
+        for key, value in scope.get("headers", []):
+            if key == b"accept-encoding":
+                for part in value.decode("latin-1").lower().split(","):
+                    coding, _, params = part.partition(";")
+                    if coding.strip() not in ("gzip", "*"):
+                        continue
+                    quality = params.strip()[2:] if params.strip().startswith("q=") else "1"
+                    try:
+                        if float(quality) > 0:
+                            return True
+                    except ValueError:
+                        continue
+        return False
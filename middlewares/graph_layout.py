@@ -0,0 +1,147 @@
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+
+# client：由前端 ECharts 力导向布局（旧行为）；server：服务端预先计算坐标，输出 layout=none 的固定布局
+GRAPH_LAYOUT = os.getenv("GRAPH_LAYOUT", "client")
+
+
+def force_layout(node_count: int, edges: np.ndarray, iterations: int = 200, size: float = 1000.0,
+                 gravity: float = 0.05, seed: int = 0) -> np.ndarray:
+    """
+    Fruchterman-Reingold 力导向布局，斥力按全部节点对、引力按边一次性向量化计算（float32）
+    :param node_count: 节点数
+    :param edges: (E, 2) 节点下标对，自环与重复边会被忽略
+    :param iterations: 迭代次数，步长随迭代线性冷却
+    :param size: 输出坐标范围 [0, size]
+    :param gravity: 指向中心的引力系数，避免不连通的子图漂散
+    :param seed: 初始位置的随机种子，相同输入得到相同布局
+    :return: (N, 2) float32 坐标
+    """
+    if node_count == 0:
+        return np.zeros((0, 2), dtype=np.float32)
+    if node_count == 1:
+        return np.full((1, 2), size / 2, dtype=np.float32)
+
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = np.unique(np.sort(edges[edges[:, 0] != edges[:, 1]], axis=1), axis=0)
+    source, target = edges[:, 0], edges[:, 1]
+
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(-1.0, 1.0, (node_count, 2)).astype(np.float32)
+    k_sq = np.float32(4.0 / node_count)
+    k = np.sqrt(k_sq)
+    temperature = 0.2
+    for step in range(iterations):
+        # 斥力 k^2 / d，方向 delta / d：两两距离用 Gram 矩阵计算，合力 = pos * sum(w) - w @ pos
+        squared = (positions * positions).sum(axis=1)
+        distance_sq = squared[:, None] + squared[None, :] - 2 * (positions @ positions.T)
+        weights = k_sq / np.maximum(distance_sq, 1e-4)
+        np.fill_diagonal(weights, 0)
+        displacement = positions * weights.sum(axis=1)[:, None] - weights @ positions
+
+        # 引力 d^2 / k，沿边方向
+        edge_delta = positions[source] - positions[target]
+        edge_force = edge_delta * (np.sqrt((edge_delta * edge_delta).sum(axis=1)) / k)[:, None]
+        for axis in range(2):
+            displacement[:, axis] += (np.bincount(target, edge_force[:, axis], node_count)
+                                      - np.bincount(source, edge_force[:, axis], node_count)).astype(np.float32)
+        displacement -= gravity * positions * node_count ** 0.5
+
+        length = np.maximum(np.sqrt((displacement * displacement).sum(axis=1)), 1e-9)[:, None]
+        positions += displacement / length * np.minimum(length, temperature * (1 - step / iterations) + 1e-3)
+
+    positions -= positions.min(axis=0)
+    positions *= size / max(float(positions.max()), 1e-9)
+    return positions.astype(np.float32)
+
+
+def graph_key(nodes: list[str], edges: list[tuple[str, str]]) -> str:
+    """
+    子图缓存键：与节点、边的顺序无关
+    """
+    digest = hashlib.sha1()
+    for part in sorted(nodes) + ["\x00"] + sorted(f"{head}\x01{tail}" for head, tail in edges):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x02")
+    return digest.hexdigest()
+
+
+def _layout_positions(nodes: list[str], edges: list[tuple[str, str]], iterations: int, size: float) -> dict:
+    index = {node: i for i, node in enumerate(nodes)}
+    edge_array = np.array([(index[head], index[tail]) for head, tail in edges], dtype=np.int64).reshape(-1, 2)
+    coordinates = force_layout(len(nodes), edge_array, iterations=iterations, size=size)
+    return {node: (round(float(x), 1), round(float(y), 1)) for node, (x, y) in zip(nodes, coordinates)}
+
+
+class GraphLayoutEngine:
+    """
+    服务端图布局：在线程池或进程池中计算，按子图缓存坐标（LRU），
+    相同子图的并发请求共享同一次计算
+    """
+
+    def __init__(self, executor: str = os.getenv("GRAPH_LAYOUT_EXECUTOR", "thread"),
+                 workers: int = int(os.getenv("GRAPH_LAYOUT_WORKERS", 2)),
+                 cache_size: int = int(os.getenv("GRAPH_LAYOUT_CACHE_SIZE", 512)),
+                 iterations: int = int(os.getenv("GRAPH_LAYOUT_ITERATIONS", 200)),
+                 size: float = float(os.getenv("GRAPH_LAYOUT_SIZE", 1000))):
+        """
+        初始化
+        :param executor: thread 或 process，节点很多时进程池可避免与事件循环争抢 GIL
+        :param workers: 线程/进程数
+        :param cache_size: 缓存的子图数量
+        :param iterations: 力导向迭代次数
+        :param size: 坐标范围
+        """
+        self.executor_type = executor
+        self.workers = workers
+        self.cache_size = cache_size
+        self.iterations = iterations
+        self.size = size
+        self.cache: OrderedDict[str, dict] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._executor: Executor | None = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="graph-layout")
+        return self._executor
+
+    async def positions(self, nodes: list[str], edges: list[tuple[str, str]]) -> dict:
+        """
+        返回 节点名 -> (x, y)，命中缓存时不再计算
+        """
+        key = graph_key(nodes, edges)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            return cached
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().run_in_executor(self._get_executor(), _layout_positions, sorted(nodes),
+                                                            list(edges), self.iterations, self.size)
+        self._pending[key] = future
+        try:
+            positions = await asyncio.shield(future)
+        finally:
+            self._pending.pop(key, None)
+        self.cache[key] = positions
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return positions
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+graph_layout = GraphLayoutEngine()
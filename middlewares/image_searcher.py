@@ -1,15 +1,80 @@
 import os
 import json
+import asyncio
 import numpy as np
-import jieba
-from tqdm import tqdm
-from openai import OpenAI
+from middlewares.metrics import observe_stage
+from middlewares.resilience import embedding_policy
+from middlewares.segmenter import segmenter
+from middlewares.lexical_index import LexicalIndex
+from middlewares.quantization import quantize, score_quantized
+from middlewares.shared_index import SharedArrayStore, SharedIndexWatcher, fingerprint, file_state
+
+SHARED_INDEX_NAME = "image_embeddings"
+# 离线批量构建的图片内容索引（initial-functions/image_content_index_build.py）
+CONTENT_INDEX_NAME = "image_content"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def image_name(image_path: str) -> str:
+    """
+    由图片路径取出不含扩展名的文件名（兼容缓存中的 Windows 路径分隔符）
+    """
+    return os.path.splitext(os.path.basename(image_path.replace("\\", "/")))[0]
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    取得分最高的 top_k 个下标（降序）；图片较多时用 argpartition 避免全量排序
+    """
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(scores, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def score_queries(embeddings: np.ndarray, query_matrix: np.ndarray, block_rows: int = 256) -> np.ndarray:
+    """
+    计算 (查询数, 图片数) 余弦相似度矩阵
+    查询数很小时整块 gemm 效率低于 gemv，按行分块使每块图片向量留在缓存中，耗时接近单次 gemv
+    """
+    return score_quantized(embeddings, query_matrix, block_rows=block_rows)
+
+
+def fuse_scores(score_matrix: np.ndarray, fusion: str = "max", top_k: int = 1, rrf_k: int = 60):
+    """
+    融合多个查询改写对全部图片的得分矩阵
+    :param score_matrix: (查询数, 图片数) 得分矩阵
+    :param fusion: mean（等价于旧版的平均查询向量）、max（取各图片的最佳查询得分）或 rrf（倒数排名融合）
+    :param top_k: 返回前k个结果
+    :param rrf_k: RRF 平滑常数
+    :return: (图片下标, 得分, 最佳匹配查询下标)；rrf 按融合名次排序，得分仍为最佳查询的得分，便于阈值过滤
+    """
+    best_query = np.argmax(score_matrix, axis=0)
+    best_scores = score_matrix[best_query, np.arange(score_matrix.shape[1])]
+    if fusion == "mean":
+        fused = score_matrix.mean(axis=0)
+        indices = top_k_indices(fused, top_k)
+        return indices, fused[indices], best_query[indices]
+    if fusion == "rrf":
+        order = np.argsort(-score_matrix, axis=1)
+        ranks = np.empty_like(order)
+        ranks[np.arange(score_matrix.shape[0])[:, None], order] = np.arange(score_matrix.shape[1])
+        fused = (1.0 / (rrf_k + ranks + 1)).sum(axis=0)
+        indices = top_k_indices(fused, top_k)
+        return indices, best_scores[indices], best_query[indices]
+    indices = top_k_indices(best_scores, top_k)
+    return indices, best_scores[indices], best_query[indices]
 
 
 class ImageSemanticSearcher:
     """
     基于阿里云 DashScope embedding 的图片语义检索器
     支持本地缓存 embedding，提升性能
+    embedding 矩阵发布到共享索引目录，多个 worker 以只读 mmap 共享同一份内存
     """
 
     def __init__(self, image_dir: str = os.getenv("STATIC_IMAGE_PATH"),
@@ -17,7 +82,14 @@ class ImageSemanticSearcher:
                  api_key: str = os.getenv("DASHSCOPE_API_KEY"),
                  base_url: str = os.getenv("DASHSCOPE_BASE_URL"),
                  model="text-embedding-v4",
-                 dimensions=1024):
+                 dimensions=int(os.getenv("IMAGE_EMBEDDING_DIMENSIONS", 1024)),
+                 shared_store: SharedArrayStore | None = None,
+                 lexical_weight: float = float(os.getenv("IMAGE_SEARCH_LEXICAL_WEIGHT", 0.3)),
+                 lexical_fast_path: bool = os.getenv("IMAGE_SEARCH_LEXICAL_FAST_PATH", "true").lower() == "true",
+                 query_fusion: str = os.getenv("IMAGE_SEARCH_QUERY_FUSION", "max"),
+                 precision: str = os.getenv("IMAGE_INDEX_PRECISION", "float32"),
+                 rerank_candidates: int = int(os.getenv("IMAGE_INDEX_RERANK_CANDIDATES", 50)),
+                 index_source: str = os.getenv("IMAGE_INDEX_SOURCE", "names")):
         """
         初始化
         :param image_dir: 图片目录
@@ -25,24 +97,105 @@ class ImageSemanticSearcher:
         :param api_key_env: 环境变量名
         :param base_url: 阿里云兼容OpenAI接口URL
         :param model: embedding模型
-        :param dimensions: 向量维度
+        :param dimensions: 向量维度（DashScope 支持降维输出，修改后缓存中维度不符的向量会重新生成）
+        :param shared_store: 共享索引存储，默认使用 SHARED_INDEX_PATH
+        :param lexical_weight: 混合排序中 BM25 词法得分的权重，0 表示纯向量排序
+        :param lexical_fast_path: 查询中完整出现图片名时直接返回，跳过 embedding 调用
+        :param query_fusion: 多个查询改写的融合方式：mean / max / rrf，见 fuse_scores
+        :param precision: 检索扫描用的向量精度：float32 / float16 / int8
+        :param rerank_candidates: 量化扫描后取前多少个候选按 float32 原始向量重排
+        :param index_source: names：按文件名 embedding 缓存构建；content：挂载离线构建的图片内容索引，
+                             未构建时回退到 names
         """
         self.image_dir = image_dir
         self.cache_path = cache_path
+        # openai 导入较重（约 0.4s），放到构造时导入，配合并行启动在工作线程中完成
+        from openai import OpenAI
         self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # 在线查询由 embedding_policy 负责超时、重试与对冲，客户端自身不再重试
+        self.query_client = self.client.with_options(timeout=embedding_policy.timeout, max_retries=0)
         self.model = model
         self.dimensions = dimensions
+        self.lexical_weight = lexical_weight
+        self.lexical_fast_path = lexical_fast_path
+        self.query_fusion = query_fusion
+        self.precision = precision
+        self.rerank_candidates = rerank_candidates
+        self._lexical_index = None
 
         self.image_texts = []
+        self.documents = []
         self.image_paths = []
         self.embeddings = None
+        self.codes = None
+        self.scales = None
+        self.index_version = None
+        self.shared_store = shared_store if shared_store is not None else SharedArrayStore()
+
+        # 1️⃣ 离线内容索引由构建脚本发布，直接挂载当前版本
+        if index_source == "content":
+            attached = self.shared_store.attach(CONTENT_INDEX_NAME)
+            if attached is not None:
+                self._on_index_change(*attached)
+                self._watcher = SharedIndexWatcher(self.shared_store, CONTENT_INDEX_NAME, self._on_index_change)
+                self._watcher.version = attached[0]
+                print(f"✅ 已挂载图片内容索引 {attached[0]}（{len(self.image_paths)} 张）")
+                return
+            print("⚠️ 未找到图片内容索引，回退到文件名 embedding")
+
+        # 2️⃣ 优先挂载其他 worker 已发布的同版本共享索引，否则加载缓存或初始化后发布
+        version = self._source_version()
+        attached = self.shared_store.attach(SHARED_INDEX_NAME, version)
+        if attached is None:
+            self._load_or_generate_embeddings()
+            # 增量生成会改写缓存文件，版本须按写入后的状态计算，否则下次启动版本不一致又会重新发布
+            version = self._source_version()
+            arrays = {"embeddings": self.embeddings}
+            if self.precision != "float32":
+                arrays.update(quantize(self.embeddings, self.precision))
+            self.shared_store.publish(SHARED_INDEX_NAME, version, arrays,
+                                      {"image_paths": self.image_paths, "image_texts": self.image_texts,
+                                       "precision": self.precision})
+            attached = self.shared_store.attach(SHARED_INDEX_NAME, version)
+        self._on_index_change(*attached)
+        self._watcher = SharedIndexWatcher(self.shared_store, SHARED_INDEX_NAME, self._on_index_change)
+        self._watcher.version = version
+
+    def _source_version(self) -> str:
+        """
+        以缓存文件状态、图片列表与模型参数计算索引版本
+        """
+        return fingerprint(file_state(self.cache_path), sorted(os.listdir(self.image_dir)),
+                           self.model, self.dimensions, self.precision)
 
-        # 1️⃣ 加载缓存或初始化
-        self._load_or_generate_embeddings()
+    def _on_index_change(self, version: str, arrays: dict, meta: dict):
+        """
+        切换到共享索引的某个版本（只读 mmap）
+        量化索引检索时只扫描 codes，float32 原始矩阵仅在重排时按候选行读取，
+        未被访问的页不会进入内存
+        """
+        self.embeddings = arrays["embeddings"]
+        self.codes = arrays.get("codes")
+        self.scales = arrays.get("scales")
+        self.image_paths = meta["image_paths"]
+        self.image_texts = meta.get("image_texts", [])
+        self.documents = meta.get("documents", [])
+        self.index_version = version
+        # 查询向量须与索引使用相同的模型与维度
+        self.model = meta.get("model", self.model)
+        self.dimensions = meta.get("dimensions", self.dimensions)
+        # 词法索引依赖分词词典，首次检索时再构建
+        self._lexical_index = None
 
-    async def _generate_embedding(self, text):
+    def _get_lexical_index(self) -> LexicalIndex:
+        if self._lexical_index is None:
+            texts = self.image_texts or [image_name(path) for path in self.image_paths]
+            self._lexical_index = LexicalIndex(texts, segmenter.lcut_for_search, documents=self.documents or None)
+        return self._lexical_index
+
+    def _embed(self, text):
         """
-        调用 API 获取 embedding 向量
+        同步调用 API 获取 embedding 向量（启动时增量生成使用）
         """
         resp = self.client.embeddings.create(
             model=self.model,
@@ -51,6 +204,16 @@ class ImageSemanticSearcher:
         )
         return resp.data[0].embedding
 
+    async def _generate_embeddings(self, texts: list[str]) -> list:
+        """
+        一次请求获取多个查询改写的 embedding，在线程中执行避免阻塞事件循环；
+        按 embedding_policy 限时、重试，慢请求在 p95 之后对冲
+        """
+        def embed_batch():
+            resp = self.query_client.embeddings.create(model=self.model, input=texts, dimensions=self.dimensions)
+            return [item.embedding for item in sorted(resp.data, key=lambda item: item.index)]
+        return await embedding_policy.call(lambda: asyncio.to_thread(embed_batch))
+
     def _load_or_generate_embeddings(self):
         """
         加载缓存，如果有新图片则增量生成
@@ -64,21 +227,20 @@ class ImageSemanticSearcher:
                 embeddings_dict = json.load(f)
             print(f"✅ 已加载缓存 embedding ({len(embeddings_dict)} 条)。")
 
-        # 逐个文件检查
+        # 逐个文件检查；只有缺少 embedding 的新图片才需要分词，避免启动时加载分词词典
         updated = False
-        for file in tqdm(os.listdir(self.image_dir)):
-            if not file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp')):
+        for file in os.listdir(self.image_dir):
+            if not file.lower().endswith(IMAGE_EXTENSIONS):
                 continue
 
             img_path = os.path.join(self.image_dir, file)
             img_name = os.path.splitext(file)[0]
-            seg_text = " ".join(jieba.lcut(img_name))
 
             self.image_paths.append(img_path)
-            self.image_texts.append(seg_text)
 
-            if img_path not in embeddings_dict:
-                embedding = self._generate_embedding(seg_text)
+            if img_path not in embeddings_dict or len(embeddings_dict[img_path]) != self.dimensions:
+                seg_text = segmenter.segment(img_name)
+                embedding = self._embed(seg_text)
                 embeddings_dict[img_path] = embedding
                 updated = True
 
@@ -91,37 +253,79 @@ class ImageSemanticSearcher:
         # 转换为矩阵
         self.embeddings = np.array(list(embeddings_dict.values()), dtype=np.float32)
         self.image_paths = list(embeddings_dict.keys())
+        self.image_texts = [image_name(path) for path in self.image_paths]
 
         # 归一化（余弦相似度更快）
         self.embeddings = self.embeddings / np.linalg.norm(self.embeddings, axis=1, keepdims=True)
         print(f"✅ 已加载 {len(self.image_paths)} 张图片的 embedding。")
 
-    async def search(self, query_texts, top_k=1):
+    def _hybrid(self, vector_scores: np.ndarray, lexical_scores: np.ndarray) -> np.ndarray:
+        if self.lexical_weight > 0:
+            return (1 - self.lexical_weight) * vector_scores + self.lexical_weight * lexical_scores
+        return vector_scores
+
+    async def search(self, query_texts, top_k=1, with_query=False):
         """
         搜索最相似的图片
         :param query_texts: list[str] 查询句子（可以是改写的多个版本）
         :param top_k: 返回前k个结果
+        :param with_query: 为 True 时每个结果附带最佳匹配的查询下标 (path, score, query_index)
+        :return: 按混合得分排序；score 为最佳查询的余弦相似度（词法快速路径命中时为 1.0）
         """
         if isinstance(query_texts, str):
             query_texts = [query_texts]
 
-        # 合并多个改写的embedding取平均（提升鲁棒性）
-        query_embeddings = []
-        for text in query_texts:
-            seg_text = " ".join(jieba.lcut(text))
-            emb = np.array(await self._generate_embedding(seg_text), dtype=np.float32)
-            emb /= np.linalg.norm(emb)
-            query_embeddings.append(emb)
+        # 索引被其他进程重建时切换到新版本
+        self._watcher.maybe_refresh()
 
-        query_vec = np.mean(query_embeddings, axis=0)
+        lexical_index = self._get_lexical_index()
+        embeddings, codes, scales, image_paths = self.embeddings, self.codes, self.scales, self.image_paths
+        with observe_stage("/query-to-image", "lexical"):
+            lexical_scores = np.stack([lexical_index.score(text) for text in query_texts])
 
-        # 本地计算余弦相似度
-        scores = np.dot(self.embeddings, query_vec)
+            # 查询中直接给出了图片名（如 WTZJ-Ⅰ型电源接口面板），无需再调用 embedding
+            if self.lexical_fast_path:
+                hits = {}
+                for query_index, text in enumerate(query_texts):
+                    for i in lexical_index.exact_hits(text, np.flatnonzero(lexical_scores[query_index])):
+                        hits.setdefault(i, query_index)
+                if hits:
+                    ranked = sorted(hits, key=lambda i: lexical_scores[hits[i], i], reverse=True)[:top_k]
+                    return [(image_paths[i], 1.0, hits[i]) if with_query else (image_paths[i], 1.0)
+                            for i in ranked]
 
-        top_indices = np.argsort(scores)[::-1][:top_k]
-        results = [(self.image_paths[i], float(scores[i])) for i in top_indices]
-        return results
+        # 多个查询改写一次请求取得 embedding
+        with observe_stage("/query-to-image", "embedding"):
+            seg_texts = [segmenter.segment(text) for text in query_texts]
+            try:
+                query_matrix = np.array(await self._generate_embeddings(seg_texts), dtype=np.float32)
+            except Exception as e:
+                # 超时、重试耗尽或熔断打开：本次不返回图片，不拖慢问答流
+                print(f"⚠️ embedding 调用失败，跳过图片检索: {e!r}")
+                return []
+            query_matrix /= np.linalg.norm(query_matrix, axis=1, keepdims=True)
 
+        with observe_stage("/query-to-image", "scoring"):
+            # (查询数, 图片数) 余弦相似度一次矩阵乘得到，与词法得分线性融合后排序；
+            # 返回的得分仍是最佳查询的余弦相似度，推送阈值不随词法权重变化
+            if codes is None:
+                vector_matrix = score_queries(embeddings, query_matrix)
+                indices, _, best_query = fuse_scores(self._hybrid(vector_matrix, lexical_scores),
+                                                     self.query_fusion, top_k)
+                scores = vector_matrix[best_query, indices]
+            else:
+                # 量化矩阵粗排取候选，再用 float32 原始向量对候选精排
+                score_matrix = self._hybrid(score_quantized(codes, query_matrix, scales), lexical_scores)
+                candidates, _, _ = fuse_scores(score_matrix, self.query_fusion, max(self.rerank_candidates, top_k))
+                candidates = np.sort(candidates)
+                vector_matrix = score_queries(embeddings[candidates], query_matrix)
+                indices, _, best_query = fuse_scores(self._hybrid(vector_matrix, lexical_scores[:, candidates]),
+                                                     self.query_fusion, top_k)
+                scores = vector_matrix[best_query, indices]
+                indices = candidates[indices]
+            if with_query:
+                return [(image_paths[i], float(score), int(q)) for i, score, q in zip(indices, scores, best_query)]
+            return [(image_paths[i], float(score)) for i, score in zip(indices, scores)]
 
 
 if __name__ == '__main__':
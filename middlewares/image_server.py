@@ -0,0 +1,187 @@
+import os
+import asyncio
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import HTTPException
+from fastapi.responses import Response, FileResponse
+
+
+class StaticImageServer:
+    """
+    静态图片服务：
+    - 基于 STATIC_IMAGE_PATH 的安全路径解析，拒绝 `..` 越界访问
+    - 强 ETag / Last-Modified，命中 If-None-Match / If-Modified-Since 时返回 304
+    - 长期 immutable 缓存头
+    - 小文件内存 LRU 缓存，以 (mtime, size) 校验失效
+    - 单区间 Range 请求（206）
+    """
+
+    def __init__(self, image_dir: str = os.getenv("STATIC_IMAGE_PATH"),
+                 max_age: int = int(os.getenv("IMAGE_CACHE_MAX_AGE", 31536000)),
+                 max_cached_file_size: int = int(os.getenv("IMAGE_MEMORY_CACHE_FILE_LIMIT", 2 * 1024 * 1024)),
+                 max_cache_bytes: int = int(os.getenv("IMAGE_MEMORY_CACHE_BYTES", 64 * 1024 * 1024))):
+        """
+        初始化
+        :param image_dir: 图片根目录
+        :param max_age: Cache-Control 中的 max-age（秒）
+        :param max_cached_file_size: 允许进入内存缓存的单文件大小上限（字节）
+        :param max_cache_bytes: 内存缓存总字节数上限
+        """
+        self.image_dir = os.path.realpath(image_dir)
+        self.cache_control = f"public, max-age={max_age}, immutable"
+        self.max_cached_file_size = max_cached_file_size
+        self.max_cache_bytes = max_cache_bytes
+
+        # real_path -> (mtime_ns, size, etag, body)
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, filename: str) -> str:
+        """
+        将请求中的文件名解析为 image_dir 下的真实路径，越界或不存在时抛出 404
+        """
+        if not filename or "\x00" in filename:
+            raise HTTPException(status_code=404, detail="File not found")
+        real_path = os.path.realpath(os.path.join(self.image_dir, filename))
+        if os.path.commonpath([self.image_dir, real_path]) != self.image_dir:
+            raise HTTPException(status_code=404, detail="File not found")
+        return real_path
+
+    @staticmethod
+    def _make_etag(stat_result: os.stat_result) -> str:
+        digest = hashlib.md5(f"{stat_result.st_mtime_ns}-{stat_result.st_size}".encode()).hexdigest()
+        return f'"{digest}"'
+
+    def _validation_headers(self, etag: str, stat_result: os.stat_result) -> dict:
+        return {
+            "ETag": etag,
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "Cache-Control": self.cache_control,
+            "Accept-Ranges": "bytes",
+        }
+
+    @staticmethod
+    def _is_not_modified(request_headers, etag: str, stat_result: os.stat_result) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _cache_get(self, real_path: str, stat_result: os.stat_result):
+        with self._lock:
+            entry = self._cache.get(real_path)
+            if entry is None:
+                return None
+            if entry[0] != stat_result.st_mtime_ns or entry[1] != stat_result.st_size:
+                self._cache.pop(real_path)
+                self._cache_bytes -= len(entry[3])
+                return None
+            self._cache.move_to_end(real_path)
+            return entry
+
+    def _cache_put(self, real_path: str, stat_result: os.stat_result, etag: str, body: bytes):
+        with self._lock:
+            old = self._cache.pop(real_path, None)
+            if old is not None:
+                self._cache_bytes -= len(old[3])
+            self._cache[real_path] = (stat_result.st_mtime_ns, stat_result.st_size, etag, body)
+            self._cache_bytes += len(body)
+            while self._cache_bytes > self.max_cache_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted[3])
+
+    @staticmethod
+    def _read(real_path: str) -> bytes:
+        with open(real_path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _parse_range(range_header: str, size: int):
+        """
+        解析单区间 Range 头，返回 (start, end)；不支持或语法无效的写法（如末位置小于起始位置）返回 None，
+        按 RFC 7233 忽略 Range 并返回完整内容；起始位置超出文件末尾时抛出 416
+        """
+        unit, _, spec = range_header.partition("=")
+        if unit.strip().lower() != "bytes" or "," in spec:
+            return None
+        start_str, _, end_str = spec.strip().partition("-")
+        # 两端只能是非负整数，且不能同时为空
+        if not (start_str or end_str) or not all(p.isascii() and p.isdigit() for p in (start_str, end_str) if p):
+            return None
+        if start_str == "":
+            start, end = max(size - int(end_str), 0), size - 1
+        else:
+            start = int(start_str)
+            if end_str and int(end_str) < start:
+                return None
+            end = min(int(end_str), size - 1) if end_str else size - 1
+        if start >= size:
+            raise HTTPException(status_code=416, detail="Range not satisfiable",
+                                headers={"Content-Range": f"bytes */{size}"})
+        return start, end
+
+    async def serve(self, filename: str, request_headers) -> Response:
+        """
+        根据文件名与请求头构造响应
+        :param filename: 相对 image_dir 的文件名
+        :param request_headers: 请求头（支持 .get 的映射）
+        """
+        return await self.serve_file(self.resolve(filename), request_headers)
+
+    async def serve_file(self, real_path: str, request_headers, extra_headers: dict | None = None) -> Response:
+        """
+        对已解析的真实路径构造响应（也用于缩略图等派生文件）
+        :param real_path: 已校验的文件路径
+        :param request_headers: 请求头（支持 .get 的映射）
+        :param extra_headers: 额外附加的响应头，如 Vary
+        """
+        try:
+            stat_result = os.stat(real_path)
+        except OSError:
+            raise HTTPException(status_code=404, detail="File not found")
+        if not os.path.isfile(real_path):
+            raise HTTPException(status_code=404, detail="File not found")
+
+        entry = self._cache_get(real_path, stat_result)
+        etag = entry[2] if entry else self._make_etag(stat_result)
+        headers = self._validation_headers(etag, stat_result)
+        if extra_headers:
+            headers.update(extra_headers)
+
+        if self._is_not_modified(request_headers, etag, stat_result):
+            return Response(status_code=304, headers=headers)
+
+        media_type = mimetypes.guess_type(real_path)[0] or "application/octet-stream"
+
+        # 大文件交给 FileResponse 分块发送（其自身支持 Range）
+        if stat_result.st_size > self.max_cached_file_size:
+            return FileResponse(real_path, media_type=media_type, headers=headers, stat_result=stat_result)
+
+        if entry is None:
+            # 在线程中读取，不阻塞事件循环
+            body = await asyncio.to_thread(self._read, real_path)
+            self._cache_put(real_path, stat_result, etag, body)
+        else:
+            body = entry[3]
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (if_range is None or if_range == etag):
+            byte_range = self._parse_range(range_header, len(body))
+            if byte_range is not None:
+                start, end = byte_range
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+                return Response(body[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+        return Response(body, media_type=media_type, headers=headers)
@@ -0,0 +1,180 @@
+import os
+import asyncio
+import threading
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from PIL import Image, ImageOps
+
+# 输出格式 -> (Pillow 格式名, 扩展名)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "webp"),
+    "jpeg": ("JPEG", "jpg"),
+    "jpg": ("JPEG", "jpg"),
+    "png": ("PNG", "png"),
+}
+
+
+def render_variant(source_path: str, target_path: str, width: int | None, quality: int, fmt: str):
+    """
+    在工作线程中生成派生图：按宽度等比缩小（不放大）、转码，并原子写入磁盘缓存
+    """
+    pil_format, _ = VARIANT_FORMATS[fmt]
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if width and image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tmp_path = f"{target_path}.{os.getpid()}.tmp"
+        save_kwargs = {"optimize": True} if pil_format == "PNG" else {"quality": quality}
+        try:
+            image.save(tmp_path, format=pil_format, **save_kwargs)
+            os.replace(tmp_path, target_path)
+        finally:
+            # 编码或写入失败时不留下半成品
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class ImageVariantCache:
+    """
+    图片缩略图 / 格式派生缓存：
+    - 宽度吸附到固定档位，质量限定区间，避免任意参数撑爆缓存
+    - 缓存文件名包含源文件 mtime 与大小，源图更新后自动失效，写入新派生图时删除该源图旧版本的派生图
+    - 缓存总大小超过 max_bytes 时按生成时间从旧到新淘汰
+    - 同一派生图并发请求只生成一次，生成任务在线程池中执行
+    缓存文件清单与总大小只在启动时扫描一次，之后随生成与淘汰增量维护；
+    多 worker 共用目录时各进程只统计自己启动前已有与自己生成的文件，目录总大小上限约为 max_bytes 乘以 worker 数
+    """
+
+    def __init__(self, cache_dir: str = os.getenv("IMAGE_VARIANT_CACHE_PATH", "assets/image_variants"),
+                 widths: str = os.getenv("IMAGE_VARIANT_WIDTHS", "160,320,640,960,1280,1920"),
+                 default_quality: int = int(os.getenv("IMAGE_VARIANT_QUALITY", 75)),
+                 max_workers: int = int(os.getenv("IMAGE_VARIANT_WORKERS", 2)),
+                 max_bytes: int = int(os.getenv("IMAGE_VARIANT_CACHE_MAX_BYTES", 512 * 1024 * 1024))):
+        """
+        初始化
+        :param cache_dir: 派生图磁盘缓存目录
+        :param widths: 允许的宽度档位，逗号分隔
+        :param default_quality: 未指定质量时的默认值
+        :param max_workers: 生成派生图的线程数
+        :param max_bytes: 磁盘缓存总大小上限，超出后淘汰至 90%，0 表示不限制
+        """
+        self.cache_dir = cache_dir
+        self.widths = sorted(int(w) for w in widths.split(",") if w.strip())
+        self.default_quality = default_quality
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-variant")
+        self.max_bytes = max_bytes
+        self._pending: dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        # 文件名 -> 大小，按生成时间从旧到新；source_key -> 该源图的派生图文件名
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self._by_source: dict[str, set[str]] = {}
+        self._bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = [(entry.stat(), entry.name) for entry in os.scandir(self.cache_dir)
+                   if entry.is_file() and not entry.name.endswith(".tmp")]
+        for stat_result, name in sorted(entries, key=lambda item: item[0].st_mtime):
+            self._track(name, stat_result.st_size)
+
+    def _track(self, name: str, size: int):
+        self._bytes += size - self._files.pop(name, 0)
+        self._files[name] = size
+        self._by_source.setdefault(name.split("-", 1)[0], set()).add(name)
+
+    def _remove(self, name: str):
+        self._bytes -= self._files.pop(name, 0)
+        source_key = name.split("-", 1)[0]
+        names = self._by_source.get(source_key)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._by_source[source_key]
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
+    def _render(self, source_path: str, target_path: str, width: int | None, quality: int, fmt: str,
+                source_key: str, version_prefix: str):
+        """
+        在工作线程中生成派生图，并清理同一源图旧版本的派生图、按总大小淘汰
+        """
+        render_variant(source_path, target_path, width, quality, fmt)
+        name = os.path.basename(target_path)
+        with self._lock:
+            self._track(name, os.path.getsize(target_path))
+            # 源图更新后旧 mtime/大小的派生图不会再被命中
+            for stale in [n for n in self._by_source.get(source_key, ()) if not n.startswith(version_prefix)]:
+                self._remove(stale)
+            if self.max_bytes > 0 and self._bytes > self.max_bytes:
+                for oldest in list(self._files):
+                    if self._bytes <= self.max_bytes * 0.9:
+                        break
+                    if oldest != name:
+                        self._remove(oldest)
+
+    def _snap_width(self, width: int | None) -> int | None:
+        if width is None:
+            return None
+        if width <= 0:
+            raise HTTPException(status_code=422, detail="Invalid width")
+        for candidate in self.widths:
+            if candidate >= width:
+                return candidate
+        return self.widths[-1]
+
+    @staticmethod
+    def negotiate_format(fmt: str | None, accept: str, source_path: str) -> str:
+        """
+        解析目标格式；fmt=auto 时根据 Accept 头优先选择 WebP
+        """
+        if fmt is None:
+            fmt = os.path.splitext(source_path)[1].lstrip(".").lower()
+        elif fmt == "auto":
+            fmt = "webp" if "image/webp" in (accept or "") else "jpeg"
+        if fmt not in VARIANT_FORMATS:
+            raise HTTPException(status_code=422, detail="Unsupported format")
+        return fmt
+
+    async def get(self, source_path: str, width: int | None = None, quality: int | None = None,
+                  fmt: str = "webp") -> str:
+        """
+        返回派生图的磁盘路径，不存在时在线程池中生成
+        :param source_path: 已校验的源图真实路径
+        :param width: 目标宽度（吸附到档位）
+        :param quality: 编码质量
+        :param fmt: 目标格式，见 VARIANT_FORMATS
+        """
+        try:
+            stat_result = os.stat(source_path)
+        except OSError:
+            raise HTTPException(status_code=404, detail="File not found")
+
+        width = self._snap_width(width)
+        quality = min(max(quality or self.default_quality, 30), 95)
+        source_key = hashlib.sha1(source_path.encode("utf-8")).hexdigest()[:16]
+        version_prefix = f"{source_key}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}-"
+        name = f"{version_prefix}w{width or 0}-q{quality}.{VARIANT_FORMATS[fmt][1]}"
+        target_path = os.path.join(self.cache_dir, name)
+        if os.path.isfile(target_path):
+            return target_path
+
+        future = self._pending.get(target_path)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self._render, source_path, target_path, width, quality,
+                                          fmt, source_key, version_prefix)
+            self._pending[target_path] = future
+            future.add_done_callback(lambda _: self._pending.pop(target_path, None))
+        try:
+            await asyncio.shield(future)
+        except OSError:
+            raise HTTPException(status_code=415, detail="Unsupported image")
+        return target_path
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,9 +1,20 @@
+import os
 import json
+import time
+import asyncio
+import inspect
 from fastapi import FastAPI
 from datetime import timedelta, datetime
 from contextlib import asynccontextmanager
 from middlewares.image_searcher import ImageSemanticSearcher
 from middlewares.knowledge_builder import KnowledgeGraphBuilder
+from middlewares.image_server import StaticImageServer
+from middlewares.image_variants import ImageVariantCache
+from middlewares.message_queue import event_bus
+from middlewares.stream_registry import stream_registry
+from middlewares.graph_layout import graph_layout
+from middlewares.profiler import request_profiler
+from services.report_jobs import report_jobs
 # from apscheduler.schedulers.asyncio import AsyncIOScheduler
 # from apscheduler.triggers.interval import IntervalTrigger
 # from apscheduler.triggers.cron import CronTrigger
@@ -14,6 +25,91 @@ from middlewares.knowledge_builder import KnowledgeGraphBuilder
 # from services.timer_tasks import flush_db_connection, update_server_functions, update_devices_info
 # from services.db_conn_test import db_conn_test
 
+# parallel：在线程中并发构建重资源；sequential：按顺序构建（旧行为）
+STARTUP_MODE = os.getenv("STARTUP_MODE", "parallel")
+# 启动完成后是否在后台预热 jieba 词典（含领域词表）与 pyecharts
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+
+
+class StartupRegistry:
+    """
+    记录各子系统的加载状态与耗时，供就绪检查接口使用
+    """
+    REQUIRED = ("image_searcher", "knowledge_graph")
+
+    def __init__(self):
+        self.subsystems = {}
+
+    async def load(self, name: str, factory):
+        """
+        在工作线程中执行 factory，记录状态；失败时向上抛出
+        """
+        self.subsystems[name] = {"state": "loading"}
+        start = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(factory)
+        except Exception as e:
+            self.subsystems[name] = {"state": "failed", "error": repr(e),
+                                     "seconds": round(time.perf_counter() - start, 3)}
+            raise
+        self.subsystems[name] = {"state": "ready", "seconds": round(time.perf_counter() - start, 3)}
+        return result
+
+    def is_ready(self) -> bool:
+        return all(self.subsystems.get(name, {}).get("state") == "ready" for name in self.REQUIRED)
+
+
+async def load_required(startup: StartupRegistry, loaders: tuple) -> list:
+    """
+    加载必需子系统；失败时记录在 StartupRegistry 中并返回 None，不中断启动，
+    /ready 返回 503，由编排系统摘除流量或重启实例
+    """
+    if STARTUP_MODE == "parallel":
+        results = await asyncio.gather(*(startup.load(name, factory) for name, factory in loaders),
+                                       return_exceptions=True)
+    else:
+        results = []
+        for name, factory in loaders:
+            try:
+                results.append(await startup.load(name, factory))
+            except Exception as e:
+                results.append(e)
+    for (name, _), result in zip(loaders, results):
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            raise result
+        if isinstance(result, Exception):
+            print(f"❌ {name} 加载失败，服务未就绪: {result!r}")
+    return [None if isinstance(result, Exception) else result for result in results]
+
+
+async def warm(startup: StartupRegistry, name: str, factory):
+    try:
+        await startup.load(name, factory)
+    except Exception as e:
+        print(f"⚠️ {name} 预热失败: {e!r}")
+
+
+async def shutdown_all(steps: tuple):
+    """
+    依次关闭各子系统，某一步失败只记录日志，其余子系统照常关闭
+    """
+    for name, close in steps:
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            print(f"⚠️ {name} 关闭失败: {e!r}")
+
+
+def warm_jieba():
+    from middlewares.segmenter import segmenter
+    segmenter.initialize()
+
+
+def warm_pyecharts():
+    from pyecharts.charts import Graph  # noqa: F401
+
 
 @asynccontextmanager
 async def tai_middleware(app: FastAPI):
@@ -22,16 +118,36 @@ async def tai_middleware(app: FastAPI):
 
     :param app: FastAPI 应用实例
     """
+    startup = StartupRegistry()
+    app.state.startup = startup
+    # 按请求剖析开启时在事件循环上安装任务工厂，关闭时无任何开销
+    request_profiler.install(asyncio.get_running_loop())
+
     # 初始化资源
-    image_searcher = ImageSemanticSearcher()
+    image_searcher, knowledge_graph = await load_required(
+        startup, (("image_searcher", ImageSemanticSearcher), ("knowledge_graph", KnowledgeGraphBuilder)))
     app.state.image_searcher = image_searcher
-
-    knowledge_graph = KnowledgeGraphBuilder()
     app.state.knowledge_graph = knowledge_graph
+
+    # jieba 与 pyecharts 不阻塞启动，首个请求前在后台预热
+    warmup_tasks = []
+    if STARTUP_WARMUP:
+        warmup_tasks = [asyncio.create_task(warm(startup, "jieba", warm_jieba)),
+                        asyncio.create_task(warm(startup, "pyecharts", warm_pyecharts))]
+
+    app.state.image_server = StaticImageServer()
+    app.state.image_variants = ImageVariantCache()
     try:
         yield  # 应用运行期间
     finally:
-        pass
+        for task in warmup_tasks:
+            task.cancel()
+        await shutdown_all((("image_variants", app.state.image_variants.close),
+                            ("stream_registry", stream_registry.shutdown),
+                            ("report_jobs", report_jobs.shutdown),
+                            ("graph_layout", graph_layout.shutdown),
+                            ("request_profiler", request_profiler.shutdown),
+                            ("event_bus", event_bus.shutdown)))
 
     # scheduler = AsyncIOScheduler()
     #
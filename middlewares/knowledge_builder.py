@@ -2,34 +2,210 @@ from dotenv import load_dotenv
 load_dotenv("../.env")
 import os
 import json
-from pyecharts.charts import Graph
-from pyecharts import options as opts
+import numpy as np
+from middlewares.shared_index import (SharedArrayStore, SharedIndexWatcher, StringTable, encode_strings,
+                                      fingerprint, file_state)
+from middlewares.graph_layout import GRAPH_LAYOUT, graph_layout
+from middlewares.causal_index import CAUSAL_RELATIONS, RelationIndex
+
+
+SHARED_INDEX_NAME = "triplets"
+# 共享索引的数组布局版本，布局变化时须递增，避免挂载旧布局的同源版本
+INDEX_FORMAT = 2
 
 
 class KnowledgeGraphBuilder:
-    def __init__(self, triplets_path: str = os.getenv("TRIPLETS_PATH")):
-        with open(triplets_path, "r", encoding="UTF-8") as triplets_file:
-            self.triplets = [json.loads(line) for line in triplets_file.readlines()]
+    """
+    知识图谱检索与绘制
+    三元组编译为紧凑数组（节点字符串表 + head/relation/tail 下标），发布到共享索引目录，
+    多个 worker 以只读 mmap 共享；节点名同样存放在共享字节数组中，只有少量关系名随 meta 加载
+    """
+
+    def __init__(self, triplets_path: str = os.getenv("TRIPLETS_PATH"),
+                 shared_store: SharedArrayStore | None = None):
+        """
+        初始化
+        :param triplets_path: 三元组文件路径（每行一个 JSON）
+        :param shared_store: 共享索引存储，默认使用 SHARED_INDEX_PATH
+        """
+        self.triplets_path = triplets_path
+        self.shared_store = shared_store if shared_store is not None else SharedArrayStore()
+
+        version = fingerprint(file_state(triplets_path), INDEX_FORMAT)
+        attached = self.shared_store.attach(SHARED_INDEX_NAME, version)
+        if attached is None:
+            arrays, meta = self._compile_triplets()
+            self.shared_store.publish(SHARED_INDEX_NAME, version, arrays, meta)
+            attached = self.shared_store.attach(SHARED_INDEX_NAME, version)
+        self._on_index_change(*attached)
+        self._watcher = SharedIndexWatcher(self.shared_store, SHARED_INDEX_NAME, self._on_index_change)
+        self._watcher.version = version
+
+    def _compile_triplets(self) -> tuple[dict, dict]:
+        """
+        解析三元组文件，编译为节点/关系字典表与 int32 下标数组
+        """
+        nodes, relations = {}, {}
+        heads, relation_ids, tails = [], [], []
+        with open(self.triplets_path, "r", encoding="UTF-8") as triplets_file:
+            for line in triplets_file:
+                if not line.strip():
+                    continue
+                triplet = json.loads(line)
+                heads.append(nodes.setdefault(triplet["head"], len(nodes)))
+                relation_ids.append(relations.setdefault(triplet["relation"], len(relations)))
+                tails.append(nodes.setdefault(triplet["tail"], len(nodes)))
+        arrays = {
+            "heads": np.array(heads, dtype=np.int32),
+            "relations": np.array(relation_ids, dtype=np.int32),
+            "tails": np.array(tails, dtype=np.int32),
+            **encode_strings("nodes", list(nodes)),
+        }
+        return arrays, {"relation_names": list(relations)}
+
+    def _on_index_change(self, version: str, arrays: dict, meta: dict):
+        self.heads = arrays["heads"]
+        self.relations = arrays["relations"]
+        self.tails = arrays["tails"]
+        self.nodes = StringTable(arrays, "nodes")
+        self.relation_names = meta["relation_names"]
+        # 因果类关系的可达性索引随三元组加载（或切换版本）时构建
+        self.causal_indexes = {}
+        for relation_id, relation in enumerate(self.relation_names):
+            if relation in CAUSAL_RELATIONS:
+                mask = self.relations == relation_id
+                self.causal_indexes[relation] = RelationIndex(self.heads[mask], self.tails[mask])
+        self.index_version = version
+
+    def _record(self, index: int) -> dict:
+        return {
+            "head": self.nodes[self.heads[index]],
+            "relation": self.relation_names[self.relations[index]],
+            "tail": self.nodes[self.tails[index]],
+        }
 
     def extract_relevant_records(self, entity: str, top_k: int = 20) -> list:
-        relevant_list = []
-        for line in self.triplets:
-            if entity in line["head"] or entity in line["tail"]:
-                relevant_list.append(line)
-            if len(relevant_list) == top_k:
+        """
+        返回 head 或 tail 包含 entity 的前 top_k 条三元组（保持文件顺序）
+        子串匹配直接在共享的节点字节表上进行，再用下标掩码一次性筛出三元组
+        """
+        self._watcher.maybe_refresh()
+        matched = np.zeros(len(self.nodes), dtype=bool)
+        matched[self.nodes.containing(entity)] = True
+        hits = np.flatnonzero(matched[self.heads] | matched[self.tails])[:top_k]
+        return [self._record(i) for i in hits]
+
+    def match_entities(self, text: str, max_entities: int = 3, min_length: int = 2) -> list[str]:
+        """
+        找出完整出现在 text 中的节点名，作为原始问题的图谱检索关键字；
+        优先较长的节点，已被选中节点包含的短节点不再重复选取
+        """
+        self._watcher.maybe_refresh()
+        # 同长度的节点按三元组文件中的出现顺序
+        found = sorted((self.nodes[i] for i in self.nodes.occurring_in(text, min_length)), key=len, reverse=True)
+        entities = []
+        for node in found:
+            if not any(node in entity for entity in entities):
+                entities.append(node)
+            if len(entities) == max_entities:
                 break
-        return relevant_list
+        return entities
+
+    def _match_causal_nodes(self, entity: str, index: RelationIndex, limit: int = 10) -> list[int]:
+        """
+        实体名完全匹配关系中的节点时只取该节点，否则取名称包含 entity 的节点
+        """
+        node_id = self.nodes.index(entity)
+        if node_id is not None and node_id in index:
+            return [node_id]
+        matched = set(self.nodes.containing(entity).tolist())
+        return [int(i) for i in index.nodes if int(i) in matched][:limit]
+
+    def causal_chains(self, entity: str, relation: str = "导致", direction: str = "effects", max_depth: int = 6,
+                      limit: int = 50, target: str | None = None) -> dict:
+        """
+        沿因果类关系查询链路
+        :param entity: 起点实体，完全匹配或子串匹配
+        :param relation: 关系名，须在 CAUSAL_RELATIONS 中
+        :param direction: effects：entity 会导致什么；causes：什么会导致 entity
+        :param max_depth: 链路最大长度
+        :param limit: 返回的链路数上限，按长度由短到长
+        :param target: 只返回到达该实体（完全匹配或子串匹配）的链路
+        """
+        self._watcher.maybe_refresh()
+        index = self.causal_indexes.get(relation)
+        if index is None:
+            raise ValueError(f"Unsupported relation: {relation}, expected one of {list(self.causal_indexes)}")
+        if direction not in ("effects", "causes"):
+            raise ValueError("direction must be 'effects' or 'causes'")
+        forward = direction == "effects"
+        sources = self._match_causal_nodes(entity, index)
+        result = {"entity": entity, "relation": relation, "direction": direction,
+                  "matched": [self.nodes[i] for i in sources], "total": 0, "chains": [], "cycles": []}
+        if not sources:
+            return result
+
+        reachable = index.reachable(sources, forward)
+        result["total"] = len(reachable)
+        result["cycles"] = [[self.nodes[i] for i in members] for members in
+                            {tuple(index.cycles(s).tolist()) for s in sources} if members]
+        targets = None
+        if target is not None:
+            # 先用闭包判断可达性，不可达时无需遍历
+            targets = set(self._match_causal_nodes(target, index)) & set(reachable.tolist())
+            if not targets:
+                return result
+
+        parents = {}
+        for node, depth, parent in index.walk(sources, forward, max_depth):
+            parents[node] = parent
+            if depth == 0 or (targets is not None and node not in targets):
+                continue
+            path = [node]
+            while parents[path[-1]] is not None:
+                path.append(parents[path[-1]])
+            # 链路统一按“原因 -> 结果”的顺序给出
+            names = [self.nodes[i] for i in (reversed(path) if forward else path)]
+            result["chains"].append({"node": self.nodes[node], "depth": depth, "path": names,
+                                     "text": f" {relation} ".join(names)})
+            if len(result["chains"]) >= limit:
+                break
+        return result
+
+    async def render_graph(self, records_data: list[dict], title: str, layout: str = GRAPH_LAYOUT) -> str:
+        """
+        绘制图谱；layout 为 server 时先在线程/进程池中计算（或从缓存取出）节点坐标，输出固定布局
+        """
+        if layout != "server":
+            return self.build_graphs(records_data, title)
+        nodes = {node for item in records_data for node in (item["head"], item["tail"])}
+        edges = {(item["head"], item["tail"]) for item in records_data}
+        positions = await graph_layout.positions(list(nodes), list(edges))
+        return self.build_graphs(records_data, title, positions)
+
+    def build_graphs(self, records_data: list[dict], title: str, positions: dict | None = None) -> str:
+        """
+        :param positions: 节点名 -> (x, y)；给定时输出 layout=none 的固定布局，前端无需再做力导向模拟
+        """
+        # pyecharts 导入较重，推迟到首次绘图（或启动后的后台预热）
+        from pyecharts.charts import Graph
+        from pyecharts import options as opts
 
-    def build_graphs(self, records_data: list[dict], title: str) -> str:
         unique_nodes = set()
         for item in records_data:
             unique_nodes.add(item["head"])
             unique_nodes.add(item["tail"])
 
         # Build node data
-        nodes_data = [
-            opts.GraphNode(name=node, symbol_size=40) for node in unique_nodes
-        ]
+        if positions:
+            nodes_data = [
+                opts.GraphNode(name=node, symbol_size=40, x=positions[node][0], y=positions[node][1], is_fixed=True)
+                for node in sorted(unique_nodes)
+            ]
+        else:
+            nodes_data = [
+                opts.GraphNode(name=node, symbol_size=40) for node in sorted(unique_nodes)
+            ]
 
         # Build edge data
         links_data = [
@@ -44,6 +220,7 @@ class KnowledgeGraphBuilder:
                 "",
                 nodes_data,
                 links_data,
+                layout="none" if positions else "force",
                 repulsion=2000,
                 edge_label=opts.LabelOpts(
                     is_show=True,
@@ -0,0 +1,87 @@
+import math
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """
+    用于精确匹配的归一化：去空白、转小写
+    """
+    return "".join(text.split()).lower()
+
+
+def is_term(token: str) -> bool:
+    """
+    过滤空白与纯标点分词
+    """
+    return any(ch.isalnum() for ch in token)
+
+
+class LexicalIndex:
+    """
+    图片文本的 BM25 倒排索引：term -> (图片下标数组, BM25 权重数组)
+    查询时按词项向量化累加，得到所有图片的词法得分
+    """
+
+    def __init__(self, texts: list[str], tokenize, k1: float = 1.5, b: float = 0.75,
+                 documents: list[str] | None = None):
+        """
+        初始化
+        :param texts: 图片名（未分词），用于精确命中判断
+        :param tokenize: 分词函数，返回词序列
+        :param k1: BM25 词频饱和参数
+        :param b: BM25 长度归一参数
+        :param documents: 参与 BM25 的文本（如图片名 + 标注 + OCR），默认与 texts 相同
+        """
+        self.tokenize = tokenize
+        self.size = len(texts)
+        self.names = [normalize_text(text) for text in texts]
+        self.k1 = k1
+
+        postings = {}
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for doc_id, text in enumerate(documents or texts):
+            terms = [token.lower() for token in tokenize(text) if is_term(token)]
+            lengths[doc_id] = len(terms)
+            for term in terms:
+                doc_tf = postings.setdefault(term, {})
+                doc_tf[doc_id] = doc_tf.get(doc_id, 0) + 1
+
+        avg_length = float(lengths.mean()) if self.size else 0.0
+        norms = k1 * (1 - b + b * lengths / max(avg_length, 1e-6))
+        self.idf = {}
+        self.postings = {}
+        for term, doc_tf in postings.items():
+            doc_ids = np.fromiter(doc_tf.keys(), dtype=np.int32, count=len(doc_tf))
+            tf = np.fromiter(doc_tf.values(), dtype=np.float32, count=len(doc_tf))
+            idf = math.log(1 + (self.size - len(doc_tf) + 0.5) / (len(doc_tf) + 0.5))
+            self.idf[term] = idf
+            self.postings[term] = (doc_ids, (idf * tf * (k1 + 1) / (tf + norms[doc_ids])).astype(np.float32))
+
+    def query_terms(self, text: str) -> list[str]:
+        """
+        查询分词后只保留索引中出现过的词项（去重）
+        """
+        terms = {token.lower() for token in self.tokenize(text) if is_term(token)}
+        return [term for term in terms if term in self.postings]
+
+    def score(self, text: str) -> np.ndarray:
+        """
+        计算所有图片的词法得分，按查询词项理论上限归一到 [0, 1]：
+        图片名覆盖了查询中的全部索引词项时接近 1
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        terms = self.query_terms(text)
+        if not terms:
+            return scores
+        for term in terms:
+            doc_ids, weights = self.postings[term]
+            scores[doc_ids] += weights
+        upper = sum(self.idf[term] for term in terms) * (self.k1 + 1)
+        return np.minimum(scores / upper, 1.0)
+
+    def exact_hits(self, text: str, candidates: np.ndarray) -> list[int]:
+        """
+        在候选图片中找出名称完整出现在查询中的图片（如查询直接给出型号名称）
+        """
+        query = normalize_text(text)
+        return [int(i) for i in candidates if self.names[i] and self.names[i] in query]
@@ -1,3 +1,157 @@
+import os
+import json
 import asyncio
+from collections import deque
+from middlewares.metrics import QUEUE_DEPTH
 
-global_queue = asyncio.Queue(200)
\ No newline at end of file
+
+def _drop_unrouted(item: tuple, streams: int):
+    print(f"⚠️ 事件缺少 stream_id，无法确定所属流（本进程 {streams} 个流），已丢弃 {item[0]} 事件")
+
+
+class InProcessEventBus:
+    """
+    进程内事件总线：每个 /ask 流一个有界 asyncio.Queue。
+    仅当 Dify 回调落在与 /ask 相同的 worker 上时可用，即单进程部署。
+    """
+
+    def __init__(self, maxsize: int = 200):
+        self.maxsize = maxsize
+        self.queues: dict[str, asyncio.Queue] = {}
+
+    async def open(self, stream_id: str):
+        self.queues[stream_id] = asyncio.Queue(self.maxsize)
+
+    def local_streams(self) -> list[str]:
+        return list(self.queues)
+
+    async def publish(self, stream_id: str | None, item: tuple):
+        """
+        推送事件，流已关闭时直接丢弃；
+        stream_id 为空（旧版工作流回调未携带流标识）时只在本进程恰好一个流时投递给它，
+        否则无法确定归属，丢弃并告警——广播会把一个用户的图片、图谱推给其他并发的问答与报告任务
+        """
+        if not stream_id:
+            if len(self.queues) != 1:
+                _drop_unrouted(item, len(self.queues))
+                return
+            stream_id = next(iter(self.queues))
+        queue = self.queues.get(stream_id)
+        if queue is not None:
+            await queue.put(item)
+
+    async def get(self, stream_id: str, timeout: float) -> tuple | None:
+        """
+        取出下一条事件，超时返回 None
+        """
+        try:
+            return await asyncio.wait_for(self.queues[stream_id].get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self, stream_id: str):
+        queue = self.queues.pop(stream_id, None)
+        # 清空队列，唤醒可能阻塞在 put 上的生产者
+        while queue is not None and not queue.empty():
+            queue.get_nowait()
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues.values())
+
+    async def shutdown(self):
+        self.queues.clear()
+
+
+class RedisEventBus:
+    """
+    基于 Redis Streams 的跨 worker 事件总线：每个 /ask 流对应一个 Stream key，
+    任意 worker 收到的 Dify 回调都能送达等待中的 SSE 流。
+    测试时可注入本地替身客户端，如 fakeredis.aioredis.FakeRedis(decode_responses=True)。
+    """
+
+    def __init__(self, client=None,
+                 key_prefix: str = os.getenv("EVENT_BUS_KEY_PREFIX", "tai:stream:"),
+                 maxlen: int = int(os.getenv("EVENT_BUS_STREAM_MAXLEN", 2000)),
+                 ttl: int = int(os.getenv("EVENT_BUS_STREAM_TTL", 600))):
+        """
+        初始化
+        :param client: redis.asyncio 客户端（需 decode_responses=True），为空时按 REDIS_* 配置创建
+        :param key_prefix: Stream key 前缀
+        :param maxlen: 单个 Stream 保留的最大事件数
+        :param ttl: Stream key 过期时间（秒）
+        """
+        if client is None:
+            import redis.asyncio as redis
+            username = os.getenv("REDIS_USER")
+            client = redis.Redis(host=os.getenv("REDIS_URL", "localhost"),
+                                 port=int(os.getenv("REDIS_PORT", 6379)),
+                                 username=None if username in (None, "", "None") else username,
+                                 password=os.getenv("REDIS_PASSWORD") or None,
+                                 db=int(os.getenv("REDIS_DB", 0)),
+                                 decode_responses=True)
+        self.client = client
+        self.key_prefix = key_prefix
+        self.maxlen = maxlen
+        self.ttl = ttl
+        # 本进程正在消费的流：stream_id -> 读取游标 / 本地缓冲
+        self._cursors: dict[str, str] = {}
+        self._buffers: dict[str, deque] = {}
+
+    def _key(self, stream_id: str) -> str:
+        return f"{self.key_prefix}{stream_id}"
+
+    async def open(self, stream_id: str):
+        self._cursors[stream_id] = "0-0"
+        self._buffers[stream_id] = deque()
+
+    def local_streams(self) -> list[str]:
+        return list(self._cursors)
+
+    async def publish(self, stream_id: str | None, item: tuple):
+        """
+        推送事件；stream_id 为空时丢弃并告警：其他 worker 上可能也有进行中的流，
+        即使本进程只有一个流也无法确定归属
+        """
+        if not stream_id:
+            _drop_unrouted(item, len(self._cursors))
+            return
+        key = self._key(stream_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {"item": json.dumps(list(item), ensure_ascii=False)}, maxlen=self.maxlen, approximate=True)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def get(self, stream_id: str, timeout: float) -> tuple | None:
+        buffer = self._buffers[stream_id]
+        if not buffer:
+            response = await self.client.xread({self._key(stream_id): self._cursors[stream_id]},
+                                               count=100, block=max(1, int(timeout * 1000)))
+            for _, entries in response or []:
+                for entry_id, fields in entries:
+                    self._cursors[stream_id] = entry_id
+                    buffer.append(tuple(json.loads(fields["item"])))
+        return buffer.popleft() if buffer else None
+
+    async def close(self, stream_id: str):
+        self._cursors.pop(stream_id, None)
+        self._buffers.pop(stream_id, None)
+
+    def depth(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    async def shutdown(self):
+        await self.client.aclose()
+
+
+def create_event_bus():
+    """
+    按 EVENT_BUS_BACKEND 创建事件总线：memory（默认）或 redis
+    """
+    backend = os.getenv("EVENT_BUS_BACKEND", "memory").lower()
+    if backend == "redis":
+        return RedisEventBus()
+    return InProcessEventBus()
+
+
+event_bus = create_event_bus()
+QUEUE_DEPTH.set_function(event_bus.depth, queue="stream")
@@ -0,0 +1,262 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# 默认直方图分桶（秒），覆盖毫秒级打分到数十秒的 Dify 长流
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """
+    指标基类：按标签值元组保存子指标，线程安全
+    """
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self):
+        return [f"{self.name}_total{_format_labels(self.labelnames, key)} {child.value}"
+                for key, child in list(self._children.items())]
+
+
+class Gauge(_Metric):
+    """
+    Gauge，支持 set_function 在抓取时实时取值（如队列长度）
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._functions = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def set_function(self, func, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._functions[key] = func
+
+    def _samples(self):
+        values = {key: child.value for key, child in list(self._children.items())}
+        for key, func in list(self._functions.items()):
+            values[key] = func()
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None,
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _samples(self):
+        lines = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(child.buckets, child.counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {child.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {child.sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP 请求完整耗时（流式响应计至最后一帧）", ("route", "method", "status"))
+HTTP_RESPONSE_START_SECONDS = Histogram(
+    "http_response_start_seconds", "HTTP 请求到响应头发出的耗时", ("route", "method"))
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds", "各处理阶段耗时", ("route", "stage"))
+DIFY_FIRST_EVENT_SECONDS = Histogram(
+    "dify_time_to_first_event_seconds", "Dify 请求发出到收到第一条事件的耗时")
+DIFY_EVENTS = Counter(
+    "dify_events", "Dify 流事件计数，按事件类型、路由后的消息类型与工作流节点类型", ("event", "message_type", "node_type"))
+DIFY_NODE_SECONDS = Histogram(
+    "dify_node_duration_seconds", "Dify 工作流节点耗时（node_finished 的 elapsed_time），按节点类型与结果",
+    ("node_type", "status"))
+QUEUE_DEPTH = Gauge(
+    "stream_queue_depth", "流式事件队列中的待消费条数", ("queue",))
+ACTIVE_STREAMS = Gauge(
+    "active_streams", "正在向客户端推送的 SSE 流数量")
+ADMISSION_SLOTS = Gauge(
+    "admission_slots", "/ask 准入控制：占用中的上游流与排队中的请求数", ("state",))
+ADMISSION_REJECTED = Counter(
+    "admission_rejected", "/ask 被拒绝（429）的请求数", ("reason",))
+COMPRESSION_BYTES = Counter(
+    "compression_bytes", "压缩中间件处理的响应字节数：raw 为压缩前，wire 为实际发出", ("stage",))
+OUTBOUND_CALLS = Counter(
+    "outbound_calls", "外部调用（DashScope/Dify）计数：ok/error/timeout/retry/hedged/rejected", ("service", "outcome"))
+OUTBOUND_CALL_SECONDS = Histogram(
+    "outbound_call_duration_seconds", "外部调用成功尝试的耗时（Dify 计至收到响应头）", ("service",))
+CIRCUIT_STATE = Gauge(
+    "circuit_state", "外部调用熔断器状态：0 关闭，1 半开，2 打开", ("service",))
+
+
+@contextmanager
+def observe_stage(route: str, stage: str):
+    """
+    记录某个处理阶段的耗时：
+        with observe_stage("/ask", "file_upload"):
+            ...
+    """
+    with STAGE_SECONDS.labels(route=route, stage=stage).time():
+        yield
+
+
+class TimingMiddleware:
+    """
+    纯 ASGI 计时中间件：按路由模板统计响应头耗时与完整耗时，
+    不缓冲响应体，对 SSE 流式响应无影响
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                HTTP_RESPONSE_START_SECONDS.labels(
+                    route=self._route(scope), method=scope["method"]).observe(time.perf_counter() - start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(route=self._route(scope), method=scope["method"],
+                                        status=status["code"]).observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _route(scope) -> str:
+        # 使用路由模板而不是原始路径，避免 /images/{filename} 之类造成标签爆炸
+        route = scope.get("route")
+        template = getattr(route, "path", None)
+        if template is None:
+            return "unmatched"
+        # route.path 是路由器内的相对模板，不含挂载前缀与 include_router 前缀；
+        # 按路径参数还原出相对路径，实际路径去掉这一段即为完整前缀
+        path = scope.get("path", "")
+        try:
+            relative = route.url_path_for(route.name, **scope.get("path_params", {}))
+        except Exception:
+            relative = None
+        if relative and path.endswith(relative):
+            return path[:len(path) - len(relative)] + template
+        return scope.get("root_path", "") + template
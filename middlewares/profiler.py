@@ -0,0 +1,287 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import asyncio
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from weakref import WeakKeyDictionary
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 当前协程所属的剖析会话，create_task 复制上下文，子任务随之继承
+_current_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+def frame_label(code) -> str:
+    """
+    folded 格式的帧名：函数限定名 + 文件（项目内为相对路径，第三方库取最后两级）
+    """
+    path = code.co_filename
+    if path.startswith(ROOT):
+        path = os.path.relpath(path, ROOT)
+    else:
+        path = "/".join(path.replace("\\", "/").split("/")[-2:])
+    return f"{code.co_qualname} ({path})".replace(";", ",")
+
+
+def await_stack(coro) -> list[str]:
+    """
+    挂起中的协程沿 cr_await 展开的调用链（根在前），末尾标注正在等待的对象
+    """
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(frame_label(frame.f_code))
+        awaited = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) \
+            or getattr(coro, "gi_yieldfrom", None)
+        if awaited is not None and not hasattr(awaited, "cr_frame") and not hasattr(awaited, "ag_frame") \
+                and not hasattr(awaited, "gi_frame"):
+            # C 实现的 Future 在 await 时表现为 FutureIter
+            name = type(awaited).__name__.replace("FutureIter", "Future")
+            stack.append(f"[await {name}]")
+            break
+        coro = awaited
+    return stack
+
+
+def cpu_stack(frame, coro) -> list[str]:
+    """
+    正在运行的任务的线程栈（根在前），去掉协程入口以下的事件循环帧
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame.f_code)
+        frame = frame.f_back
+    frames.reverse()
+    entry = getattr(coro, "cr_code", None)
+    for i, code in enumerate(frames):
+        if code is entry:
+            frames = frames[i:]
+            break
+    return [frame_label(code) for code in frames]
+
+
+class RequestProfile:
+    """
+    单次请求的剖析会话：关联的任务、采样得到的 folded 栈计数
+    """
+
+    def __init__(self, reason: str):
+        self.profile_id = uuid.uuid4().hex
+        self.reason = reason
+        self.stream_id = None
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.samples = 0
+        self.stacks = Counter()
+        self.tasks: WeakKeyDictionary[asyncio.Task, str] = WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def add_task(self, task: asyncio.Task, label: str):
+        with self._lock:
+            self.tasks[task] = label
+
+    def live_tasks(self) -> list[tuple[asyncio.Task, str]]:
+        with self._lock:
+            return [(task, label) for task, label in self.tasks.items() if not task.done()]
+
+    def to_dict(self) -> dict:
+        return {"profile_id": self.profile_id, "stream_id": self.stream_id, "reason": self.reason,
+                "started_at": self.started_at, "duration": self.duration, "samples": self.samples,
+                "unique_stacks": len(self.stacks)}
+
+
+class RequestProfiler:
+    """
+    按请求开启的异步感知采样剖析器，默认关闭：
+    - 请求携带 X-Profile: <PROFILE_TOKEN>，或按 PROFILE_SAMPLE_RATE 随机抽样
+    - 请求任务、其中创建的后台任务（Dify 流、预取检索）以及携带同一 stream_id 的回调请求归入同一会话
+    - 采样线程每隔 interval 秒采一次：正在运行的任务取线程栈（CPU 时间：分词、NumPy、pyecharts、JSON 编码），
+      挂起的任务沿 await 链取栈并以 [await ...] 结尾（等待 I/O、线程池、队列）
+    - 会话在 Dify 任务结束后写出 folded 栈文件（flamegraph.pl / speedscope 可直接读取）与元数据
+    关闭时不安装任务工厂、不启动采样线程，每个请求只多一次属性判断。
+    取其他线程的栈只能通过 sys._current_frames()：解释器不提供时正在运行的任务退化为只记录 await 链；
+    采样出现异常时（如解释器内部结构变化）剖析器自行关闭，不影响请求
+    """
+
+    def __init__(self, token: str = os.getenv("PROFILE_TOKEN", ""),
+                 sample_rate: float = float(os.getenv("PROFILE_SAMPLE_RATE", 0)),
+                 interval: float = float(os.getenv("PROFILE_INTERVAL", 0.005)),
+                 max_active: int = int(os.getenv("PROFILE_MAX_ACTIVE", 4)),
+                 output_dir: str = os.getenv("PROFILE_OUTPUT_PATH", "logs/profiles")):
+        """
+        初始化
+        :param token: X-Profile 请求头须匹配的口令，为空时不接受按请求开启
+        :param sample_rate: 随机抽样的请求比例，0 表示不抽样
+        :param interval: 采样间隔（秒）
+        :param max_active: 同时进行的剖析会话上限，超出的请求不剖析
+        :param output_dir: 结果目录
+        """
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_active = max_active
+        self.output_dir = output_dir
+        self.enabled = bool(token) or sample_rate > 0
+        self.active: dict[str, RequestProfile] = {}
+        self.streams: dict[str, RequestProfile] = {}
+        self._loop = None
+        self._loop_thread_id = None
+        self._previous_factory = None
+        self._sampler = None
+        self._wakeup = threading.Event()
+        # 事件循环线程的当前栈（CPython 私有接口，须先检查）
+        self._current_frames = getattr(sys, "_current_frames", None)
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        """
+        在事件循环上安装任务工厂，使剖析会话中创建的任务自动归入会话
+        """
+        if not self.enabled or self._loop is loop:
+            return
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._previous_factory = loop.get_task_factory()
+        loop.set_task_factory(self._task_factory)
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        profile = context.get(_current_profile) if context is not None else _current_profile.get()
+        if profile is not None:
+            profile.add_task(task, getattr(coro, "__qualname__", type(coro).__name__))
+        return task
+
+    def _requested(self, headers) -> str | None:
+        if self.token:
+            provided = headers.get("x-profile")
+            if provided and hmac.compare_digest(provided, self.token):
+                return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def begin(self, headers, label: str) -> RequestProfile | None:
+        """
+        请求入口调用：需要剖析时创建会话，当前任务及之后创建的任务归入该会话
+        """
+        if not self.enabled or self._loop is None or len(self.active) >= self.max_active:
+            return None
+        reason = self._requested(headers)
+        if reason is None:
+            return None
+        profile = RequestProfile(reason)
+        profile.add_task(asyncio.current_task(), label)
+        _current_profile.set(profile)
+        self.active[profile.profile_id] = profile
+        self._ensure_sampler()
+        return profile
+
+    def bind(self, profile: RequestProfile | None, stream_id: str):
+        """
+        关联 stream_id，Dify 回调可据此归入同一会话
+        """
+        if profile is not None:
+            profile.stream_id = stream_id
+            self.streams[stream_id] = profile
+
+    @contextmanager
+    def attach(self, stream_id: str | None, label: str):
+        """
+        回调接口中使用：stream_id 属于某个剖析会话时，把当前请求任务归入该会话
+        """
+        profile = self.streams.get(stream_id) if stream_id else None
+        if profile is None:
+            yield
+            return
+        profile.add_task(asyncio.current_task(), label)
+        token = _current_profile.set(profile)
+        try:
+            yield
+        finally:
+            _current_profile.reset(token)
+
+    def finish(self, profile: RequestProfile | None):
+        """
+        结束会话并写出结果（在线程中写文件）
+        """
+        if profile is None or self.active.pop(profile.profile_id, None) is None:
+            return
+        if profile.stream_id is not None:
+            self.streams.pop(profile.stream_id, None)
+        profile.duration = round(time.perf_counter() - profile._start, 4)
+        self._loop.run_in_executor(None, self._write, profile)
+
+    def _write(self, profile: RequestProfile):
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{profile.profile_id}")
+        with profile._lock:
+            stacks = sorted(profile.stacks.items())
+        with open(f"{prefix}.folded", "w", encoding="utf-8") as f:
+            for stack, count in stacks:
+                f.write(f"{stack} {count}\n")
+        with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+            json.dump({**profile.to_dict(), "interval": self.interval}, f, ensure_ascii=False)
+        print(f"🔥 剖析结果已写入 {prefix}.folded（{profile.samples} 次采样，{profile.duration}s）")
+
+    def _ensure_sampler(self):
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+            self._sampler.start()
+        self._wakeup.set()
+
+    def _sample_loop(self):
+        # 没有进行中的会话时阻塞等待，不占用 CPU
+        while self._wakeup.wait():
+            while self.active:
+                try:
+                    self._sample()
+                except Exception as e:
+                    self._disable(e)
+                    return
+                time.sleep(self.interval)
+            self._wakeup.clear()
+
+    def _disable(self, error: Exception):
+        print(f"⚠️ 剖析采样失败，已关闭请求剖析: {error!r}")
+        self.enabled = False
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            # 结束会话、恢复任务工厂须在事件循环线程中进行
+            loop.call_soon_threadsafe(self.shutdown)
+
+    def _sample(self):
+        frame = self._current_frames().get(self._loop_thread_id) if self._current_frames is not None else None
+        # 事件循环当前执行的任务
+        running = asyncio.current_task(self._loop)
+        for profile in list(self.active.values()):
+            for task, label in profile.live_tasks():
+                coro = task.get_coro()
+                if task is running and frame is not None:
+                    stack = cpu_stack(frame, coro)
+                else:
+                    stack = await_stack(coro)
+                with profile._lock:
+                    profile.stacks[";".join([label, *stack])] += 1
+            profile.samples += 1
+
+    def shutdown(self):
+        for profile in list(self.active.values()):
+            self.finish(profile)
+        if self._loop is not None and self._loop.get_task_factory() == self._task_factory:
+            self._loop.set_task_factory(self._previous_factory)
+        self._loop = None
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,40 @@
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8")
+
+
+def quantize(embeddings: np.ndarray, precision: str) -> dict[str, np.ndarray]:
+    """
+    量化归一化后的 embedding 矩阵
+    :param embeddings: (图片数, 维度) float32 矩阵
+    :param precision: float32（不量化）、float16 或 int8（逐行对称量化，另存每行缩放系数）
+    :return: {"codes": 量化矩阵[, "scales": 每行缩放系数]}
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"不支持的精度：{precision}，可选 {PRECISIONS}")
+    if precision == "float32":
+        return {"codes": np.asarray(embeddings, dtype=np.float32)}
+    if precision == "float16":
+        return {"codes": np.asarray(embeddings, dtype=np.float16)}
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+    return {"codes": codes, "scales": scales.astype(np.float32)}
+
+
+def score_quantized(codes: np.ndarray, query_matrix: np.ndarray, scales: np.ndarray | None = None,
+                    block_rows: int = 256) -> np.ndarray:
+    """
+    计算 (查询数, 图片数) 相似度矩阵；按行分块反量化为 float32，块内数据留在缓存中，
+    不在内存中还原整份 float32 矩阵
+    """
+    query_t = np.ascontiguousarray(query_matrix.T, dtype=np.float32)
+    out = np.empty((codes.shape[0], query_matrix.shape[0]), dtype=np.float32)
+    for start in range(0, codes.shape[0], block_rows):
+        block = codes[start:start + block_rows]
+        if block.dtype != np.float32:
+            block = block.astype(np.float32)
+        np.dot(block, query_t, out=out[start:start + block_rows])
+    if scales is not None:
+        out *= scales[:, None]
+    return out.T
@@ -0,0 +1,236 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from middlewares.metrics import OUTBOUND_CALLS, OUTBOUND_CALL_SECONDS, CIRCUIT_STATE
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断打开期间直接拒绝调用，调用方应立即降级（如跳过图片）而不是等待上游
+    """
+
+
+class CircuitBreaker:
+    """
+    连续失败熔断器：
+    - closed：正常放行，连续失败达到 failure_threshold 次后打开
+    - open：直接拒绝，reset_timeout 秒后进入半开
+    - half_open：只放行一个探测调用，成功则关闭，失败则重新打开
+    """
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = "closed"
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state, self._probing = "half_open", False
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed" or self.failure_threshold <= 0:
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._state, self._probing = "closed", False
+
+    def release_probe(self):
+        """
+        探测调用被取消（未得出结果）时释放名额，由下一个调用继续探测
+        """
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == "half_open" or (self.failure_threshold > 0 and self.failures >= self.failure_threshold):
+            self._state, self._probing = "open", False
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """
+    最近 window 次成功调用的耗时，用于估计对冲请求的发起时机
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class CallPolicy:
+    """
+    外部调用策略（DashScope embedding、Dify），依次应用：
+    - 熔断：打开时立即抛出 CircuitOpenError；一次调用重试耗尽后才计一次失败
+    - 截止时间：单次尝试 timeout，包括重试与退避在内的总耗时 deadline
+    - 重试：仅对可重试的错误，指数退避 + 全抖动，避免同时重试形成尖峰
+    - 对冲：单次尝试超过近期 hedge_quantile 分位耗时仍未返回时，再并发发出一个相同请求，取先成功者；
+      对冲数量不超过调用数的 hedge_budget，上游整体变慢时不会让请求量翻倍
+    """
+
+    def __init__(self, name: str, timeout: float = 10.0, deadline: float = 30.0, retries: int = 2,
+                 backoff: float = 0.1, backoff_max: float = 2.0, hedge_quantile: float = 0.0,
+                 hedge_min_delay: float = 0.05, hedge_budget: float = 0.1, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        """
+        初始化
+        :param name: 服务名，用于指标标签
+        :param timeout: 单次尝试的超时（秒）
+        :param deadline: 整个调用（含重试）的截止时间（秒）
+        :param retries: 最大重试次数
+        :param backoff: 首次重试的退避基数（秒），之后按 2 的幂增长
+        :param backoff_max: 退避上限（秒）
+        :param hedge_quantile: 对冲触发的耗时分位，如 0.95；0 表示不对冲
+        :param hedge_min_delay: 对冲等待的下限（秒）
+        :param hedge_budget: 对冲请求数占调用数的比例上限
+        :param failure_threshold: 熔断的连续失败次数，0 表示不熔断
+        :param reset_timeout: 熔断打开后进入半开的等待（秒）
+        """
+        self.name = name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = LatencyTracker()
+        self._calls = 0
+        self._hedges = 0
+        CIRCUIT_STATE.set_function(lambda: CircuitBreaker.STATES[self.breaker.state], service=name)
+
+    def hedge_delay(self) -> float | None:
+        """
+        对冲等待时间；未开启、样本不足或超出对冲预算时返回 None
+        """
+        if self.hedge_quantile <= 0 or self._hedges > self.hedge_budget * self._calls:
+            return None
+        quantile = self.latency.quantile(self.hedge_quantile)
+        return None if quantile is None else max(quantile, self.hedge_min_delay)
+
+    def backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    async def call(self, operation, retryable=None, hedge: bool = True, counts_as_failure=None):
+        """
+        按策略执行一次外部调用
+        :param operation: 无参数的异步函数，每次尝试（含对冲）调用一次，须可重复执行
+        :param retryable: (异常) -> bool，判断失败后能否重试；为空时全部可重试。非幂等调用应只重试请求未发出的错误
+        :param hedge: 是否允许对冲，非幂等调用应关闭
+        :param counts_as_failure: (异常) -> bool，判断失败是否计入熔断；为空时全部计入。
+                                  调用方错误（如 4xx）说明上游可用，应排除，这类错误直接抛出、不重试
+        """
+        state = self.breaker.state
+        if not self.breaker.allow():
+            OUTBOUND_CALLS.labels(service=self.name, outcome="rejected").inc()
+            raise CircuitOpenError(f"{self.name} circuit open")
+        # 本次调用是否占用了半开状态的探测名额，只有占用者才能释放
+        probe = state == "half_open" and self.breaker.failure_threshold > 0
+
+        self._calls += 1
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(self._attempt(operation, hedge), min(self.timeout, remaining))
+            except asyncio.CancelledError:
+                if probe:
+                    self.breaker.release_probe()
+                raise
+            except Exception as e:
+                OUTBOUND_CALLS.labels(service=self.name,
+                                      outcome="timeout" if isinstance(e, asyncio.TimeoutError) else "error").inc()
+                if counts_as_failure is not None and not counts_as_failure(e):
+                    if probe:
+                        self.breaker.release_probe()
+                    raise
+                delay = self.backoff_delay(attempt)
+                if (attempt >= self.retries or (retryable is not None and not retryable(e))
+                        or time.monotonic() + delay >= deadline or (not probe and self.breaker.state == "open")):
+                    # 一次逻辑调用（含重试）只计一次失败，重试本身不会让熔断器提前打开
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                OUTBOUND_CALLS.labels(service=self.name, outcome="retry").inc()
+                await asyncio.sleep(delay)
+                continue
+            elapsed = time.perf_counter() - start
+            self.latency.observe(elapsed)
+            OUTBOUND_CALL_SECONDS.labels(service=self.name).observe(elapsed)
+            OUTBOUND_CALLS.labels(service=self.name, outcome="ok").inc()
+            self.breaker.record_success()
+            return result
+
+    async def _attempt(self, operation, hedge: bool):
+        delay = self.hedge_delay() if hedge else None
+        if delay is None:
+            return await operation()
+
+        pending = {asyncio.ensure_future(operation())}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self._hedges += 1
+                OUTBOUND_CALLS.labels(service=self.name, outcome="hedged").inc()
+                pending.add(asyncio.ensure_future(operation()))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+# DashScope 查询 embedding：幂等，可重试并在 p95 之后对冲
+embedding_policy = CallPolicy(
+    "dashscope_embedding",
+    timeout=float(os.getenv("EMBEDDING_TIMEOUT", 3)),
+    deadline=float(os.getenv("EMBEDDING_DEADLINE", 6)),
+    retries=int(os.getenv("EMBEDDING_RETRIES", 2)),
+    hedge_quantile=float(os.getenv("EMBEDDING_HEDGE_QUANTILE", 0.95)),
+    hedge_budget=float(os.getenv("EMBEDDING_HEDGE_BUDGET", 0.1)),
+    failure_threshold=int(os.getenv("EMBEDDING_BREAKER_FAILURES", 5)),
+    reset_timeout=float(os.getenv("EMBEDDING_BREAKER_RESET", 30)),
+)
+
+# Dify：chat-messages 非幂等，只在请求未发出或被明确拒绝时重试，不对冲；超时仅约束到收到响应头为止
+dify_policy = CallPolicy(
+    "dify",
+    timeout=float(os.getenv("DIFY_CONNECT_TIMEOUT", 10)),
+    deadline=float(os.getenv("DIFY_CONNECT_DEADLINE", 20)),
+    retries=int(os.getenv("DIFY_RETRIES", 2)),
+    backoff=0.2,
+    failure_threshold=int(os.getenv("DIFY_BREAKER_FAILURES", 5)),
+    reset_timeout=float(os.getenv("DIFY_BREAKER_RESET", 30)),
+)
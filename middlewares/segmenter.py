@@ -0,0 +1,143 @@
+import os
+import re
+import json
+import threading
+from functools import lru_cache
+
+# 型号、制式等带连字符的术语，如 GSM-R、WTZJ-Ⅱ（jieba 默认会在连字符处切开）
+TERM_PATTERN = re.compile(r"[A-Za-z0-9]+(?:-[A-Za-z0-9Ⅰ-Ⅻ]+)+")
+# jieba 默认只把 [中文 a-zA-Z0-9+#&._%-] 视为可切分块，补充罗马数字 Ⅰ-ⅿ，使 WTZJ-Ⅱ 可整体成词
+RE_HAN_DEFAULT = re.compile("([一-鿕a-zA-Z0-9+#&\\._%\\-Ⅰ-ⅿ]+)", re.U)
+RE_SKIP_DEFAULT = re.compile("(\r\n|\\s)", re.U)
+
+
+def build_domain_vocabulary(image_dir: str | None = None, triplets_path: str | None = None,
+                            max_entity_length: int = 6) -> list[str]:
+    """
+    从图片名与三元组实体中提取领域词表
+    :param image_dir: 图片目录，提取文件名中的型号术语
+    :param triplets_path: 三元组文件，较短的 head/tail 实体整体作为词，较长的只提取型号术语
+    :param max_entity_length: 整体成词的实体最大长度，过长的短语成词会使检索粒度过粗
+    """
+    texts, words = [], set()
+    if image_dir and os.path.isdir(image_dir):
+        texts.extend(os.path.splitext(file)[0] for file in os.listdir(image_dir))
+    if triplets_path and os.path.isfile(triplets_path):
+        with open(triplets_path, "r", encoding="UTF-8") as triplets_file:
+            for line in triplets_file:
+                if not line.strip():
+                    continue
+                triplet = json.loads(line)
+                for entity in (triplet["head"], triplet["tail"]):
+                    texts.append(entity)
+                    if 2 <= len(entity) <= max_entity_length and RE_HAN_DEFAULT.fullmatch(entity):
+                        words.add(entity)
+    for text in texts:
+        words.update(term for term in TERM_PATTERN.findall(text) if len(term) >= 2)
+    return sorted(words)
+
+
+class DomainSegmenter:
+    """
+    带领域词表与结果缓存的 jieba 分词器
+    - 前缀词典序列化缓存放在持久目录，避免每个进程重新构建（容器中 /tmp 不保留）
+    - 领域词表由图片名与三元组实体自动生成，另可加载人工维护的用户词典
+    - 相同字符串的分词结果做 LRU 缓存
+    """
+
+    def __init__(self, cache_dir: str = os.getenv("JIEBA_CACHE_PATH", "assets/jieba"),
+                 user_dict_path: str = os.getenv("JIEBA_USER_DICT_PATH", "configs/railway_userdict.txt"),
+                 image_dir: str = os.getenv("STATIC_IMAGE_PATH"),
+                 triplets_path: str = os.getenv("TRIPLETS_PATH"),
+                 memo_size: int = int(os.getenv("JIEBA_MEMO_SIZE", 4096))):
+        """
+        初始化
+        :param cache_dir: 前缀词典缓存目录
+        :param user_dict_path: 人工维护的用户词典（jieba 格式：词 [词频] [词性]），不存在时忽略
+        :param image_dir: 图片目录，用于生成领域词表
+        :param triplets_path: 三元组文件，用于生成领域词表
+        :param memo_size: 分词结果缓存条数
+        """
+        self.cache_dir = cache_dir
+        self.user_dict_path = user_dict_path
+        self.image_dir = image_dir
+        self.triplets_path = triplets_path
+        self.vocabulary = []
+        self._tokenizer = None
+        self._lock = threading.Lock()
+        self.lcut = lru_cache(maxsize=memo_size)(self._lcut)
+        self.lcut_for_search = lru_cache(maxsize=memo_size)(self._lcut_for_search)
+
+    def initialize(self):
+        """
+        加载前缀词典（优先读取持久缓存）并注册领域词表，线程安全，可重复调用
+        """
+        if self._tokenizer is not None:
+            return
+        with self._lock:
+            if self._tokenizer is not None:
+                return
+            import jieba
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tokenizer = jieba.Tokenizer()
+            tokenizer.tmp_dir = self.cache_dir
+            tokenizer.initialize()
+            if self.user_dict_path and os.path.isfile(self.user_dict_path):
+                tokenizer.load_userdict(self.user_dict_path)
+            self.vocabulary = build_domain_vocabulary(self.image_dir, self.triplets_path)
+            for word in self.vocabulary:
+                tokenizer.add_word(word)
+            self._tokenizer = tokenizer
+
+    def _cut(self, text: str):
+        """
+        与 jieba Tokenizer.cut 的精确模式（HMM）相同，但按 RE_HAN_DEFAULT 划分可切分块；
+        不修改 jieba 模块的全局正则，进程内其他 jieba 使用者不受影响
+        """
+        cut_block = self._tokenizer._Tokenizer__cut_DAG
+        for block in RE_HAN_DEFAULT.split(text):
+            if not block:
+                continue
+            if RE_HAN_DEFAULT.match(block):
+                yield from cut_block(block)
+                continue
+            for part in RE_SKIP_DEFAULT.split(block):
+                if RE_SKIP_DEFAULT.match(part):
+                    yield part
+                else:
+                    yield from part
+
+    def _lcut(self, text: str) -> tuple[str, ...]:
+        self.initialize()
+        return tuple(self._cut(text))
+
+    def _lcut_for_search(self, text: str) -> tuple[str, ...]:
+        """
+        搜索引擎模式：长词额外输出其中的词典子词（如 CIR设备 -> 设备），用于词法索引；
+        子词规则与 jieba Tokenizer.cut_for_search 相同
+        """
+        self.initialize()
+        freq, words = self._tokenizer.FREQ, []
+        for word in self._cut(text):
+            for n in (2, 3):
+                if len(word) > n:
+                    words.extend(word[i:i + n] for i in range(len(word) - n + 1) if freq.get(word[i:i + n]))
+            words.append(word)
+        return tuple(words)
+
+    def segment(self, text: str) -> str:
+        """
+        分词后以空格连接，作为 embedding 的输入文本
+        """
+        return " ".join(self.lcut(text))
+
+
+segmenter = DomainSegmenter()
+
+
+if __name__ == '__main__':
+    # 预先生成前缀词典缓存（可在镜像构建阶段执行），并打印领域词表规模
+    segmenter.initialize()
+    print(f"✅ 词典缓存目录：{segmenter.cache_dir}，领域词 {len(segmenter.vocabulary)} 个")
+    for text in ["GSM-R呼叫失败", "车次功能号注册", "WTZJ-Ⅱ标准型CIR设备", "小型CIR B子架端口面板"]:
+        print(segmenter.lcut(text))
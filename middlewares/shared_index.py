@@ -0,0 +1,239 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+
+
+def fingerprint(*parts) -> str:
+    """
+    由源文件状态等信息计算索引版本号，多个 worker 对同一份源数据得到相同版本
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(json.dumps(part, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def file_state(path: str) -> list:
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, stat_result.st_mtime_ns, stat_result.st_size]
+
+
+def _digest(data: bytes) -> int:
+    # 跨进程稳定的 64 位摘要（内置 hash 按进程随机化）
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def encode_strings(name: str, strings: list[str]) -> dict[str, np.ndarray]:
+    """
+    把字符串表编码为可随共享索引发布的数组：
+    - {name}_data：各字符串 UTF-8 字节依次拼接，每个后接一个 \0，子串匹配不会跨越两个字符串
+    - {name}_offsets：第 i 个字符串位于 data[offsets[i]:offsets[i + 1] - 1]
+    - {name}_hashes / {name}_order：按摘要排序的下标，用于精确查找
+    """
+    encoded = [text.encode("utf-8") for text in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) + 1 for item in encoded])
+    hashes = np.array([_digest(item) for item in encoded], dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+    return {
+        f"{name}_data": np.frombuffer(b"".join(item + b"\0" for item in encoded), dtype=np.uint8),
+        f"{name}_offsets": offsets,
+        f"{name}_hashes": hashes[order],
+        f"{name}_order": order.astype(np.int64),
+    }
+
+
+class StringTable:
+    """
+    挂载在共享数组上的只读字符串表（由 encode_strings 编码），字符串本身不复制到各 worker：
+    按下标访问时才解码单个字符串，子串匹配直接在 mmap 的字节上进行
+    """
+
+    def __init__(self, arrays: dict[str, np.ndarray], name: str):
+        self.data = arrays[f"{name}_data"]
+        self.offsets = arrays[f"{name}_offsets"]
+        self.hashes = arrays[f"{name}_hashes"]
+        self.order = arrays[f"{name}_order"]
+        # 表中出现过的字节长度，用于 occurring_in 剪枝（只保存去重后的长度）
+        self._byte_lengths = set(np.unique(np.diff(self.offsets) - 1).tolist())
+        self._max_bytes = max(self._byte_lengths, default=0)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index) -> str:
+        return self.data[self.offsets[index]:self.offsets[index + 1] - 1].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def index(self, text: str) -> int | None:
+        """
+        精确查找，返回下标，不存在时返回 None
+        """
+        digest = np.uint64(_digest(text.encode("utf-8")))
+        start, end = np.searchsorted(self.hashes, digest, "left"), np.searchsorted(self.hashes, digest, "right")
+        for position in range(start, end):
+            if self[self.order[position]] == text:
+                return int(self.order[position])
+        return None
+
+    def containing(self, text: str) -> np.ndarray:
+        """
+        包含子串 text 的字符串下标（升序）；UTF-8 自同步，字节匹配即字符匹配
+        """
+        if not text:
+            return np.arange(len(self))
+        starts = [match.start() for match in re.finditer(re.escape(text.encode("utf-8")), memoryview(self.data))]
+        return np.unique(np.searchsorted(self.offsets, starts, "right") - 1)
+
+    def occurring_in(self, text: str, min_length: int = 1) -> list[int]:
+        """
+        完整出现在 text 中、长度不少于 min_length 个字符的字符串下标
+        枚举 text 的子串按摘要查找，只枚举表中存在的字节长度
+        """
+        parts = []
+        for start in range(len(text)):
+            for end in range(start + min_length, len(text) + 1):
+                part = text[start:end].encode("utf-8")
+                if len(part) > self._max_bytes:
+                    break
+                if len(part) in self._byte_lengths:
+                    parts.append(part)
+        if not parts or not len(self):
+            return []
+        # 全部子串的摘要一次性在有序摘要数组中定位，命中后再比对原文排除摘要碰撞
+        digests = np.array([_digest(part) for part in parts], dtype=np.uint64)
+        positions = np.minimum(np.searchsorted(self.hashes, digests), len(self.hashes) - 1)
+        found = set()
+        for part, digest, position in zip(parts, digests, positions):
+            while position < len(self.hashes) and self.hashes[position] == digest:
+                index = int(self.order[position])
+                if self[index] == part.decode("utf-8"):
+                    found.add(index)
+                position += 1
+        return sorted(found)
+
+
+class SharedArrayStore:
+    """
+    版本化的共享只读数组存储：
+    - publish 把数组写成 .npy 文件（先写临时目录再原子 rename），并原子替换 CURRENT 指针
+    - attach 以 mmap_mode="r" 挂载，各 worker 共享同一份操作系统页缓存，内存不随 worker 数增长
+    - 索引重建时发布新版本，worker 通过 refresh 检测 CURRENT 变化后切换
+    - 发布后只保留最近 keep_versions 个版本（至少保留上一版本），更早的版本目录直接删除
+    旧版本删除时其他 worker 可能仍挂载着它：这依赖 Linux/POSIX 语义，已 mmap 的文件被 unlink 后映射仍然有效，
+    直到该 worker 切换版本释放数组；Windows 上被映射的文件无法删除，删除失败会被忽略，留待下次发布再清理
+    """
+
+    def __init__(self, root_dir: str = os.getenv("SHARED_INDEX_PATH", "assets/shared_index"),
+                 keep_versions: int = int(os.getenv("SHARED_INDEX_KEEP_VERSIONS", 2))):
+        """
+        初始化
+        :param root_dir: 共享索引根目录
+        :param keep_versions: 每个索引保留的版本数（含当前版本），小于 2 时按 2 处理，
+                              刚读到旧 CURRENT 的 worker 仍能挂载上一版本
+        """
+        self.root_dir = root_dir
+        self.keep_versions = keep_versions
+
+    def _current_path(self, name: str) -> str:
+        return os.path.join(self.root_dir, name, "CURRENT")
+
+    def current_version(self, name: str) -> str | None:
+        try:
+            with open(self._current_path(name), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def has_version(self, name: str, version: str) -> bool:
+        return os.path.isfile(os.path.join(self.root_dir, name, version, "meta.json"))
+
+    def publish(self, name: str, version: str, arrays: dict[str, np.ndarray], meta: dict):
+        """
+        发布一个版本；同版本已存在（其他 worker 已发布）时只更新 CURRENT
+        """
+        index_dir = os.path.join(self.root_dir, name)
+        version_dir = os.path.join(index_dir, version)
+        os.makedirs(index_dir, exist_ok=True)
+        if not self.has_version(name, version):
+            tmp_dir = f"{version_dir}.{os.getpid()}.tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            for array_name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f"{array_name}.npy"), np.ascontiguousarray(array))
+            with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"arrays": list(arrays), "created_at": time.time(), **meta}, f, ensure_ascii=False)
+            try:
+                os.rename(tmp_dir, version_dir)
+            except OSError:
+                # 并发发布时其他 worker 已先完成
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        tmp_current = f"{self._current_path(name)}.{os.getpid()}.tmp"
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_current, self._current_path(name))
+        self._cleanup(name, version)
+
+    def attach(self, name: str, version: str | None = None):
+        """
+        只读挂载指定版本（默认 CURRENT），返回 (version, arrays, meta)，不存在时返回 None
+        """
+        version = version or self.current_version(name)
+        if version is None or not self.has_version(name, version):
+            return None
+        version_dir = os.path.join(self.root_dir, name, version)
+        try:
+            with open(os.path.join(version_dir, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            arrays = {array_name: np.load(os.path.join(version_dir, f"{array_name}.npy"), mmap_mode="r")
+                      for array_name in meta["arrays"]}
+        except FileNotFoundError:
+            # 挂载途中该版本已被其他 worker 的发布清理
+            return None
+        return version, arrays, meta
+
+    def _cleanup(self, name: str, current: str):
+        index_dir = os.path.join(self.root_dir, name)
+        versions = [d for d in os.listdir(index_dir)
+                    if d != current and os.path.isdir(os.path.join(index_dir, d)) and not d.endswith(".tmp")]
+        versions.sort(key=lambda d: os.path.getmtime(os.path.join(index_dir, d)), reverse=True)
+        for stale in versions[max(self.keep_versions - 1, 1):]:
+            shutil.rmtree(os.path.join(index_dir, stale), ignore_errors=True)
+
+
+class SharedIndexWatcher:
+    """
+    限频检查 CURRENT 指针，发现新版本时回调重新挂载
+    """
+
+    def __init__(self, store: SharedArrayStore, name: str, on_change,
+                 interval: float = float(os.getenv("SHARED_INDEX_CHECK_INTERVAL", 5))):
+        self.store = store
+        self.name = name
+        self.on_change = on_change
+        self.interval = interval
+        self.version = None
+        self._checked_at = 0.0
+
+    def maybe_refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.interval:
+            return
+        self._checked_at = now
+        version = self.store.current_version(self.name)
+        if version is not None and version != self.version:
+            attached = self.store.attach(self.name, version)
+            if attached is not None:
+                self.on_change(*attached)
+                self.version = version
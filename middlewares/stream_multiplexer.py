@@ -0,0 +1,212 @@
+import os
+import json
+import asyncio
+from fastapi import WebSocket, WebSocketDisconnect, HTTPException
+from middlewares.message_queue import event_bus
+from middlewares.stream_registry import stream_registry, StreamGapError
+from middlewares.metrics import ACTIVE_STREAMS
+
+# 每个流未确认事件数的上限（流控窗口），0 表示不做流控
+WS_STREAM_WINDOW = int(os.getenv("WS_STREAM_WINDOW", 64))
+# 单个 WebSocket 连接同时订阅的流数量上限
+WS_MAX_STREAMS = int(os.getenv("WS_MAX_STREAMS", 8))
+
+
+def format_ws_event(stream_id: str, event_id: int, frame: str) -> str:
+    """
+    把回放缓冲中的 SSE 帧转为 WebSocket 消息，data 部分已是 JSON，直接拼接不再重复编码
+    """
+    if frame.startswith('data: [DONE]'):
+        return json.dumps({"op": "end", "stream_id": stream_id, "id": event_id})
+    return f'{{"op":"event","stream_id":{json.dumps(stream_id)},"id":{event_id},"data":{frame[6:].rstrip()}}}'
+
+
+class StreamSubscription:
+    """
+    连接上的一个流订阅：已发送但未确认的事件数达到 window 时暂停转发，
+    事件仍留在回放缓冲中，不阻塞上游
+    """
+
+    def __init__(self, stream_id: str, window: int, acked: int, upstream: asyncio.Task | None):
+        self.stream_id = stream_id
+        self.window = window
+        self.acked = acked
+        self.upstream = upstream
+        self.task: asyncio.Task | None = None
+        self._credit = asyncio.Event()
+
+    def ack(self, event_id: int):
+        if event_id > self.acked:
+            self.acked = event_id
+            self._credit.set()
+
+    async def wait_credit(self, event_id: int):
+        while self.window > 0 and event_id - self.acked > self.window:
+            self._credit.clear()
+            await self._credit.wait()
+
+
+class MultiplexedConnection:
+    """
+    单个 WebSocket 连接上复用多个问答流，与 SSE 共用同一个流注册表。
+    客户端消息（JSON）：
+    - {"op": "ask", "ref": 客户端自定义标识, "question": ..., "history": [...], "conversation_id": ..., "window": 64}
+    - {"op": "attach", "stream_id": ..., "last_event_id": 0, "window": 64}  订阅已有的流（含 SSE 发起的流）
+    - {"op": "ack", "stream_id": ..., "id": 已处理的最大事件 id}  流控确认
+    - {"op": "cancel", "stream_id": ...}  取消订阅；本连接发起的流同时取消上游 Dify 请求
+    服务端消息：
+    - {"op": "opened", "ref": ..., "stream_id": ...}
+    - {"op": "event", "stream_id": ..., "id": ..., "data": {"type": ..., "text": ...}}
+    - {"op": "end", "stream_id": ..., "id": ...}
+    - {"op": "cancelled", "stream_id": ...}
+    - {"op": "error", "ref"/"stream_id": ..., "status": ..., "detail": ...}
+    连接断开只停止转发，上游继续写入回放缓冲，可重新 attach 或通过 SSE 续传接口读取
+    """
+
+    def __init__(self, websocket: WebSocket, start_answer, window: int = WS_STREAM_WINDOW,
+                 max_streams: int = WS_MAX_STREAMS):
+        """
+        初始化
+        :param start_answer: async (websocket, message) -> (stream_id, Dify 任务)，负责准入、参数校验与建流
+        :param window: 默认流控窗口
+        :param max_streams: 本连接同时订阅的流数量上限
+        """
+        self.websocket = websocket
+        self.start_answer = start_answer
+        self.window = window
+        self.max_streams = max_streams
+        self.subscriptions: dict[str, StreamSubscription] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: dict | str):
+        text = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
+        async with self._send_lock:
+            await self.websocket.send_text(text)
+
+    async def run(self):
+        await self.websocket.accept()
+        try:
+            while True:
+                received = await self.websocket.receive()
+                if received["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(received.get("code", 1000))
+                if received.get("text") is None:
+                    # 只接受文本帧，二进制帧直接拒绝而不是中断连接
+                    await self.send({"op": "error", "status": 400, "detail": "Binary frames are not supported"})
+                    continue
+                try:
+                    message = json.loads(received["text"])
+                except (TypeError, ValueError):
+                    await self.send({"op": "error", "status": 400, "detail": "Invalid JSON message"})
+                    continue
+                if not isinstance(message, dict):
+                    await self.send({"op": "error", "status": 400, "detail": "Message must be an object"})
+                    continue
+                try:
+                    await self.dispatch(message)
+                except WebSocketDisconnect:
+                    raise
+                except (TypeError, ValueError) as e:
+                    await self.send({"op": "error", "ref": message.get("ref"), "stream_id": message.get("stream_id"),
+                                     "status": 400, "detail": str(e)})
+                except Exception as e:
+                    # 单条消息处理失败只影响该请求，连接上的其他流继续推送
+                    print(f"⚠️ WebSocket 消息处理失败: {e!r}")
+                    await self.send({"op": "error", "ref": message.get("ref"), "stream_id": message.get("stream_id"),
+                                     "status": 500, "detail": "Internal server error"})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for subscription in self.subscriptions.values():
+                if subscription.task is not None:
+                    subscription.task.cancel()
+            self.subscriptions.clear()
+
+    async def dispatch(self, message: dict):
+        op = message.get("op")
+        stream_id = message.get("stream_id")
+        if op == "ask":
+            await self._ask(message)
+        elif op == "attach":
+            await self._attach(message)
+        elif op == "ack" and stream_id in self.subscriptions:
+            self.subscriptions[stream_id].ack(int(message.get("id", 0)))
+        elif op == "cancel" and stream_id in self.subscriptions:
+            await self._cancel(self.subscriptions.pop(stream_id))
+        elif op not in ("ack", "cancel"):
+            await self.send({"op": "error", "status": 400, "detail": f"Unknown op: {op}"})
+
+    def _window(self, message: dict) -> int:
+        window = message.get("window")
+        return self.window if window is None else max(int(window), 0)
+
+    async def _ask(self, message: dict):
+        ref = message.get("ref")
+        if len(self.subscriptions) >= self.max_streams:
+            await self.send({"op": "error", "ref": ref, "status": 429, "detail": "Too many streams on connection"})
+            return
+        try:
+            stream_id, upstream = await self.start_answer(self.websocket, message)
+        except HTTPException as e:
+            await self.send({"op": "error", "ref": ref, "status": e.status_code, "detail": e.detail,
+                             "retry_after": (e.headers or {}).get("Retry-After")})
+            return
+        except Exception as e:
+            # 建流失败（如上游连接错误）：按 ref 报告，不中断连接
+            print(f"⚠️ WebSocket 建流失败: {e!r}")
+            await self.send({"op": "error", "ref": ref, "status": 500, "detail": "Failed to start answer"})
+            return
+        await self.send({"op": "opened", "ref": ref, "stream_id": stream_id})
+        self._subscribe(stream_id, 0, self._window(message), upstream)
+
+    async def _attach(self, message: dict):
+        stream_id = message.get("stream_id")
+        last_event_id = int(message.get("last_event_id") or 0)
+        buffer = stream_registry.get(stream_id)
+        if buffer is None:
+            await self.send({"op": "error", "stream_id": stream_id, "status": 404,
+                             "detail": "Stream not found or expired"})
+        elif not buffer.can_resume(last_event_id):
+            await self.send({"op": "error", "stream_id": stream_id, "status": 410,
+                             "detail": "Requested events are no longer buffered"})
+        elif stream_id in self.subscriptions or len(self.subscriptions) >= self.max_streams:
+            await self.send({"op": "error", "stream_id": stream_id, "status": 409,
+                             "detail": "Already subscribed or too many streams on connection"})
+        else:
+            self._subscribe(stream_id, last_event_id, self._window(message), None)
+
+    def _subscribe(self, stream_id: str, last_event_id: int, window: int, upstream: asyncio.Task | None):
+        subscription = StreamSubscription(stream_id, window, last_event_id, upstream)
+        subscription.task = asyncio.create_task(self._forward(subscription, last_event_id))
+        self.subscriptions[stream_id] = subscription
+
+    async def _forward(self, subscription: StreamSubscription, last_event_id: int):
+        ACTIVE_STREAMS.labels().inc()
+        try:
+            buffer = stream_registry.get(subscription.stream_id)
+            if buffer is None:
+                return
+            try:
+                async for event_id, frame in buffer.follow(last_event_id):
+                    await subscription.wait_credit(event_id)
+                    await self.send(format_ws_event(subscription.stream_id, event_id, frame))
+            except StreamGapError:
+                # 客户端确认过慢，所需事件已被淘汰：与 attach 一致返回 410，结束本订阅
+                await self.send({"op": "error", "stream_id": subscription.stream_id, "status": 410,
+                                 "detail": "Requested events are no longer buffered"})
+        except (WebSocketDisconnect, RuntimeError):
+            # 连接已关闭，由 run 负责清理
+            pass
+        finally:
+            ACTIVE_STREAMS.labels().dec()
+            if self.subscriptions.get(subscription.stream_id) is subscription:
+                del self.subscriptions[subscription.stream_id]
+
+    async def _cancel(self, subscription: StreamSubscription):
+        if subscription.task is not None:
+            subscription.task.cancel()
+        if subscription.upstream is not None and not subscription.upstream.done():
+            subscription.upstream.cancel()
+            # 通知回放缓冲结束，其他跟随者（如 SSE 续传）也能收到结束事件
+            await event_bus.publish(subscription.stream_id, ('end', ''))
+        await self.send({"op": "cancelled", "stream_id": subscription.stream_id})
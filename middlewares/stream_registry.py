@@ -0,0 +1,224 @@
+import os
+import json
+import asyncio
+import hashlib
+from collections import deque
+from middlewares.message_queue import event_bus
+from middlewares.metrics import QUEUE_DEPTH
+
+
+def format_event(item: tuple) -> str | None:
+    """
+    把事件总线中的 (type, text) 转为 SSE data 行，无需推送的事件返回 None
+    """
+    try:
+        type_, text = item
+    except (TypeError, ValueError):
+        # 如果item无法解包，跳过
+        return None
+    # 确保text是字符串，如果为空则用空字符串
+    text = text if text else ""
+    if type_ == 'end':
+        return 'data: [DONE]\n\n'
+    if type_ in ['think', 'plain_text', 'images']:
+        data = json.dumps({"type": type_, "text": text}, ensure_ascii=False)
+        return f'data: {data}\n\n'
+    if type_ in ['echarts']:
+        try:
+            echarts = json.loads(text)
+        except (TypeError, ValueError):
+            return None
+        data = json.dumps({"type": type_, "text": echarts}, ensure_ascii=False)
+        return f'data: {data}\n\n'
+    # 未知类型跳过
+    return None
+
+
+class StreamGapError(Exception):
+    """
+    跟随读取的连接落后过多，所需事件已被回放缓冲淘汰；连接应结束，客户端续传时得到 410
+    """
+
+    def __init__(self, stream_id: str, first_id: int):
+        super().__init__(f"Stream {stream_id} evicted events before id {first_id}")
+        self.first_id = first_id
+
+
+def format_gap_event(first_id: int) -> str:
+    """
+    通知 SSE 客户端事件出现缺口（命名事件 gap），发出后服务端随即结束响应
+    """
+    return f'event: gap\ndata: {json.dumps({"type": "gap", "first_id": first_id})}\n\n'
+
+
+# 同一流中内容完全相同时只推送一次的事件类型（预取结果与 Dify 回调可能重复）
+DEDUP_TYPES = ('images', 'echarts')
+
+
+class StreamBuffer:
+    """
+    单个问答流的有界回放缓冲：事件按自增 id 保存，超过字节上限时淘汰最早的事件。
+    任意数量的连接可从某个 id 之后开始跟随读取
+    """
+
+    def __init__(self, stream_id: str, max_bytes: int):
+        self.stream_id = stream_id
+        self.max_bytes = max_bytes
+        self.frames: deque[tuple[int, str]] = deque()
+        self.next_id = 1
+        self.bytes = 0
+        self.finished = False
+        self.claimed: dict[str, set] = {}
+        self._seen_frames: set[bytes] = set()
+        self._changed = asyncio.Event()
+
+    @property
+    def first_id(self) -> int:
+        return self.frames[0][0] if self.frames else self.next_id
+
+    def append(self, frame: str):
+        self.frames.append((self.next_id, frame))
+        self.next_id += 1
+        self.bytes += len(frame)
+        while self.bytes > self.max_bytes and len(self.frames) > 1:
+            self.bytes -= len(self.frames.popleft()[1])
+        self._notify()
+
+    def is_duplicate(self, type_: str, frame: str) -> bool:
+        """
+        图片、图表事件与已推送过的内容完全相同时返回 True
+        """
+        if type_ not in DEDUP_TYPES:
+            return False
+        digest = hashlib.sha1(frame.encode("utf-8")).digest()
+        if digest in self._seen_frames:
+            return True
+        self._seen_frames.add(digest)
+        return False
+
+    def claim(self, kind: str, keys) -> list:
+        """
+        登记本流已推送（或即将推送）的内容，返回此前未登记过的 key；
+        用于预取结果与 Dify 回调之间按语义去重（如图片链接、图谱三元组）
+        """
+        claimed = self.claimed.setdefault(kind, set())
+        fresh = [key for key in dict.fromkeys(keys) if key not in claimed]
+        claimed.update(fresh)
+        return fresh
+
+    def finish(self):
+        self.finished = True
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def can_resume(self, last_event_id: int) -> bool:
+        """
+        last_event_id 之后的事件是否仍完整保留在缓冲中
+        """
+        return last_event_id + 1 >= self.first_id
+
+    async def follow(self, last_event_id: int = 0):
+        """
+        依次产出 id > last_event_id 的 (id, frame)，流结束且已读完时返回；
+        下一条待读事件已被淘汰时抛出 StreamGapError，不静默跳过
+        """
+        cursor = last_event_id
+        while True:
+            changed = self._changed
+            while cursor + 1 < self.next_id:
+                # 读取落后时事件可能已被淘汰，每次按当前首个 id 定位
+                if cursor + 1 < self.first_id:
+                    raise StreamGapError(self.stream_id, self.first_id)
+                event_id, frame = self.frames[cursor + 1 - self.first_id]
+                cursor = event_id
+                yield event_id, frame
+            if self.finished:
+                return
+            await changed.wait()
+
+
+class StreamRegistry:
+    """
+    问答流注册表：每个流一个后台任务从事件总线读取事件写入回放缓冲，
+    与客户端连接解耦——连接断开不影响上游，重连后按 Last-Event-ID 续传；
+    上游结束后缓冲再保留 grace 秒。
+    缓冲保存在进程内，多 worker 部署时续传请求需落到同一 worker（会话保持）
+    """
+
+    def __init__(self, max_bytes: int = int(os.getenv("STREAM_REPLAY_MAX_BYTES", 1024 * 1024)),
+                 grace: float = float(os.getenv("STREAM_REPLAY_GRACE", 120)),
+                 idle_timeout: float = float(os.getenv("STREAM_IDLE_TIMEOUT", 600))):
+        """
+        初始化
+        :param max_bytes: 单个流回放缓冲的字节上限
+        :param grace: 上游结束后缓冲保留的秒数
+        :param idle_timeout: 上游持续无事件超过该秒数视为结束
+        """
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.idle_timeout = idle_timeout
+        self.streams: dict[str, StreamBuffer] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def open(self, stream_id: str) -> StreamBuffer:
+        """
+        为新建的问答流创建缓冲并启动读取任务（event_bus.open 须已调用）；
+        只在建流时调用，已登记的 stream_id 抛出 ValueError。连接接入已有的流使用 get，
+        已过期的流不会被重新创建
+        """
+        if stream_id in self.streams:
+            raise ValueError(f"Stream {stream_id} is already open")
+        buffer = self.streams[stream_id] = StreamBuffer(stream_id, self.max_bytes)
+        self._tasks[stream_id] = asyncio.create_task(self._pump(buffer))
+        return buffer
+
+    def get(self, stream_id: str) -> StreamBuffer | None:
+        """
+        取得流的缓冲，未知或已过期返回 None
+        """
+        return self.streams.get(stream_id)
+
+    async def _pump(self, buffer: StreamBuffer):
+        idle = 0.0
+        try:
+            try:
+                while True:
+                    item = await event_bus.get(buffer.stream_id, timeout=1.0)
+                    if item is None:
+                        idle += 1.0
+                        if idle >= self.idle_timeout:
+                            break
+                        continue
+                    idle = 0.0
+                    frame = format_event(item)
+                    if frame is not None and not buffer.is_duplicate(item[0], frame):
+                        buffer.append(frame)
+                    if item[0] == 'end':
+                        break
+            except Exception as e:
+                # 事件总线读取失败（如 Redis 断开）：结束缓冲，已连接的客户端读完已有事件后结束
+                print(f"⚠️ 问答流 {buffer.stream_id} 读取失败: {e!r}")
+            finally:
+                buffer.finish()
+                await event_bus.close(buffer.stream_id)
+            await asyncio.sleep(self.grace)
+        finally:
+            # 正常结束、读取失败或被取消都从注册表移除，避免条目泄漏
+            self.streams.pop(buffer.stream_id, None)
+            self._tasks.pop(buffer.stream_id, None)
+
+    def buffered_frames(self) -> int:
+        return sum(len(buffer.frames) for buffer in self.streams.values())
+
+    async def shutdown(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self.streams.clear()
+        self._tasks.clear()
+
+
+stream_registry = StreamRegistry()
+QUEUE_DEPTH.set_function(stream_registry.buffered_frames, queue="replay")
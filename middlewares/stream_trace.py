@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import uuid
+import logging
+from logging.handlers import RotatingFileHandler
+
+
+class StreamTrace:
+    """
+    单次 /ask 的事件轨迹：记录每条 Dify 事件与回调命中的相对时间戳
+    """
+
+    def __init__(self, query: str, stream_id: str):
+        self.trace_id = uuid.uuid4().hex
+        self.stream_id = stream_id
+        self.query = query
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.events = []
+
+    def record(self, source: str, **fields):
+        """
+        :param source: 事件来源，dify / query-to-image / keywords-to-graph / speculative
+        :param fields: event、node_id、type、bytes，以及推入队列的 item=(type, text)
+        """
+        self.events.append({"t": round(time.perf_counter() - self._start, 4), "source": source, **fields})
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "stream_id": self.stream_id,
+            "started_at": self.started_at,
+            "query": self.query,
+            "events": self.events,
+        }
+
+
+class StreamTraceRecorder:
+    """
+    事件轨迹记录器，按行写入 JSON 到滚动日志文件，默认关闭
+    """
+
+    def __init__(self, enabled: bool = os.getenv("STREAM_TRACE_ENABLED", "false").lower() == "true",
+                 path: str = os.getenv("STREAM_TRACE_PATH", "logs/stream_traces.jsonl"),
+                 max_bytes: int = int(os.getenv("STREAM_TRACE_MAX_BYTES", 20 * 1024 * 1024)),
+                 backup_count: int = int(os.getenv("STREAM_TRACE_BACKUP_COUNT", 5))):
+        """
+        初始化
+        :param enabled: 是否记录
+        :param path: 轨迹文件路径
+        :param max_bytes: 单个文件大小上限，超过后滚动
+        :param backup_count: 保留的历史文件数
+        """
+        self.enabled = enabled
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.active: dict[str, StreamTrace] = {}
+        self._logger = None
+
+    def _get_logger(self) -> logging.Logger:
+        if self._logger is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes,
+                                          backupCount=self.backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("stream_trace")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def start(self, query: str, stream_id: str) -> StreamTrace | None:
+        if not self.enabled:
+            return None
+        trace = StreamTrace(query, stream_id)
+        self.active[stream_id] = trace
+        return trace
+
+    def record_callback(self, stream_id: str | None, source: str, **fields):
+        """
+        回调接口命中时调用；旧版工作流回调不携带流标识时记入当前所有活跃轨迹
+        """
+        traces = list(self.active.values()) if not stream_id else [self.active.get(stream_id)]
+        for trace in traces:
+            if trace is not None:
+                trace.record(source, **fields)
+
+    def finish(self, trace: StreamTrace | None):
+        if trace is None:
+            return
+        self.active.pop(trace.stream_id, None)
+        self._get_logger().info(json.dumps(trace.to_dict(), ensure_ascii=False))
+
+
+def load_traces(path: str) -> list[dict]:
+    """
+    读取轨迹文件中的全部轨迹
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+stream_tracer = StreamTraceRecorder()
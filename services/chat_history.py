@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import math
+import hashlib
+from collections import OrderedDict
+
+# 工作流开始节点中 chat_histories 变量的 max_length 为 20000 字符
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", 2000))
+HISTORY_MAX_CHARS = int(os.getenv("HISTORY_MAX_CHARS", 8000))
+HISTORY_TURN_MAX_CHARS = int(os.getenv("HISTORY_TURN_MAX_CHARS", 800))
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", 300))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中日韩字符约 1 字 1 token，其余约 4 字符 1 token
+    """
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "豈" <= ch <= "﫿")
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def normalize_turns(history: list) -> list[dict]:
+    """
+    把客户端传入的历史统一为 [{"role": "user"|"assistant", "content": str}, ...]
+    兼容 {"role", "content"}、{"question", "answer"} 与 [问, 答] 三种写法
+    """
+    turns = []
+    for item in history or []:
+        if isinstance(item, dict) and "content" in item:
+            turns.append({"role": item.get("role", "user"), "content": str(item["content"])})
+        elif isinstance(item, dict) and ("question" in item or "answer" in item):
+            if item.get("question"):
+                turns.append({"role": "user", "content": str(item["question"])})
+            if item.get("answer"):
+                turns.append({"role": "assistant", "content": str(item["answer"])})
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            turns.append({"role": "user", "content": str(item[0])})
+            turns.append({"role": "assistant", "content": str(item[1])})
+        else:
+            turns.append({"role": "user", "content": json.dumps(item, ensure_ascii=False)})
+    return turns
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def fit_history(turns: list[dict], max_tokens: int = HISTORY_MAX_TOKENS, max_chars: int = HISTORY_MAX_CHARS,
+                turn_max_chars: int = HISTORY_TURN_MAX_CHARS,
+                summary_max_chars: int = HISTORY_SUMMARY_MAX_CHARS) -> list[dict]:
+    """
+    按 token 预算保留最近的若干轮，单轮内容截断到 turn_max_chars；
+    超出窗口的较早轮次压缩为一条摘要（抽取较早的用户问题），不额外调用模型
+    """
+    kept, used_tokens, used_chars = [], 0, 0
+    for turn in reversed(turns):
+        content = _clip(turn["content"], turn_max_chars)
+        tokens, chars = estimate_tokens(content), len(content)
+        if used_tokens + tokens > max_tokens or used_chars + chars > max_chars:
+            break
+        kept.append({"role": turn["role"], "content": content})
+        used_tokens += tokens
+        used_chars += chars
+    kept.reverse()
+
+    # 摘要优先保留离当前最近的问题，长度单独受 summary_max_chars 限制
+    questions, summary_chars = [], 0
+    for turn in reversed(turns[:len(turns) - len(kept)]):
+        if turn["role"] != "user":
+            continue
+        question = _clip(turn["content"], 60)
+        if summary_chars + len(question) > summary_max_chars:
+            break
+        questions.append(question)
+        summary_chars += len(question) + 1
+    if questions:
+        kept.insert(0, {"role": "system", "content": f"更早的对话中用户问过：{'；'.join(reversed(questions))}"})
+    return kept
+
+
+def encode_history(turns: list[dict]) -> str:
+    """
+    紧凑 JSON 编码，替代 Python repr
+    """
+    return json.dumps(turns, ensure_ascii=False, separators=(",", ":"))
+
+
+def history_key(owner: str | None, conversation_id) -> str | None:
+    """
+    服务端历史的存储键：conversation_id 由客户端提供且可猜测，须按通过校验的调用方（API key 摘要）划分命名空间，
+    否则任何人传入他人的会话号即可读到他人的历史；调用方未通过校验时返回 None，不读写服务端历史
+    """
+    if not owner or conversation_id is None:
+        return None
+    return f"{hashlib.sha256(owner.encode('utf-8')).hexdigest()[:16]}:{conversation_id}"
+
+
+class InMemoryHistoryStore:
+    """
+    进程内会话历史：history_key -> 最近若干轮，按最近使用淘汰并带过期时间
+    仅单进程部署可用，多 worker 时使用 RedisHistoryStore
+    """
+
+    def __init__(self, max_turns: int = int(os.getenv("HISTORY_STORE_MAX_TURNS", 40)),
+                 ttl: int = int(os.getenv("HISTORY_STORE_TTL", 86400)),
+                 max_conversations: int = int(os.getenv("HISTORY_STORE_MAX_CONVERSATIONS", 10000))):
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        self._conversations: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+
+    async def get(self, conversation_id) -> list[dict]:
+        entry = self._conversations.get(str(conversation_id))
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return []
+        return list(entry[1])
+
+    async def append(self, conversation_id, turns: list[dict]):
+        key = str(conversation_id)
+        history = (await self.get(key) + turns)[-self.max_turns:]
+        self._conversations[key] = (time.monotonic(), history)
+        self._conversations.move_to_end(key)
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+
+
+class RedisHistoryStore:
+    """
+    基于 Redis List 的会话历史，多 worker 共享
+    """
+
+    def __init__(self, client=None, key_prefix: str = os.getenv("HISTORY_STORE_KEY_PREFIX", "tai:history:"),
+                 max_turns: int = int(os.getenv("HISTORY_STORE_MAX_TURNS", 40)),
+                 ttl: int = int(os.getenv("HISTORY_STORE_TTL", 86400))):
+        if client is None:
+            import redis.asyncio as redis
+            username = os.getenv("REDIS_USER")
+            client = redis.Redis(host=os.getenv("REDIS_URL", "localhost"),
+                                 port=int(os.getenv("REDIS_PORT", 6379)),
+                                 username=None if username in (None, "", "None") else username,
+                                 password=os.getenv("REDIS_PASSWORD") or None,
+                                 db=int(os.getenv("REDIS_DB", 0)),
+                                 decode_responses=True)
+        self.client = client
+        self.key_prefix = key_prefix
+        self.max_turns = max_turns
+        self.ttl = ttl
+
+    async def get(self, conversation_id) -> list[dict]:
+        return [json.loads(turn) for turn in await self.client.lrange(f"{self.key_prefix}{conversation_id}", 0, -1)]
+
+    async def append(self, conversation_id, turns: list[dict]):
+        key = f"{self.key_prefix}{conversation_id}"
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.rpush(key, *[json.dumps(turn, ensure_ascii=False) for turn in turns])
+            pipe.ltrim(key, -self.max_turns, -1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+
+def create_history_store():
+    """
+    按 HISTORY_STORE_BACKEND 创建会话历史存储：none（默认，不在服务端保存）、memory 或 redis
+    """
+    backend = os.getenv("HISTORY_STORE_BACKEND", "none").lower()
+    if backend == "redis":
+        return RedisHistoryStore()
+    if backend == "memory":
+        return InMemoryHistoryStore()
+    return None
+
+
+history_store = create_history_store()
@@ -2,46 +2,136 @@
 # load_dotenv("../.env")
 import os
 import json
+import time
 import asyncio
 import aiohttp
 from fastapi import UploadFile
-from middlewares.message_queue import global_queue
+from middlewares.message_queue import event_bus
+from middlewares.metrics import DIFY_FIRST_EVENT_SECONDS, DIFY_EVENTS, DIFY_NODE_SECONDS
+from middlewares.resilience import dify_policy, CircuitOpenError
+from middlewares.stream_trace import StreamTrace, stream_tracer
+from services.chat_history import normalize_turns, fit_history, encode_history, history_key, history_store
 
 dify_user = os.getenv('DIFY_USER')
 dify_url = os.getenv('DIFY_BASE_URL')
 dify_token = os.getenv('DIFY_API_KEY')
 dify_base_city = os.getenv('DIFY_USER_BASE_CITY')
 
+# 流式读取的时限：相邻两条事件的最长间隔与整个流的总时长，超时视为上游故障并结束本次问答
+dify_stream_timeout = aiohttp.ClientTimeout(total=float(os.getenv("DIFY_STREAM_DEADLINE", 600)),
+                                            sock_connect=dify_policy.timeout,
+                                            sock_read=float(os.getenv("DIFY_READ_TIMEOUT", 60)))
+# Dify 不可用（熔断或重试耗尽）时推送给用户的提示
+DIFY_UNAVAILABLE_MESSAGE = os.getenv("DIFY_UNAVAILABLE_MESSAGE", "问答服务暂时不可用，请稍后重试。")
+# 明确未被处理、可安全重发的状态码
+RETRYABLE_STATUS = (429, 502, 503, 504)
+# 指标中的工作流节点类型与结果只取已知取值，其余记为 other，避免标签基数随上游数据增长
+DIFY_NODE_TYPES = frozenset((
+    "start", "end", "answer", "llm", "knowledge-retrieval", "question-classifier", "if-else", "code",
+    "template-transform", "http-request", "variable-aggregator", "variable-assigner", "assigner",
+    "parameter-extractor", "iteration", "iteration-start", "loop", "loop-start", "loop-end", "tool",
+    "document-extractor", "list-operator", "agent"))
+DIFY_NODE_STATUSES = frozenset(("succeeded", "failed", "stopped", "exception"))
+
 with open(os.getenv('DIFY_MESSAGE_CONFIG'), "r", encoding="UTF8") as f:
     message_config = json.load(f)
 
+# 节点 id -> 消息类型（同一节点出现在多个类型中时以先出现者为准）
+node_types = {}
+for opt, node_list in message_config["messages"].items():
+    for node_id in node_list:
+        node_types.setdefault(node_id, opt)
+
+
+class DifyHTTPError(Exception):
+    def __init__(self, status: int, detail: str):
+        super().__init__(f"Dify HTTP {status}: {detail}")
+        self.status = status
+
+
+class DifyStreamError(Exception):
+    """
+    事件流未以 message_end 正常结束：上游推送 error 事件，或连接在 message_end 之前关闭
+    """
+
+
+def observe_node_event(event: str, data: dict) -> str:
+    """
+    node_started / node_finished 事件：返回节点类型标签，node_finished 同时记录节点耗时
+    """
+    node_type = data.get("node_type")
+    node_type = node_type if node_type in DIFY_NODE_TYPES else "other"
+    elapsed = data.get("elapsed_time")
+    if event == "node_finished" and isinstance(elapsed, (int, float)):
+        status = data.get("status")
+        DIFY_NODE_SECONDS.labels(node_type=node_type,
+                                 status=status if status in DIFY_NODE_STATUSES else "other").observe(elapsed)
+    return node_type
 
-async def file_upload(image: UploadFile) -> str | None:
-    form_data = aiohttp.FormData()
-    form_data.add_field(
-        "file",
-        await image.read(),  # 直接读取内存中的文件内容
-        filename=image.filename,
-        content_type=image.content_type
-    )
-    form_data.add_field("user", dify_user)
 
+def retryable_before_send(error: Exception) -> bool:
+    """
+    非幂等请求（chat-messages）只在请求未送达或被明确拒绝时重试，避免重复执行工作流
+    """
+    if isinstance(error, DifyHTTPError):
+        return error.status in RETRYABLE_STATUS
+    return isinstance(error, aiohttp.ClientConnectorError)
+
+
+def upstream_failure(error: Exception) -> bool:
+    """
+    计入熔断的失败：连接错误、超时、可重试状态码与 5xx；400/401/404 等调用方错误说明上游可用，不计入
+    """
+    if isinstance(error, DifyHTTPError):
+        return error.status in RETRYABLE_STATUS or error.status >= 500
+    return True
+
+
+async def file_upload(image: UploadFile) -> str | None:
+    content = await image.read()  # 直接读取内存中的文件内容
     headers = {
         "Authorization": f"Bearer {dify_token}"
     }
 
-    async with aiohttp.ClientSession() as session:
+    async def upload(session: aiohttp.ClientSession) -> str | None:
+        # 每次尝试重新构造表单，FormData 只能发送一次
+        form_data = aiohttp.FormData()
+        form_data.add_field("file", content, filename=image.filename, content_type=image.content_type)
+        form_data.add_field("user", dify_user)
         async with session.post(f"{dify_url}/files/upload", data=form_data, headers=headers) as resp:
+            if resp.status in RETRYABLE_STATUS or resp.status >= 500:
+                raise DifyHTTPError(resp.status, (await resp.text())[:200])
             try:
                 result = await resp.json()
                 return result.get("id", None)
             except Exception as e:
                 return None
 
+    async with aiohttp.ClientSession() as session:
+        try:
+            return await dify_policy.call(lambda: upload(session), hedge=False)
+        except Exception as e:
+            print(f"⚠️ Dify 文件上传失败: {e!r}")
+            return None
 
-async def dify_stream_chat(query: str, histories: list, image: str | None = None, response_model: str = "streaming"):
-    echarts_generated = False
+
+async def dify_stream_chat(query: str, histories: list, image: str | None = None, response_model: str = "streaming",
+                           trace: StreamTrace | None = None, stream_id: str | None = None,
+                           conversation_id: int | str | None = None, session: aiohttp.ClientSession | None = None,
+                           owner: str | None = None):
+    """
+    :param histories: 客户端携带的历史；为空且开启了服务端历史存储时按 conversation_id 读取
+    :param conversation_id: 会话标识，开启服务端历史存储时本轮问答结束后追加到该会话
+    :param session: 复用的连接池（如批量任务），为空时为本次请求单独创建
+    :param owner: 通过校验的调用方 API key，服务端历史按其划分命名空间；为空时不读写服务端历史
+    :return: 正常结束时返回正文，出错或未结束返回 None
+    """
     workflow_url = f"{dify_url}/chat-messages"
+    turns = normalize_turns(histories)
+    stored_key = history_key(owner, conversation_id) if history_store is not None else None
+    if not turns and stored_key is not None:
+        turns = await history_store.get(stored_key)
+
     headers = {
         "Authorization": f"Bearer {dify_token}",
         "Content-Type": "application/json"
@@ -49,8 +139,11 @@ async def dify_stream_chat(query: str, histories: list, image: str | None = None
 
     data = {
         "inputs": {
-            "chat_histories": str(histories),
+            # 按 token 预算截断并用 JSON 编码，避免长会话的 repr 无限增长
+            "chat_histories": encode_history(fit_history(turns)),
             "base_city": dify_base_city,
+            # 工作流中的 HTTP 回调节点需原样带回，用于把图片/图谱路由到本次问答流
+            "stream_id": stream_id or "",
         },
         "query": query,
         "response_mode": response_model,
@@ -65,27 +158,114 @@ async def dify_stream_chat(query: str, histories: list, image: str | None = None
     }
 
     if response_model == "streaming":
+        try:
+            answer = await _consume_stream(workflow_url, headers, data, trace, stream_id, session)
+        finally:
+            stream_tracer.finish(trace)
+        if answer is not None and stored_key is not None:
+            await history_store.append(stored_key, [{"role": "user", "content": query},
+                                                    {"role": "assistant", "content": answer}])
+        return answer
+
+
+async def _consume_stream(workflow_url: str, headers: dict, data: dict, trace: StreamTrace | None,
+                          stream_id: str | None, session: aiohttp.ClientSession | None = None):
+    """
+    读取 Dify 事件流，按节点 id 路由为消息类型后推入队列
+    :return: 正常结束时返回拼接的正文（plain_text），出错或未结束返回 None
+    """
+    if session is None:
         async with aiohttp.ClientSession() as session:
-            async with session.post(workflow_url, headers=headers, json=data) as responses:
-                async for line in responses.content:
-                    line = line.decode("utf-8")
-                    response = None
-                    if line.startswith("data: ") is False:
-                        continue
-                    json_data = line[6:]  # 去掉 "data: " 前缀
-                    response = json.loads(json_data)
-                    print(response)
-                    if response["event"] == "message_end" or response["event"] == "error":
-                        await global_queue.put(('end', ''))
-                        return
-                    if response["event"] == "message":
-                        node_id = response["from_variable_selector"][0]
-                        for opt, node_list in message_config["messages"].items():
-                            if node_id in node_list:
-                                if opt == "echarts" and echarts_generated is False:
-                                    echarts_data = response["answer"][11:-4]
-                                    echarts_generated = True
-                                    await global_queue.put((opt, echarts_data))
-                                elif opt != "echarts":
-                                    await global_queue.put((opt, response["answer"]))
-                                break
\ No newline at end of file
+            return await _consume_stream(workflow_url, headers, data, trace, stream_id, session)
+
+    async def connect() -> aiohttp.ClientResponse:
+        response = await session.post(workflow_url, headers=headers, json=data, timeout=dify_stream_timeout)
+        if response.status >= 400:
+            detail = (await response.text())[:200]
+            response.release()
+            raise DifyHTTPError(response.status, detail)
+        return response
+
+    echarts_generated = False
+    answer_parts = []
+    request_start = time.perf_counter()
+    first_event = True
+    try:
+        # 只有建立连接、收到响应头这一段受重试与熔断约束，之后的流式读取受 dify_stream_timeout 约束
+        responses = await dify_policy.call(connect, retryable=retryable_before_send, hedge=False,
+                                           counts_as_failure=upstream_failure)
+    except Exception as e:
+        print(f"⚠️ Dify 请求失败: {e!r}")
+        await _end_with_failure(stream_id, trace, e, answered=False)
+        return None
+
+    try:
+        async with responses:
+            async for line in responses.content:
+                line = line.decode("utf-8")
+                response = None
+                if line.startswith("data: ") is False:
+                    continue
+                if first_event:
+                    DIFY_FIRST_EVENT_SECONDS.labels().observe(time.perf_counter() - request_start)
+                    first_event = False
+                json_data = line[6:]  # 去掉 "data: " 前缀
+                response = json.loads(json_data)
+                print(response)
+
+                event = response["event"]
+                node_id = response["from_variable_selector"][0] if event == "message" else None
+                message_type = node_types.get(node_id, "unrouted") if event == "message" else ""
+                node_type = observe_node_event(event, response.get("data") or {}) \
+                    if event in ("node_started", "node_finished") else ""
+                DIFY_EVENTS.labels(event=event, message_type=message_type, node_type=node_type).inc()
+
+                item = None
+                if event == "message_end":
+                    item = ('end', '')
+                elif event == "message" and message_type != "unrouted":
+                    if message_type == "echarts" and echarts_generated is False:
+                        echarts_generated = True
+                        item = (message_type, response["answer"][11:-4])
+                    elif message_type != "echarts":
+                        item = (message_type, response["answer"])
+
+                if trace is not None:
+                    trace.record("dify", event=event, node_id=node_id, type=message_type,
+                                 bytes=len(line), item=item)
+                if event == "error":
+                    raise DifyStreamError(response.get("message") or "error event")
+                if item is not None:
+                    await event_bus.publish(stream_id, item)
+                    if item[0] == "plain_text":
+                        answer_parts.append(item[1])
+                if item == ('end', ''):
+                    return "".join(answer_parts)
+        # 上游在 message_end 之前关闭了连接
+        raise DifyStreamError("stream closed before message_end")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # 读取中断或事件间隔超时：计入熔断
+        dify_policy.breaker.record_failure()
+        print(f"⚠️ Dify 事件流中断: {e!r}")
+        error = e
+    except Exception as e:
+        # error 事件、提前结束或无法解析的事件（JSON 错误、缺少字段）
+        print(f"⚠️ Dify 事件流异常结束: {e!r}")
+        error = e
+    # 除 message_end 外的所有退出都在此结束问答流，客户端不必等到流空闲超时
+    await _end_with_failure(stream_id, trace, error, answered=bool(answer_parts))
+    return None
+
+
+async def _end_with_failure(stream_id: str | None, trace: StreamTrace | None, error: Exception, answered: bool):
+    """
+    上游失败时结束问答流；尚未输出正文时推送不可用提示
+    """
+    items = [("plain_text", DIFY_UNAVAILABLE_MESSAGE)] if not answered and DIFY_UNAVAILABLE_MESSAGE else []
+    items.append(("end", ""))
+    for item in items:
+        # 与正常路径一样逐条记录推送的 item，回放失败轨迹时同样能读到 end
+        if trace is not None:
+            trace.record("dify", event="failure", error=repr(error), circuit_open=isinstance(error, CircuitOpenError),
+                         bytes=len(item[1]), item=item)
+        await event_bus.publish(stream_id, item)
@@ -0,0 +1,331 @@
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import aiohttp
+from datetime import datetime
+from html import escape
+from fastapi import HTTPException, status
+from middlewares.message_queue import event_bus
+from middlewares.stream_trace import stream_tracer
+from services.dify import dify_stream_chat
+
+REPORT_OUTPUT_PATH = os.getenv("REPORT_OUTPUT_PATH", "assets/reports")
+REPORT_FORMATS = {"html": ("html", "text/html; charset=utf-8"), "markdown": ("md", "text/markdown; charset=utf-8")}
+# HTML 报告在浏览器中渲染图表与正文所用的脚本：本地文件路径时内联进报告（离线可用），否则按 URL 引用
+REPORT_ECHARTS_JS = os.getenv("REPORT_ECHARTS_JS", "https://cdn.jsdelivr.net/npm/echarts@5/dist/echarts.min.js")
+REPORT_MARKED_JS = os.getenv("REPORT_MARKED_JS", "https://cdn.jsdelivr.net/npm/marked/marked.min.js")
+# 模型输出的正文经 marked 转成 HTML 后须先经 DOMPurify 清洗；未加载 DOMPurify 时正文按纯文本显示
+REPORT_PURIFY_JS = os.getenv("REPORT_PURIFY_JS", "https://cdn.jsdelivr.net/npm/dompurify@3/dist/purify.min.js")
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{scripts}
+<style>
+body {{ max-width: 960px; margin: 0 auto; padding: 24px; font-family: sans-serif; line-height: 1.6; }}
+section {{ border-top: 1px solid #ddd; padding: 16px 0; }}
+.images img {{ max-width: 100%; margin: 8px 0; }}
+.chart {{ width: 100%; height: 480px; }}
+.failed {{ color: #c00; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>生成时间：{generated_at}，共 {total} 个问题，成功 {succeeded} 个</p>
+<div id="report"></div>
+<script id="report-data" type="application/json">{data}</script>
+<script>
+const results = JSON.parse(document.getElementById("report-data").textContent);
+const root = document.getElementById("report");
+results.forEach((result, i) => {{
+  const section = document.createElement("section");
+  const heading = document.createElement("h2");
+  heading.textContent = `${{i + 1}}. ${{result.question}}`;
+  section.appendChild(heading);
+  if (result.status !== "done") {{
+    const error = document.createElement("p");
+    error.className = "failed";
+    error.textContent = `生成失败：${{result.error || result.status}}`;
+    section.appendChild(error);
+  }}
+  const answer = document.createElement("div");
+  if (window.marked && window.DOMPurify) {{
+    answer.innerHTML = DOMPurify.sanitize(marked.parse(result.answer || ""));
+  }} else {{
+    answer.textContent = result.answer || "";
+  }}
+  section.appendChild(answer);
+  const images = document.createElement("div");
+  images.className = "images";
+  (result.images || []).forEach(url => {{
+    const img = document.createElement("img");
+    img.src = url;
+    images.appendChild(img);
+  }});
+  section.appendChild(images);
+  (result.charts || []).forEach(option => {{
+    const chart = document.createElement("div");
+    chart.className = "chart";
+    section.appendChild(chart);
+    // 提示框用画布绘制，图表数据中的 HTML 不会被解析
+    if (window.echarts) echarts.init(chart).setOption({{...option, tooltip: {{...(option.tooltip || {{}}), renderMode: "richText"}}}});
+  }});
+  root.appendChild(section);
+}});
+</script>
+</body>
+</html>
+"""
+
+
+def render_markdown(title: str, results: list[dict], generated_at: str) -> str:
+    """
+    Markdown 报告：正文原样保留，图片为链接，图表以 ECharts option 的 JSON 代码块附在问题之后
+    """
+    succeeded = sum(1 for result in results if result["status"] == "done")
+    lines = [f"# {title}", "", f"生成时间：{generated_at}，共 {len(results)} 个问题，成功 {succeeded} 个", ""]
+    for i, result in enumerate(results, 1):
+        lines += [f"## {i}. {result['question']}", ""]
+        if result["status"] != "done":
+            lines += [f"> 生成失败：{result.get('error') or result['status']}", ""]
+        if result["answer"]:
+            lines += [result["answer"], ""]
+        lines += [f"![{result['question']}-{n}]({url})" for n, url in enumerate(result["images"], 1)]
+        if result["images"]:
+            lines.append("")
+        for option in result["charts"]:
+            lines += ["```json", json.dumps(option, ensure_ascii=False, indent=2), "```", ""]
+    return "\n".join(lines)
+
+
+def script_tag(source: str) -> str:
+    """
+    source 为本地文件时内联脚本内容，否则按 URL 引用；为空时不引用
+    """
+    if not source:
+        return ""
+    if os.path.isfile(source):
+        with open(source, "r", encoding="utf-8") as f:
+            code = re.sub(r"</(script)", r"<\\/\1", f.read(), flags=re.IGNORECASE)
+        return f"<script>{code}</script>"
+    return f'<script src="{escape(source)}"></script>'
+
+
+def render_html(title: str, results: list[dict], generated_at: str) -> str:
+    """
+    HTML 报告：结果以 JSON 内嵌，浏览器端用 marked + DOMPurify 渲染正文、ECharts 渲染图表；
+    脚本配置为本地文件时全部内联，报告为不依赖网络的单个文件
+    """
+    data = json.dumps(results, ensure_ascii=False).replace("</", "<\\/")
+    scripts = "\n".join(filter(None, map(script_tag, (REPORT_ECHARTS_JS, REPORT_MARKED_JS, REPORT_PURIFY_JS))))
+    return HTML_TEMPLATE.format(title=escape(title), scripts=scripts, generated_at=generated_at, total=len(results),
+                                succeeded=sum(1 for result in results if result["status"] == "done"), data=data)
+
+
+class ReportJob:
+    """
+    一个批量报告任务：逐题收集 Dify 正文、图片与图谱，全部完成后生成报告文件
+    """
+
+    def __init__(self, questions: list[str], title: str, fmt: str, parallelism: int):
+        self.job_id = uuid.uuid4().hex
+        self.questions = questions
+        self.title = title
+        self.format = fmt
+        self.parallelism = parallelism
+        self.status = "queued"
+        self.results = [{"question": question, "status": "queued", "answer": "", "images": [], "charts": [],
+                         "error": None, "seconds": None} for question in questions]
+        self.created_at = time.time()
+        self.finished_at = None
+        self.path = None
+        self.error = None
+        self.task: asyncio.Task | None = None
+
+    def to_dict(self) -> dict:
+        counts = {}
+        for result in self.results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        return {
+            "job_id": self.job_id,
+            "title": self.title,
+            "format": self.format,
+            "status": self.status,
+            "total": len(self.questions),
+            "progress": counts,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(timespec="seconds"),
+            "finished_at": datetime.fromtimestamp(self.finished_at).isoformat(timespec="seconds")
+            if self.finished_at else None,
+            "error": self.error,
+        }
+
+
+class ReportJobManager:
+    """
+    批量报告任务管理：
+    - 批量任务使用独立的并发上限，不占用 /ask 的准入名额，避免挤占交互式请求
+    - 所有批量请求共用一个 aiohttp 连接池
+    - 任务状态保存在进程内，多 worker 部署时查询与下载须落到创建任务的 worker（会话保持）
+    """
+
+    def __init__(self, max_parallel: int = int(os.getenv("REPORT_MAX_PARALLEL", 2)),
+                 max_jobs: int = int(os.getenv("REPORT_MAX_JOBS", 4)),
+                 max_questions: int = int(os.getenv("REPORT_MAX_QUESTIONS", 200)),
+                 question_timeout: float = float(os.getenv("REPORT_QUESTION_TIMEOUT", 300)),
+                 retention: float = float(os.getenv("REPORT_RETENTION", 86400)),
+                 output_dir: str = REPORT_OUTPUT_PATH):
+        """
+        初始化
+        :param max_parallel: 所有批量任务合计同时进行的 Dify 流数量
+        :param max_jobs: 同时排队或运行的任务数上限
+        :param max_questions: 单个任务的问题数上限
+        :param question_timeout: 单个问题的最长处理时间（秒）
+        :param retention: 已结束任务及其报告文件的保留时间（秒）
+        :param output_dir: 报告文件目录
+        """
+        self.max_parallel = max_parallel
+        self.max_jobs = max_jobs
+        self.max_questions = max_questions
+        self.question_timeout = question_timeout
+        self.retention = retention
+        self.output_dir = output_dir
+        self.jobs: dict[str, ReportJob] = {}
+        self._semaphore = asyncio.Semaphore(max_parallel)
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_parallel * 2))
+        return self._session
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at and now - job.finished_at > self.retention:
+                if job.path and os.path.exists(job.path):
+                    os.remove(job.path)
+                del self.jobs[job_id]
+
+    def submit(self, questions: list[str], title: str, fmt: str = "html", parallelism: int | None = None) -> ReportJob:
+        """
+        创建任务并在后台执行
+        :param parallelism: 本任务同时进行的问题数（至少为 1），不超过 max_parallel，为空时取 max_parallel
+        """
+        self._prune()
+        questions = [question.strip() for question in questions if question and question.strip()]
+        if not questions:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No questions given")
+        if len(questions) > self.max_questions:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"At most {self.max_questions} questions per job")
+        if fmt not in REPORT_FORMATS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unsupported format, expected one of {list(REPORT_FORMATS)}")
+        if parallelism is not None and parallelism < 1:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="parallelism must be at least 1")
+        if sum(1 for job in self.jobs.values() if job.status in ("queued", "running")) >= self.max_jobs:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many report jobs",
+                                headers={"Retry-After": "60"})
+
+        job = ReportJob(questions, title, fmt, min(parallelism or self.max_parallel, self.max_parallel))
+        self.jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> ReportJob | None:
+        return self.jobs.get(job_id)
+
+    async def _run(self, job: ReportJob):
+        job.status = "running"
+        job_semaphore = asyncio.Semaphore(job.parallelism)
+        session = self._get_session()
+
+        async def run_one(index: int):
+            async with job_semaphore, self._semaphore:
+                await self._run_question(job.results[index], session)
+
+        try:
+            await asyncio.gather(*(run_one(i) for i in range(len(job.questions))))
+            job.path = await asyncio.to_thread(self._write_report, job)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = repr(e)
+        finally:
+            job.finished_at = time.time()
+
+    async def _run_question(self, result: dict, session: aiohttp.ClientSession):
+        """
+        为单个问题建立独立的事件通道，运行 Dify 工作流并收集正文、图片与图谱，直到 'end'
+        """
+        result["status"] = "running"
+        start = time.perf_counter()
+        stream_id = uuid.uuid4().hex
+        await event_bus.open(stream_id)
+        trace = stream_tracer.start(result["question"], stream_id)
+        chat = asyncio.create_task(dify_stream_chat(result["question"], [], trace=trace, stream_id=stream_id,
+                                                    session=session))
+        answer_parts, images = [], {}
+
+        async def collect():
+            while True:
+                item = await event_bus.get(stream_id, timeout=1.0)
+                if item is None:
+                    if chat.done():
+                        break
+                    continue
+                type_, text = item
+                if type_ == "end":
+                    break
+                if type_ == "plain_text":
+                    answer_parts.append(text or "")
+                elif type_ == "images" and text:
+                    images.update(dict.fromkeys(text if isinstance(text, list) else [text]))
+                elif type_ == "echarts":
+                    try:
+                        result["charts"].append(json.loads(text))
+                    except (TypeError, ValueError):
+                        pass
+            return await chat
+
+        try:
+            answer = await asyncio.wait_for(collect(), timeout=self.question_timeout)
+            result["status"] = "done" if answer is not None else "failed"
+            if answer is None:
+                result["error"] = "Dify stream ended with an error"
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = "timeout" if isinstance(e, asyncio.TimeoutError) else repr(e)
+        finally:
+            if not chat.done():
+                chat.cancel()
+            await event_bus.close(stream_id)
+            result["answer"] = "".join(answer_parts)
+            result["images"] = list(images)
+            result["seconds"] = round(time.perf_counter() - start, 3)
+
+    def _write_report(self, job: ReportJob) -> str:
+        extension, _ = REPORT_FORMATS[job.format]
+        generated_at = datetime.now().isoformat(sep=" ", timespec="seconds")
+        render = render_html if job.format == "html" else render_markdown
+        content = render(job.title, job.results, generated_at)
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{job.job_id}.{extension}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    async def shutdown(self):
+        for job in self.jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+
+report_jobs = ReportJobManager()
@@ -0,0 +1,4 @@
+import os
+
+# services.dify 在导入时读取节点路由配置
+os.environ.setdefault("DIFY_MESSAGE_CONFIG", "configs/nodetype_config.json")
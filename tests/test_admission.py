@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+from middlewares.apikey_auth import _get_expected_api_keys
+from middlewares.admission import AdmissionController
+
+
+@pytest.fixture(autouse=True)
+def api_keys(monkeypatch):
+    monkeypatch.setenv("FASTAPI_API_KEY", "key-a,key-b")
+    _get_expected_api_keys.cache_clear()
+    yield
+    _get_expected_api_keys.cache_clear()
+
+
+def make_request(token: str | None = None, host: str = "10.0.0.1") -> Request:
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token is not None else []
+    return Request({"type": "http", "method": "POST", "path": "/ask", "headers": headers, "client": (host, 1234)})
+
+
+def admit(controller: AdmissionController, request: Request):
+    return asyncio.run(controller.admit(request))
+
+
+def test_verified_key_gets_its_own_bucket():
+    controller = AdmissionController(max_streams=0, rate=1, burst=1)
+    slot = admit(controller, make_request("key-a"))
+    assert slot.api_key == "key-a"
+    # 同一 IP 上的另一个有效 key 不受影响
+    assert admit(controller, make_request("key-b")).api_key == "key-b"
+    assert set(controller.buckets) == {"key:key-a", "key:key-b"}
+
+
+def test_unverified_tokens_share_the_ip_bucket():
+    controller = AdmissionController(max_streams=0, rate=1, burst=1, anonymous_rate=1, anonymous_burst=1)
+    slot = admit(controller, make_request("random-1"))
+    assert slot.api_key is None
+    with pytest.raises(HTTPException) as e:
+        admit(controller, make_request("random-2"))
+    assert e.value.status_code == 429
+    assert set(controller.buckets) == {"ip:10.0.0.1"}
+    # 其他 IP 的匿名请求不受影响
+    assert admit(controller, make_request(host="10.0.0.2")).api_key is None
+
+
+def test_anonymous_bucket_has_its_own_budget():
+    # 同一站点 NAT 后的多台终端共用一个 IP 桶，匿名突发额度独立于 key 配置
+    controller = AdmissionController(max_streams=0, rate=1, burst=1, anonymous_rate=1, anonymous_burst=3)
+    for _ in range(3):
+        admit(controller, make_request())
+    with pytest.raises(HTTPException):
+        admit(controller, make_request())
+    admit(controller, make_request("key-a"))
+    with pytest.raises(HTTPException):
+        admit(controller, make_request("key-a"))
+
+
+def test_require_api_key_rejects_invalid_token():
+    controller = AdmissionController(max_streams=0, rate=0, require_api_key=True)
+    for token in (None, "random"):
+        with pytest.raises(HTTPException) as e:
+            admit(controller, make_request(token))
+        assert e.value.status_code == 401
+    assert admit(controller, make_request("key-a")).api_key == "key-a"
+
+
+def test_tokens_ignored_when_no_key_configured(monkeypatch):
+    monkeypatch.setenv("FASTAPI_API_KEY", "")
+    _get_expected_api_keys.cache_clear()
+    controller = AdmissionController(max_streams=0, rate=1, burst=5, anonymous_rate=1, anonymous_burst=5)
+    assert admit(controller, make_request("key-a")).api_key is None
+    assert set(controller.buckets) == {"ip:10.0.0.1"}
+
+
+def test_concurrency_limit_and_release():
+    async def scenario():
+        controller = AdmissionController(max_streams=1, max_waiting=0, wait_timeout=0.01, rate=0, anonymous_rate=0)
+        slot = await controller.admit(make_request())
+        with pytest.raises(HTTPException) as e:
+            await controller.admit(make_request())
+        assert e.value.status_code == 429 and e.value.headers["Retry-After"] == "1"
+        slot.release()
+        slot.release()
+        assert controller.active == 0
+        (await controller.admit(make_request())).release()
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+from services.chat_history import estimate_tokens, fit_history, history_key, normalize_turns
+
+
+def turns(count: int, length: int = 10) -> list[dict]:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i:02d}" + "x" * (length - 2)}
+            for i in range(count)]
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("你好abcd") == 3
+
+
+def test_fit_history_keeps_everything_within_budget():
+    history = turns(4)
+    assert fit_history(history, max_tokens=100, max_chars=100) == history
+
+
+def test_fit_history_keeps_recent_turns_and_summarizes_older_questions():
+    history = turns(6, length=40)
+    fitted = fit_history(history, max_tokens=1000, max_chars=80)
+    assert fitted[1:] == history[-2:]
+    assert fitted[0]["role"] == "system"
+    # 摘要只包含被截掉的用户问题，按原顺序排列
+    assert fitted[0]["content"].endswith(f"{history[0]['content']}；{history[2]['content']}")
+
+
+def test_fit_history_respects_token_budget():
+    history = turns(6, length=40)
+    fitted = fit_history(history, max_tokens=25, max_chars=10000)
+    assert fitted[1:] == history[-2:]
+
+
+def test_fit_history_clips_long_turns_and_summary():
+    history = [{"role": "user", "content": "q" * 100} for _ in range(10)] + [{"role": "user", "content": "a" * 50}]
+    fitted = fit_history(history, max_tokens=1000, max_chars=30, turn_max_chars=20, summary_max_chars=130)
+    assert fitted[-1] == {"role": "user", "content": "a" * 20 + "…"}
+    summary = fitted[0]["content"]
+    assert summary.count("q" * 60 + "…") == 2
+
+
+def test_fit_history_empty():
+    assert fit_history([]) == []
+
+
+def test_normalize_turns_accepts_all_formats():
+    assert normalize_turns([{"question": "q", "answer": "a"}, ["q2", "a2"], {"role": "assistant", "content": 1}]) == [
+        {"role": "user", "content": "q"}, {"role": "assistant", "content": "a"},
+        {"role": "user", "content": "q2"}, {"role": "assistant", "content": "a2"},
+        {"role": "assistant", "content": "1"},
+    ]
+
+
+def test_history_key_is_namespaced_by_owner():
+    assert history_key(None, 1) is None
+    assert history_key("key-a", None) is None
+    assert history_key("key-a", 1) != history_key("key-b", 1)
+    assert history_key("key-a", 1).endswith(":1")
+    assert "key-a" not in history_key("key-a", 1)
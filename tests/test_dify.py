@@ -0,0 +1,19 @@
+from middlewares.metrics import DIFY_NODE_SECONDS
+from services.dify import observe_node_event
+
+
+def test_node_type_label_is_bounded():
+    assert observe_node_event("node_started", {"node_type": "llm"}) == "llm"
+    assert observe_node_event("node_started", {"node_type": "x" * 40}) == "other"
+    assert observe_node_event("node_started", {}) == "other"
+
+
+def test_node_finished_records_elapsed_time():
+    child = DIFY_NODE_SECONDS.labels(node_type="knowledge-retrieval", status="succeeded")
+    count = child.count
+    observe_node_event("node_finished", {"node_type": "knowledge-retrieval", "status": "succeeded",
+                                         "elapsed_time": 0.3})
+    observe_node_event("node_started", {"node_type": "knowledge-retrieval", "elapsed_time": 0.3})
+    assert child.count == count + 1
+    observe_node_event("node_finished", {"node_type": "code", "status": "weird", "elapsed_time": 1})
+    assert DIFY_NODE_SECONDS.labels(node_type="code", status="other").count == 1
@@ -0,0 +1,67 @@
+import uuid
+import time
+import socket
+import asyncio
+import threading
+import httpx
+import pytest
+import uvicorn
+from middlewares.message_queue import event_bus
+from middlewares.resilience import dify_policy
+import services.dify as dify
+
+
+@pytest.fixture
+def fake_dify(monkeypatch):
+    # 以 503 故障注入启动本地 Dify 替身，被测代码通过真实 HTTP 连接访问
+    from tools.fake_dify import FakeDifyConfig, build_app, parse_args
+    config = FakeDifyConfig(parse_args(["--token-rate", "0", "--first-event-delay", "0", "--think-tokens", "2",
+                                        "--answer-tokens", "5", "--callback-base", "",
+                                        "--fault-targets", "chat-messages", "--error-rate", "1"]))
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(build_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.01)
+    base_url = f"http://127.0.0.1:{port}"
+    monkeypatch.setattr(dify, "dify_url", f"{base_url}/v1")
+    monkeypatch.setattr(dify_policy, "backoff", 0)
+    yield base_url
+    server.should_exit = True
+    thread.join(timeout=10)
+    dify_policy.breaker.record_success()
+
+
+async def ask(question: str) -> tuple[str | None, list[tuple]]:
+    stream_id = uuid.uuid4().hex
+    await event_bus.open(stream_id)
+    try:
+        answer = await dify.dify_stream_chat(question, [], stream_id=stream_id)
+        items = []
+        while not items or items[-1] != ("end", ""):
+            item = await event_bus.get(stream_id, timeout=1)
+            assert item is not None, items
+            items.append(item)
+        return answer, items
+    finally:
+        await event_bus.close(stream_id)
+
+
+def test_injected_fault_ends_stream_with_unavailable_message(fake_dify):
+    answer, items = asyncio.run(ask("CIR 无法注册"))
+    assert answer is None
+    assert items == [("plain_text", dify.DIFY_UNAVAILABLE_MESSAGE), ("end", "")]
+    assert dify_policy.breaker.failures >= 1
+
+
+def test_clearing_faults_restores_answers(fake_dify):
+    faults = httpx.put(f"{fake_dify}/faults", json={"error_rate": 0}).json()
+    assert faults["error_rate"] == 0
+    answer, items = asyncio.run(ask("CIR 无法注册"))
+    assert answer and items[-1] == ("end", "")
+    assert ("plain_text", dify.DIFY_UNAVAILABLE_MESSAGE) not in items
+    assert "".join(text for kind, text in items if kind == "plain_text") == answer
@@ -0,0 +1,89 @@
+import os
+import asyncio
+import pytest
+from fastapi import HTTPException
+from middlewares.image_server import StaticImageServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    (image_dir / "a.png").write_bytes(bytes(range(100)))
+    (image_dir / "sub").mkdir()
+    (image_dir / "sub" / "b.png").write_bytes(b"b" * 10)
+    (tmp_path / "secret.txt").write_text("secret")
+    return StaticImageServer(str(image_dir), max_cached_file_size=1024, max_cache_bytes=4096)
+
+
+def serve(server: StaticImageServer, filename: str, headers: dict):
+    return asyncio.run(server.serve(filename, headers))
+
+
+@pytest.mark.parametrize("filename", ["../secret.txt", "sub/../../secret.txt", "/etc/passwd", "", "a.png\x00"])
+def test_resolve_rejects_paths_outside_root(server, filename):
+    with pytest.raises(HTTPException) as e:
+        server.resolve(filename)
+    assert e.value.status_code == 404
+
+
+def test_resolve_rejects_symlink_escape(server, tmp_path):
+    os.symlink(tmp_path / "secret.txt", os.path.join(server.image_dir, "link.png"))
+    with pytest.raises(HTTPException):
+        server.resolve("link.png")
+
+
+def test_resolve_allows_nested_paths(server):
+    assert server.resolve("sub/../sub/b.png") == os.path.join(server.image_dir, "sub", "b.png")
+
+
+def test_serve_missing_file_and_directory(server):
+    for filename in ("missing.png", "sub"):
+        with pytest.raises(HTTPException) as e:
+            serve(server, filename, {})
+        assert e.value.status_code == 404
+
+
+def test_serve_full_body_and_not_modified(server):
+    response = serve(server, "a.png", {})
+    assert response.status_code == 200
+    assert response.body == bytes(range(100))
+    assert response.headers["accept-ranges"] == "bytes"
+    etag = response.headers["etag"]
+    assert serve(server, "a.png", {"if-none-match": etag}).status_code == 304
+    assert serve(server, "a.png", {"if-modified-since": response.headers["last-modified"]}).status_code == 304
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-9", 0, 9),
+    ("bytes=90-", 90, 99),
+    ("bytes=-5", 95, 99),
+    ("bytes=95-200", 95, 99),
+])
+def test_serve_single_range(server, header, start, end):
+    response = serve(server, "a.png", {"range": header})
+    assert response.status_code == 206
+    assert response.body == bytes(range(start, end + 1))
+    assert response.headers["content-range"] == f"bytes {start}-{end}/100"
+
+
+@pytest.mark.parametrize("header", ["bytes=0-1,5-6", "items=0-1", "bytes=a-b", "bytes=50-10", "bytes=--5",
+                                    "bytes=-", "bytes=+1-5"])
+def test_serve_ignores_unsupported_or_invalid_range(server, header):
+    response = serve(server, "a.png", {"range": header})
+    assert response.status_code == 200
+    assert len(response.body) == 100
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=100-200", "bytes=-0"])
+def test_serve_unsatisfiable_range(server, header):
+    with pytest.raises(HTTPException) as e:
+        serve(server, "a.png", {"range": header})
+    assert e.value.status_code == 416
+    assert e.value.headers["Content-Range"] == "bytes */100"
+
+
+def test_if_range_mismatch_ignores_range(server):
+    etag = serve(server, "a.png", {}).headers["etag"]
+    assert serve(server, "a.png", {"range": "bytes=0-9", "if-range": etag}).status_code == 206
+    assert serve(server, "a.png", {"range": "bytes=0-9", "if-range": '"stale"'}).status_code == 200
@@ -0,0 +1,66 @@
+import os
+import asyncio
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+from middlewares.image_variants import ImageVariantCache
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "a.png"
+    Image.new("RGB", (400, 200), (200, 30, 30)).save(path)
+    return str(path)
+
+
+def get(cache: ImageVariantCache, source: str, **kwargs) -> str:
+    return asyncio.run(cache.get(source, **kwargs))
+
+
+def cache_files(cache: ImageVariantCache) -> list[str]:
+    return sorted(os.listdir(cache.cache_dir))
+
+
+def test_variant_is_resized_and_tracked(tmp_path, source):
+    cache = ImageVariantCache(str(tmp_path / "variants"), widths="100,300")
+    path = get(cache, source, width=120, fmt="webp")
+    with Image.open(path) as image:
+        assert image.size == (300, 150) and image.format == "WEBP"
+    assert get(cache, source, width=120, fmt="webp") == path
+    assert cache._bytes == os.path.getsize(path)
+    # 重新启动时按目录内容恢复统计
+    assert ImageVariantCache(cache.cache_dir)._bytes == cache._bytes
+
+
+def test_stale_versions_are_removed(tmp_path, source):
+    cache = ImageVariantCache(str(tmp_path / "variants"), widths="100")
+    old = get(cache, source, width=100, fmt="jpeg")
+    Image.new("RGB", (500, 200)).save(source)
+    new = get(cache, source, width=100, fmt="jpeg")
+    assert cache_files(cache) == [os.path.basename(new)] and not os.path.exists(old)
+    assert cache._bytes == os.path.getsize(new)
+
+
+def test_total_size_is_capped(tmp_path, source):
+    cache = ImageVariantCache(str(tmp_path / "variants"), widths="50,100,200,300")
+    sizes = [os.path.getsize(get(cache, source, width=w, fmt="png")) for w in (50, 100, 200)]
+    cache.max_bytes = sum(sizes)
+    newest = get(cache, source, width=300, fmt="png")
+    assert cache._bytes <= cache.max_bytes
+    assert os.path.basename(newest) in cache_files(cache)
+    assert cache._bytes == sum(os.path.getsize(os.path.join(cache.cache_dir, n)) for n in cache_files(cache))
+
+
+def test_failed_save_leaves_no_temporary_file(tmp_path, source, monkeypatch):
+    cache = ImageVariantCache(str(tmp_path / "variants"))
+
+    def broken_save(self, fp, *args, **kwargs):
+        with open(fp, "wb") as f:
+            f.write(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Image.Image, "save", broken_save)
+    with pytest.raises(HTTPException) as e:
+        get(cache, source, width=160, fmt="webp")
+    assert e.value.status_code == 415
+    assert cache_files(cache) == [] and cache._bytes == 0
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from middlewares import init_lifespan
+
+
+class Recorder:
+    """
+    记录关闭顺序的替身子系统，fail 为 True 时关闭抛错
+    """
+
+    def __init__(self, name: str, calls: list, fail: bool = False, coroutine: bool = False):
+        self.name = name
+        self.calls = calls
+        self.fail = fail
+        self.coroutine = coroutine
+
+    def _close(self):
+        self.calls.append(self.name)
+        if self.fail:
+            raise RuntimeError(f"{self.name} close failed")
+
+    def shutdown(self):
+        if not self.coroutine:
+            return self._close()
+
+        async def close():
+            self._close()
+        return close()
+
+    close = shutdown
+
+
+@pytest.fixture
+def lifespan(monkeypatch):
+    calls = []
+    monkeypatch.setattr(init_lifespan, "STARTUP_WARMUP", False)
+    monkeypatch.setattr(init_lifespan, "ImageSemanticSearcher", lambda: object())
+    monkeypatch.setattr(init_lifespan, "KnowledgeGraphBuilder", lambda: object())
+    monkeypatch.setattr(init_lifespan, "StaticImageServer", lambda: object())
+    monkeypatch.setattr(init_lifespan, "ImageVariantCache", lambda: Recorder("image_variants", calls))
+    monkeypatch.setattr(init_lifespan, "stream_registry", Recorder("stream_registry", calls, coroutine=True))
+    monkeypatch.setattr(init_lifespan, "report_jobs", Recorder("report_jobs", calls, coroutine=True))
+    monkeypatch.setattr(init_lifespan, "graph_layout", Recorder("graph_layout", calls))
+    monkeypatch.setattr(init_lifespan, "request_profiler", SimpleNamespace(
+        install=lambda loop: None, shutdown=Recorder("request_profiler", calls).shutdown))
+    monkeypatch.setattr(init_lifespan, "event_bus", Recorder("event_bus", calls, coroutine=True))
+    return calls
+
+
+def test_ready_when_required_subsystems_load(lifespan):
+    with TestClient(main.app) as client:
+        resp = client.get("/ready")
+    assert resp.status_code == 200
+    assert resp.json()["ready"] is True
+
+
+def test_failing_loader_reports_not_ready(lifespan, monkeypatch):
+    def broken():
+        raise FileNotFoundError("index missing")
+
+    monkeypatch.setattr(init_lifespan, "ImageSemanticSearcher", broken)
+    with TestClient(main.app) as client:
+        assert main.app.state.image_searcher is None
+        resp = client.get("/ready")
+    assert resp.status_code == 503
+    body = resp.json()
+    assert body["ready"] is False
+    assert body["subsystems"]["image_searcher"]["state"] == "failed"
+    assert "index missing" in body["subsystems"]["image_searcher"]["error"]
+    # 另一个必需子系统不受影响
+    assert body["subsystems"]["knowledge_graph"]["state"] == "ready"
+
+
+def test_sequential_startup_loads_remaining_subsystems(lifespan, monkeypatch):
+    def broken():
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(init_lifespan, "STARTUP_MODE", "sequential")
+    monkeypatch.setattr(init_lifespan, "ImageSemanticSearcher", broken)
+    with TestClient(main.app) as client:
+        resp = client.get("/ready")
+    assert resp.status_code == 503
+    assert resp.json()["subsystems"]["knowledge_graph"]["state"] == "ready"
+
+
+def test_shutdown_runs_every_step_when_one_fails(lifespan, monkeypatch):
+    calls = lifespan
+    monkeypatch.setattr(init_lifespan, "ImageVariantCache", lambda: Recorder("image_variants", calls, fail=True))
+    monkeypatch.setattr(init_lifespan, "report_jobs", Recorder("report_jobs", calls, fail=True, coroutine=True))
+    with TestClient(main.app):
+        pass
+    assert calls == ["image_variants", "stream_registry", "report_jobs", "graph_layout", "request_profiler",
+                     "event_bus"]
@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from middlewares.message_queue import InProcessEventBus, RedisEventBus
+
+
+def make_bus(kind: str, server: FakeServer):
+    if kind == "memory":
+        return InProcessEventBus(maxsize=10)
+    return RedisEventBus(FakeRedis(server=server, decode_responses=True), key_prefix="test:")
+
+
+@pytest.fixture(params=["memory", "redis"])
+def bus_factory(request):
+    server = FakeServer()
+    return lambda: make_bus(request.param, server)
+
+
+def test_publish_and_get_in_order(bus_factory):
+    async def scenario():
+        bus = bus_factory()
+        await bus.open("a")
+        await bus.open("b")
+        await bus.publish("a", ("plain_text", "你好"))
+        await bus.publish("b", ("images", "[]"))
+        await bus.publish("a", ("end", ""))
+        assert await bus.get("a", timeout=0.1) == ("plain_text", "你好")
+        assert await bus.get("a", timeout=0.1) == ("end", "")
+        assert await bus.get("b", timeout=0.1) == ("images", "[]")
+        assert await bus.get("a", timeout=0.01) is None
+        await bus.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_close_stops_delivery(bus_factory):
+    async def scenario():
+        bus = bus_factory()
+        await bus.open("a")
+        await bus.publish("a", ("plain_text", "x"))
+        await bus.close("a")
+        assert bus.local_streams() == []
+        assert bus.depth() == 0
+        # 流关闭后的事件直接丢弃，不抛错
+        await bus.publish("a", ("plain_text", "y"))
+        await bus.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_missing_stream_id_is_not_broadcast(bus_factory):
+    async def scenario():
+        bus = bus_factory()
+        await bus.open("a")
+        await bus.open("b")
+        await bus.publish(None, ("images", '["/images/a.png"]'))
+        assert await bus.get("a", timeout=0.01) is None
+        assert await bus.get("b", timeout=0.01) is None
+        await bus.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_missing_stream_id_with_single_local_stream():
+    async def scenario():
+        bus = InProcessEventBus()
+        await bus.open("a")
+        await bus.publish(None, ("plain_text", "x"))
+        return await bus.get("a", timeout=0.1)
+
+    assert asyncio.run(scenario()) == ("plain_text", "x")
+
+
+def test_redis_bus_delivers_across_workers():
+    async def scenario():
+        server = FakeServer()
+        consumer, producer = make_bus("redis", server), make_bus("redis", server)
+        await consumer.open("a")
+        # 回调落在另一个 worker 上：该 worker 本地没有这个流
+        await producer.publish("a", ("echarts", "{}"))
+        await producer.publish(None, ("plain_text", "lost"))
+        assert await consumer.get("a", timeout=0.1) == ("echarts", "{}")
+        assert await consumer.get("a", timeout=0.01) is None
+        await consumer.shutdown()
+        await producer.shutdown()
+
+    asyncio.run(scenario())
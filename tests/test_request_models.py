@@ -0,0 +1,44 @@
+import pytest
+from pydantic import ValidationError
+from endpoints.request_models import (CAUSAL_MAX_DEPTH, CAUSAL_MAX_LIMIT, REPORT_MAX_PARALLEL, REPORT_MAX_QUESTIONS,
+                                      CausalChainModel, ReportJobModel)
+
+
+def test_report_job_defaults():
+    model = ReportJobModel(questions=["制动缸压力不足"])
+    assert model.format == "html" and model.parallelism is None
+
+
+@pytest.mark.parametrize("fields", [
+    {"questions": []},
+    {"questions": ["q"] * (REPORT_MAX_QUESTIONS + 1)},
+    {"questions": ["q"], "format": "pdf"},
+    {"questions": ["q"], "parallelism": 0},
+    {"questions": ["q"], "parallelism": -1},
+    {"questions": ["q"], "parallelism": REPORT_MAX_PARALLEL + 1},
+])
+def test_report_job_rejects_out_of_range_fields(fields):
+    with pytest.raises(ValidationError):
+        ReportJobModel(**fields)
+
+
+def test_report_job_accepts_bounds():
+    model = ReportJobModel(questions=["q"] * REPORT_MAX_QUESTIONS, format="markdown", parallelism=REPORT_MAX_PARALLEL)
+    assert model.parallelism == REPORT_MAX_PARALLEL
+
+
+@pytest.mark.parametrize("fields", [
+    {"direction": "sideways"},
+    {"max_depth": 0},
+    {"max_depth": CAUSAL_MAX_DEPTH + 1},
+    {"limit": 0},
+    {"limit": CAUSAL_MAX_LIMIT + 1},
+])
+def test_causal_chain_rejects_out_of_range_fields(fields):
+    with pytest.raises(ValidationError):
+        CausalChainModel(entity="制动缸", **fields)
+
+
+def test_causal_chain_accepts_bounds():
+    model = CausalChainModel(entity="制动缸", direction="causes", max_depth=CAUSAL_MAX_DEPTH, limit=CAUSAL_MAX_LIMIT)
+    assert model.direction == "causes"
@@ -0,0 +1,139 @@
+import asyncio
+import pytest
+from middlewares.resilience import CallPolicy, CircuitBreaker, CircuitOpenError
+
+
+class ClientError(Exception):
+    pass
+
+
+def make_policy(**kwargs) -> CallPolicy:
+    options = {"timeout": 1, "deadline": 5, "retries": 0, "backoff": 0, "failure_threshold": 2,
+               "reset_timeout": 60}
+    return CallPolicy("test", **{**options, **kwargs})
+
+
+def run_failing(policy: CallPolicy, error: Exception, **kwargs):
+    async def operation():
+        raise error
+
+    with pytest.raises(type(error)):
+        asyncio.run(policy.call(operation, **kwargs))
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    policy = make_policy()
+    run_failing(policy, RuntimeError("down"))
+    assert policy.breaker.state == "closed"
+    run_failing(policy, RuntimeError("down"))
+    assert policy.breaker.state == "open"
+    run_failing(policy, CircuitOpenError())
+
+
+def test_half_open_allows_single_probe(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    breaker.opened_at -= 10
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    breaker.opened_at -= 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_excluded_failures_do_not_trip_breaker():
+    policy = make_policy(failure_threshold=1, retries=2)
+    calls = []
+
+    async def operation():
+        calls.append(1)
+        raise ClientError("bad request")
+
+    for _ in range(3):
+        with pytest.raises(ClientError):
+            asyncio.run(policy.call(operation, counts_as_failure=lambda e: not isinstance(e, ClientError)))
+    # 不计入熔断的错误也不重试
+    assert len(calls) == 3
+    assert policy.breaker.state == "closed" and policy.breaker.failures == 0
+
+
+def test_excluded_failure_releases_half_open_probe():
+    policy = make_policy(failure_threshold=1)
+    run_failing(policy, RuntimeError("down"))
+    policy.breaker.opened_at -= 60
+    run_failing(policy, ClientError("bad request"), counts_as_failure=lambda e: False)
+    assert policy.breaker.state == "half_open"
+    assert asyncio.run(policy.call(lambda: asyncio.sleep(0, result="ok"))) == "ok"
+    assert policy.breaker.state == "closed"
+
+
+def test_retries_only_retryable_errors():
+    policy = make_policy(retries=2, failure_threshold=10)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("transient")
+        return "ok"
+
+    assert asyncio.run(policy.call(flaky)) == "ok"
+    assert len(attempts) == 3 and policy.breaker.failures == 0
+
+    attempts.clear()
+    with pytest.raises(RuntimeError):
+        asyncio.run(policy.call(flaky, retryable=lambda e: False))
+    assert len(attempts) == 1
+
+
+def test_retries_count_as_one_failure():
+    policy = make_policy(retries=3, failure_threshold=2)
+    attempts = []
+
+    async def operation():
+        attempts.append(1)
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(policy.call(operation))
+    assert len(attempts) == 4
+    assert policy.breaker.failures == 1 and policy.breaker.state == "closed"
+    with pytest.raises(RuntimeError):
+        asyncio.run(policy.call(operation))
+    assert policy.breaker.state == "open"
+
+
+def test_cancelled_call_releases_only_its_own_probe():
+    async def scenario():
+        policy = make_policy(failure_threshold=1)
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "ok"
+
+        # 半开前已在进行中的调用被取消，不应释放探测名额
+        bystander = asyncio.create_task(policy.call(slow))
+        await asyncio.sleep(0)
+        policy.breaker.record_failure()
+        policy.breaker.opened_at -= 60
+        probe = asyncio.create_task(policy.call(slow))
+        await asyncio.sleep(0)
+        assert policy.breaker._probing
+        bystander.cancel()
+        await asyncio.gather(bystander, return_exceptions=True)
+        assert policy.breaker._probing
+        with pytest.raises(CircuitOpenError):
+            await policy.call(slow)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        assert not policy.breaker._probing
+
+    asyncio.run(scenario())
@@ -0,0 +1,38 @@
+import pytest
+from middlewares.segmenter import DomainSegmenter, build_domain_vocabulary
+
+jieba = pytest.importorskip("jieba")
+
+
+@pytest.fixture(scope="module")
+def segmenter(tmp_path_factory):
+    image_dir = tmp_path_factory.mktemp("images")
+    (image_dir / "WTZJ-Ⅱ标准型CIR设备.png").write_bytes(b"")
+    (image_dir / "GSM-R呼叫失败.png").write_bytes(b"")
+    segmenter = DomainSegmenter(cache_dir=str(tmp_path_factory.mktemp("jieba")), user_dict_path="",
+                                image_dir=str(image_dir), triplets_path=None)
+    segmenter.initialize()
+    return segmenter
+
+
+def test_vocabulary_keeps_hyphenated_terms(segmenter):
+    assert {"WTZJ-Ⅱ", "GSM-R"} <= set(segmenter.vocabulary)
+    assert build_domain_vocabulary(None, None) == []
+
+
+def test_domain_terms_are_single_tokens(segmenter):
+    assert "WTZJ-Ⅱ" in segmenter.lcut("WTZJ-Ⅱ标准型CIR设备")
+    assert segmenter.lcut("GSM-R呼叫失败")[0] == "GSM-R"
+    assert segmenter.segment("a b") == "a   b"
+
+
+def test_search_mode_adds_dictionary_subwords(segmenter):
+    words = segmenter.lcut_for_search("WTZJ-Ⅱ标准型CIR设备")
+    assert words.index("标准") < words.index("标准型")
+    assert "WTZJ-Ⅱ" in words
+
+
+def test_global_jieba_is_untouched(segmenter):
+    segmenter.lcut("WTZJ-Ⅱ")
+    assert not jieba.re_han_default.match("Ⅱ")
+    assert "WTZJ-Ⅱ" not in jieba.lcut("WTZJ-Ⅱ")
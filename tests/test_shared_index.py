@@ -0,0 +1,83 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from middlewares.shared_index import SharedArrayStore, SharedIndexWatcher
+
+
+def publish(store: SharedArrayStore, version: str, value: int):
+    store.publish("index", version, {"values": np.full(4, value, dtype=np.int32)}, {"value": value})
+
+
+def version_dirs(store: SharedArrayStore) -> set[str]:
+    index_dir = os.path.join(store.root_dir, "index")
+    return {d for d in os.listdir(index_dir) if os.path.isdir(os.path.join(index_dir, d))}
+
+
+def test_publish_attach_republish_reattach(tmp_path):
+    store = SharedArrayStore(str(tmp_path), keep_versions=2)
+    publish(store, "v1", 1)
+    version, arrays, meta = store.attach("index")
+    assert (version, meta["value"]) == ("v1", 1)
+    assert arrays["values"].tolist() == [1, 1, 1, 1]
+
+    attached = []
+    watcher = SharedIndexWatcher(store, "index", lambda *args: attached.append(args), interval=0)
+    watcher.version = version
+
+    publish(store, "v2", 2)
+    assert store.current_version("index") == "v2"
+    watcher.maybe_refresh()
+    assert watcher.version == "v2"
+    new_version, new_arrays, new_meta = attached[-1]
+    assert (new_version, new_meta["value"]) == ("v2", 2)
+    assert new_arrays["values"].tolist() == [2, 2, 2, 2]
+    # 未切换的 worker 仍可读取上一版本
+    assert arrays["values"].tolist() == [1, 1, 1, 1]
+    assert store.attach("index", "v1") is not None
+
+    # 同版本再次发布只切换 CURRENT
+    publish(store, "v1", 99)
+    assert store.current_version("index") == "v1"
+    watcher.maybe_refresh()
+    assert watcher.version == "v1"
+    assert attached[-1][1]["values"].tolist() == [1, 1, 1, 1]
+
+
+def test_cleanup_keeps_previous_version(tmp_path):
+    store = SharedArrayStore(str(tmp_path), keep_versions=1)
+    publish(store, "v1", 1)
+    publish(store, "v2", 2)
+    assert version_dirs(store) == {"v1", "v2"}
+
+    store.keep_versions = 2
+    os.utime(os.path.join(store.root_dir, "index", "v1"), (1, 1))
+    publish(store, "v3", 3)
+    assert version_dirs(store) == {"v2", "v3"}
+    assert store.attach("index", "v1") is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="依赖 unlink 后 mmap 仍有效的 POSIX 语义")
+def test_deleted_version_stays_readable_while_mapped(tmp_path):
+    store = SharedArrayStore(str(tmp_path), keep_versions=2)
+    publish(store, "v1", 1)
+    _, arrays, _ = store.attach("index")
+    os.utime(os.path.join(store.root_dir, "index", "v1"), (1, 1))
+    publish(store, "v2", 2)
+    publish(store, "v3", 3)
+    assert "v1" not in version_dirs(store)
+    assert arrays["values"].tolist() == [1, 1, 1, 1]
+
+
+def test_attach_returns_none_when_version_removed_midway(tmp_path):
+    store = SharedArrayStore(str(tmp_path))
+    publish(store, "v1", 1)
+    os.remove(os.path.join(store.root_dir, "index", "v1", "values.npy"))
+    assert store.attach("index") is None
+
+    attached = []
+    watcher = SharedIndexWatcher(store, "index", lambda *args: attached.append(args), interval=0)
+    watcher.maybe_refresh()
+    assert attached == [] and watcher.version is None
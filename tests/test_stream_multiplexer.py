@@ -0,0 +1,62 @@
+import uuid
+import asyncio
+import pytest
+from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi.testclient import TestClient
+from middlewares.message_queue import event_bus
+from middlewares.stream_registry import stream_registry
+from middlewares.stream_multiplexer import MultiplexedConnection
+
+
+async def start_answer(websocket: WebSocket, message: dict) -> tuple[str, asyncio.Task | None]:
+    question = message.get("question")
+    if question == "busy":
+        raise HTTPException(status_code=429, detail="Server busy", headers={"Retry-After": "3"})
+    if question == "broken":
+        raise ConnectionError("upstream unreachable")
+    stream_id = f"ws-{question}-{uuid.uuid4().hex}"
+    await event_bus.open(stream_id)
+    stream_registry.open(stream_id)
+    await event_bus.publish(stream_id, ("plain_text", question))
+    await event_bus.publish(stream_id, ("end", ""))
+    return stream_id, None
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket):
+        await MultiplexedConnection(websocket, start_answer).run()
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_failed_ask_is_reported_on_its_ref_and_socket_stays_open(client):
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"op": "ask", "ref": 1, "question": "broken"})
+        assert ws.receive_json() == {"op": "error", "ref": 1, "status": 500, "detail": "Failed to start answer"}
+        ws.send_json({"op": "ask", "ref": 2, "question": "busy"})
+        error = ws.receive_json()
+        assert error["ref"] == 2 and error["status"] == 429 and error["retry_after"] == "3"
+        ws.send_json({"op": "ask", "ref": 3, "question": "ok"})
+        opened = ws.receive_json()
+        assert opened["op"] == "opened" and opened["ref"] == 3 and opened["stream_id"].startswith("ws-ok-")
+        event = ws.receive_json()
+        assert event["op"] == "event" and event["data"] == {"type": "plain_text", "text": "ok"}
+        assert ws.receive_json()["op"] == "end"
+
+
+def test_malformed_messages_keep_the_socket_open(client):
+    with client.websocket_connect("/ws") as ws:
+        ws.send_bytes(b"\x00")
+        assert ws.receive_json()["detail"] == "Binary frames are not supported"
+        ws.send_text("{bad")
+        assert ws.receive_json()["detail"] == "Invalid JSON message"
+        ws.send_json({"op": "ack", "stream_id": "x", "id": "nan"})
+        ws.send_json({"op": "attach", "stream_id": "missing", "last_event_id": "x"})
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"op": "attach", "stream_id": "missing"})
+        assert ws.receive_json()["status"] == 404
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import pytest
+from middlewares.stream_registry import StreamBuffer, StreamGapError, format_event, format_gap_event
+
+
+async def collect(buffer: StreamBuffer, last_event_id: int = 0) -> list[tuple[int, str]]:
+    return [event async for event in buffer.follow(last_event_id)]
+
+
+def test_follow_resumes_after_last_event_id():
+    buffer = StreamBuffer("s", max_bytes=1024)
+    for text in ("a", "b", "c"):
+        buffer.append(text)
+    buffer.finish()
+    assert asyncio.run(collect(buffer)) == [(1, "a"), (2, "b"), (3, "c")]
+    assert asyncio.run(collect(buffer, 2)) == [(3, "c")]
+    assert asyncio.run(collect(buffer, 3)) == []
+
+
+def test_evicted_events_cannot_be_resumed():
+    buffer = StreamBuffer("s", max_bytes=2)
+    for text in ("a", "b", "c", "d"):
+        buffer.append(text)
+    assert buffer.first_id == 3
+    assert not buffer.can_resume(0) and not buffer.can_resume(1)
+    assert buffer.can_resume(2) and buffer.can_resume(4)
+    buffer.finish()
+    assert asyncio.run(collect(buffer, 2)) == [(3, "c"), (4, "d")]
+
+
+def test_follow_waits_for_new_events():
+    async def scenario():
+        buffer = StreamBuffer("s", max_bytes=1024)
+        buffer.append("a")
+        reader = asyncio.create_task(collect(buffer))
+        await asyncio.sleep(0)
+        buffer.append("b")
+        await asyncio.sleep(0)
+        buffer.append("c")
+        buffer.finish()
+        return await reader
+
+    assert asyncio.run(scenario()) == [(1, "a"), (2, "b"), (3, "c")]
+
+
+def test_slow_reader_gets_gap_instead_of_skipping():
+    async def scenario():
+        buffer = StreamBuffer("s", max_bytes=2)
+        buffer.append("a")
+        reader = buffer.follow(0)
+        assert await reader.__anext__() == (1, "a")
+        # 读取方暂停期间缓冲淘汰了 2、3
+        for text in ("b", "c", "d", "e"):
+            buffer.append(text)
+        with pytest.raises(StreamGapError) as e:
+            await reader.__anext__()
+        return e.value.first_id
+
+    assert asyncio.run(scenario()) == 4
+
+
+def test_gap_event_is_named_sse_event():
+    frame = format_gap_event(4)
+    assert frame.startswith("event: gap\n") and frame.endswith("\n\n")
+    assert json.loads(frame.splitlines()[1][6:]) == {"type": "gap", "first_id": 4}
+
+
+def test_is_duplicate_only_for_dedup_types():
+    buffer = StreamBuffer("s", max_bytes=1024)
+    images = format_event(("images", json.dumps(["/images/a.png"])))
+    assert not buffer.is_duplicate("images", images)
+    assert buffer.is_duplicate("images", images)
+    assert not buffer.is_duplicate("images", format_event(("images", json.dumps(["/images/b.png"]))))
+    text = format_event(("plain_text", "同一句话"))
+    assert not buffer.is_duplicate("plain_text", text)
+    assert not buffer.is_duplicate("plain_text", text)
+
+
+def test_claim_returns_only_unseen_keys_in_order():
+    buffer = StreamBuffer("s", max_bytes=1024)
+    assert buffer.claim("images", ["b", "a", "b"]) == ["b", "a"]
+    assert buffer.claim("images", ["a", "c"]) == ["c"]
+    assert buffer.claim("triples", ["a"]) == ["a"]
@@ -0,0 +1,227 @@
+"""
+本地 Dify 替身服务，用于离线联调与压测：
+- POST /v1/files/upload      返回伪造的文件 id
+- POST /v1/chat-messages     以可配置的 token 速率流式输出 think / plain_text / echarts 消息，
+                             节点 id 取自 DIFY_MESSAGE_CONFIG，并按真实工作流回调
+                             /query-to-image 与 /keywords-to-graph
+- POST /v1/embeddings        兼容 OpenAI 接口的 embedding 替身（DashScope compatible-mode），向量由文本确定
+- PUT  /faults               运行时调整故障注入，如 {"error_rate": 1.0}，用于验证重试、对冲与熔断
+
+故障注入：按 --fault-targets 指定的接口，以 --error-rate 概率返回 503，以 --slow-rate 概率额外等待 --slow-latency 秒
+
+用法（项目根目录）：
+    python tools/fake_dify.py --port 8081 --callback-base http://127.0.0.1:7999 --token-rate 50
+    然后将 .env 中 DIFY_BASE_URL 指向 http://127.0.0.1:8081/v1（验证 embedding 时 DASHSCOPE_BASE_URL 同样指向该地址）
+    python tools/fake_dify.py --embedding-latency 0.05 --slow-rate 0.1 --slow-latency 2 --error-rate 0.05
+"""
+import os
+import sys
+import json
+import uuid
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import aiohttp
+import uvicorn
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, JSONResponse
+
+ECHARTS_SAMPLE = {
+    "title": {"text": "fake"},
+    "xAxis": {"type": "category", "data": ["A", "B", "C"]},
+    "yAxis": {"type": "value"},
+    "series": [{"type": "bar", "data": [1, 2, 3]}],
+}
+ANSWER_SAMPLE = "CIR设备在进出GSM-R区段不能自动注册时，应先确认车次号是否正确，再按调度员指示操作。"
+
+
+class FakeDifyConfig:
+    def __init__(self, args):
+        with open(args.message_config, "r", encoding="UTF8") as f:
+            messages = json.load(f)["messages"]
+        self.think_nodes = messages.get("think", [])
+        self.text_nodes = messages.get("plain_text", [])
+        self.echarts_nodes = messages.get("echarts", [])
+        self.token_rate = args.token_rate
+        self.think_tokens = args.think_tokens
+        self.answer_tokens = args.answer_tokens
+        self.first_event_delay = args.first_event_delay
+        self.callback_base = args.callback_base.rstrip("/") if args.callback_base else ""
+        self.keywords = [k for k in args.keywords.split(",") if k]
+        self.embedding_latency = args.embedding_latency
+        self.fault_targets = {t for t in args.fault_targets.split(",") if t}
+        self.error_rate = args.error_rate
+        self.slow_rate = args.slow_rate
+        self.slow_latency = args.slow_latency
+
+    async def inject_fault(self, target: str) -> JSONResponse | None:
+        """
+        按配置对目标接口注入延迟或错误，返回非空时直接作为响应
+        """
+        if target not in self.fault_targets:
+            return None
+        if random.random() < self.slow_rate:
+            await asyncio.sleep(self.slow_latency)
+        if random.random() < self.error_rate:
+            return JSONResponse({"code": "service_unavailable", "message": "injected fault"}, status_code=503)
+        return None
+
+
+def sse(payload: dict) -> bytes:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def fake_embedding(text: str, dimensions: int) -> list[float]:
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def tokens(count: int):
+    for i in range(count):
+        yield ANSWER_SAMPLE[i % len(ANSWER_SAMPLE)]
+
+
+def build_app(config: FakeDifyConfig) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.session = aiohttp.ClientSession()
+        try:
+            yield
+        finally:
+            await app.state.session.close()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.put("/faults")
+    async def update_faults(request: Request):
+        body = await request.json()
+        for key in ("error_rate", "slow_rate", "slow_latency", "embedding_latency"):
+            if key in body:
+                setattr(config, key, float(body[key]))
+        if "fault_targets" in body:
+            config.fault_targets = set(body["fault_targets"])
+        return {key: getattr(config, key) for key in ("error_rate", "slow_rate", "slow_latency",
+                                                      "embedding_latency")}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        fault = await config.inject_fault("embeddings")
+        if fault is not None:
+            return fault
+        await asyncio.sleep(config.embedding_latency)
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = int(body.get("dimensions") or 1024)
+        return {"object": "list", "model": body.get("model", "text-embedding-v4"),
+                "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+                         for i, text in enumerate(texts)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    @app.post("/v1/files/upload")
+    async def files_upload(request: Request):
+        await request.body()
+        fault = await config.inject_fault("files")
+        if fault is not None:
+            return fault
+        return {"id": uuid.uuid4().hex, "name": "upload", "created_at": int(time.time())}
+
+    async def callback(session: aiohttp.ClientSession, path: str, body: dict):
+        if not config.callback_base:
+            return
+        try:
+            async with session.post(f"{config.callback_base}/api/qa/{path}", json=body) as resp:
+                await resp.read()
+        except aiohttp.ClientError as e:
+            print(f"callback {path} failed: {e}")
+
+    @app.post("/v1/chat-messages")
+    async def chat_messages(request: Request):
+        body = await request.json()
+        fault = await config.inject_fault("chat-messages")
+        if fault is not None:
+            return fault
+        query = body.get("query", "")
+        stream_id = body.get("inputs", {}).get("stream_id", "")
+        session = request.app.state.session
+        interval = 1 / config.token_rate if config.token_rate > 0 else 0
+        conversation_id = uuid.uuid4().hex
+        message_id = uuid.uuid4().hex
+
+        def message(node_id: str, answer: str) -> bytes:
+            return sse({"event": "message", "conversation_id": conversation_id, "message_id": message_id,
+                        "answer": answer, "from_variable_selector": [node_id, "text"]})
+
+        def node_finished(node_id: str, started: float) -> bytes:
+            return sse({"event": "node_finished", "data": {"node_id": node_id, "node_type": "llm",
+                                                            "status": "succeeded",
+                                                            "elapsed_time": time.perf_counter() - started}})
+
+        async def stream():
+            await asyncio.sleep(config.first_event_delay)
+            yield sse({"event": "workflow_started", "conversation_id": conversation_id})
+            for node_id in config.think_nodes[:1]:
+                started = time.perf_counter()
+                yield sse({"event": "node_started", "data": {"node_id": node_id, "node_type": "llm"}})
+                for token in tokens(config.think_tokens):
+                    yield message(node_id, token)
+                    await asyncio.sleep(interval)
+                yield node_finished(node_id, started)
+
+            # 与真实工作流一致：检索阶段回调图片与图谱接口
+            await asyncio.gather(
+                callback(session, "query-to-image", {"questions": [query], "stream_id": stream_id}),
+                callback(session, "keywords-to-graph", {"keywords": config.keywords or [query], "title": query,
+                                                        "stream_id": stream_id}),
+            )
+
+            for node_id in config.text_nodes[:1]:
+                started = time.perf_counter()
+                yield sse({"event": "node_started", "data": {"node_id": node_id, "node_type": "llm"}})
+                for token in tokens(config.answer_tokens):
+                    yield message(node_id, token)
+                    await asyncio.sleep(interval)
+                yield node_finished(node_id, started)
+            for node_id in config.echarts_nodes[:1]:
+                yield message(node_id, f"```echarts\n{json.dumps(ECHARTS_SAMPLE, ensure_ascii=False)}\n```")
+            yield sse({"event": "message_end", "conversation_id": conversation_id, "message_id": message_id})
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--message-config", default=os.getenv("DIFY_MESSAGE_CONFIG", "configs/nodetype_config.json"))
+    parser.add_argument("--token-rate", type=float, default=50, help="每秒输出的 token 数，0 表示不限速")
+    parser.add_argument("--think-tokens", type=int, default=20)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--first-event-delay", type=float, default=0.3, help="首个事件前的等待（秒）")
+    parser.add_argument("--callback-base", default=f"http://127.0.0.1:{os.getenv('PORT', 7999)}",
+                        help="被测服务地址，置空则不回调")
+    parser.add_argument("--keywords", default="CIR,GSM-R", help="回调 /keywords-to-graph 的关键字，逗号分隔")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="embedding 接口的基础耗时（秒）")
+    parser.add_argument("--fault-targets", default="embeddings,chat-messages,files",
+                        help="注入故障的接口，逗号分隔：embeddings / chat-messages / files")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的概率")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="额外等待 --slow-latency 的概率（模拟长尾）")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="长尾请求的额外等待（秒）")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    uvicorn.run(build_app(FakeDifyConfig(args)), host=args.host, port=args.port)
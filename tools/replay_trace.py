@@ -0,0 +1,90 @@
+"""
+回放 /ask 事件轨迹：按记录的时间间隔把事件推入队列，经 stream_generator 输出 SSE，
+用于离线复现与基准测试流式行为（无需 Dify）
+
+用法（项目根目录）：
+    python tools/replay_trace.py logs/stream_traces.jsonl --index -1 --speed 10
+    python tools/replay_trace.py logs/stream_traces.jsonl --trace-id <id> --speed 0 --quiet
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from endpoints.v1 import stream_generator
+from middlewares.message_queue import event_bus
+from middlewares.stream_registry import stream_registry
+from middlewares.stream_trace import load_traces
+
+
+async def feed(trace: dict, speed: float, stream_id: str):
+    """
+    按原始时间轴（除以 speed）推入事件；speed<=0 表示不等待
+    """
+    start = time.perf_counter()
+    for event in trace["events"]:
+        item = event.get("item")
+        if item is None:
+            continue
+        if speed > 0:
+            delay = event["t"] / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await event_bus.publish(stream_id, tuple(item))
+
+
+async def replay(trace: dict, speed: float, quiet: bool) -> dict:
+    stream_id = f"replay-{trace['trace_id']}"
+    await event_bus.open(stream_id)
+    stream_registry.open(stream_id)
+    feeder = asyncio.create_task(feed(trace, speed, stream_id))
+    start = time.perf_counter()
+    first_frame = None
+    frames = 0
+    sent_bytes = 0
+    async for frame in stream_generator(stream_id):
+        now = time.perf_counter() - start
+        if first_frame is None:
+            first_frame = now
+        frames += 1
+        sent_bytes += len(frame.encode("utf-8"))
+        if not quiet:
+            print(f"[{now:8.3f}s] {frame.strip()[:120]}")
+    await feeder
+    return {
+        "trace_id": trace["trace_id"],
+        "speed": speed,
+        "recorded_seconds": trace["events"][-1]["t"] if trace["events"] else 0,
+        "replay_seconds": round(time.perf_counter() - start, 4),
+        "first_frame_seconds": round(first_frame or 0, 4),
+        "frames": frames,
+        "bytes": sent_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default=os.getenv("STREAM_TRACE_PATH", "logs/stream_traces.jsonl"))
+    parser.add_argument("--trace-id", default=None)
+    parser.add_argument("--index", type=int, default=-1, help="未指定 trace-id 时按序号选取，默认最后一条")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示尽可能快")
+    parser.add_argument("--quiet", action="store_true", help="只输出汇总")
+    args = parser.parse_args()
+
+    traces = load_traces(args.path)
+    if args.trace_id:
+        trace = next(t for t in traces if t["trace_id"] == args.trace_id)
+    else:
+        trace = traces[args.index]
+    print(json.dumps(asyncio.run(replay(trace, args.speed, args.quiet)), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()